@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+MAX_RELATIVE_EXPIRE = 60 * 60 * 24 * 30
+
+type Item = Tuple[bytes, int, int, float]
+
+
+class FakeMemcached:
+    """In-process memcached speaking the subset of the text protocol the
+    pairing cache handlers use: get, gets, set, add, replace, append, cas,
+    delete, incr, decr, touch, version and flush_all, with `noreply` where
+    memcached allows it.
+
+    While `down` is set every command is answered by closing the connection,
+    the way clients see a crashed node
+    """
+
+    def __init__(self):
+        self.items: Dict[bytes, Item] = dict()
+        self.down: bool = False
+        self._cas: Iterator[int] = itertools.count(1)
+        self.address: Tuple[str, int] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopping: asyncio.Event | None = None
+        self._thread: threading.Thread | None = None
+
+    def stop(self) -> None:
+        """Stop a server started by `serve_in_thread`; open connections are dropped"""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join(5)
+        self._thread = None
+
+    @staticmethod
+    def _deadline(expire: int) -> float:
+        if expire == 0:
+            return 0
+        if expire < 0:
+            return -1
+        if expire > MAX_RELATIVE_EXPIRE:
+            return float(expire)
+        return time.time() + expire
+
+    def _live(self, key: bytes) -> Item | None:
+        item = self.items.get(key)
+        if item is not None and item[3] and item[3] < time.time():
+            del self.items[key]
+            return None
+        return item
+
+    def _retrieve(self, keys: List[bytes], with_cas: bool) -> bytes:
+        out: List[bytes] = list()
+        for key in keys:
+            item = self._live(key)
+            if item is None:
+                continue
+            value, flags, cas, _ = item
+            suffix = b" %d" % cas if with_cas else b""
+            out.append(
+                b"VALUE %s %d %d%s\r\n%s\r\n" % (key, flags, len(value), suffix, value)
+            )
+        out.append(b"END\r\n")
+        return b"".join(out)
+
+    def _store(self, command: bytes, parts: List[bytes], value: bytes) -> bytes:
+        key, flags, expire = parts[1], int(parts[2]), int(parts[3])
+        current = self._live(key)
+        match command:
+            case b"add" if current is not None:
+                return b"NOT_STORED"
+            case b"replace" if current is None:
+                return b"NOT_STORED"
+            case b"cas" if current is None:
+                return b"NOT_FOUND"
+            case b"cas" if current[2] != int(parts[5]):
+                return b"EXISTS"
+            case b"append" if current is None:
+                return b"NOT_STORED"
+            case b"append":
+                # Appends keep the item's flags and expiry
+                self.items[key] = (
+                    current[0] + value,
+                    current[1],
+                    next(self._cas),
+                    current[3],
+                )
+                return b"STORED"
+        self.items[key] = (value, flags, next(self._cas), self._deadline(expire))
+        return b"STORED"
+
+    def _counter(self, command: bytes, key: bytes, delta: int) -> bytes:
+        item = self._live(key)
+        if item is None:
+            return b"NOT_FOUND"
+        if command == b"incr":
+            value = (int(item[0]) + delta) % 2**64
+        else:
+            # decr stops at zero instead of wrapping
+            value = max(0, int(item[0]) - delta)
+        self.items[key] = (b"%d" % value, item[1], next(self._cas), item[3])
+        return b"%d" % value
+
+    def _touch(self, key: bytes, expire: int) -> bytes:
+        item = self._live(key)
+        if item is None:
+            return b"NOT_FOUND"
+        self.items[key] = (item[0], item[1], item[2], self._deadline(expire))
+        return b"TOUCHED"
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                parts = (await reader.readuntil(b"\r\n"))[:-2].split()
+                if self.down:
+                    self.items.clear()
+                    return
+                if not parts:
+                    continue
+                command, noreply = parts[0], parts[-1] == b"noreply"
+                match command:
+                    case b"get" | b"gets":
+                        reply = self._retrieve(parts[1:], command == b"gets")
+                    case b"set" | b"add" | b"replace" | b"append" | b"cas":
+                        value = (await reader.readexactly(int(parts[4]) + 2))[:-2]
+                        reply = self._store(command, parts, value) + b"\r\n"
+                    case b"delete":
+                        found = self.items.pop(parts[1], None) is not None
+                        reply = b"DELETED\r\n" if found else b"NOT_FOUND\r\n"
+                    case b"incr" | b"decr":
+                        reply = (
+                            self._counter(command, parts[1], int(parts[2])) + b"\r\n"
+                        )
+                    case b"touch":
+                        reply = self._touch(parts[1], int(parts[2])) + b"\r\n"
+                    case b"version":
+                        reply = b"VERSION fake\r\n"
+                    case b"flush_all":
+                        self.items.clear()
+                        reply = b"OK\r\n"
+                    case _:
+                        reply, noreply = b"ERROR\r\n", False
+                if not noreply:
+                    writer.write(reply)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def serve_in_thread(host: str = "127.0.0.1", port: int = 11211) -> FakeMemcached:
+    """Start a FakeMemcached on its own event loop thread and wait until it listens.
+
+    The blocking pymemcache client used at startup must not share a loop with
+    the server, hence the dedicated thread
+    """
+    fake = FakeMemcached()
+    fake.address = (host, port)
+    listening = threading.Event()
+
+    async def run() -> None:
+        server = await asyncio.start_server(fake.handle, host, port)
+        fake._loop, fake._stopping = asyncio.get_running_loop(), asyncio.Event()
+        listening.set()
+        await fake._stopping.wait()
+        server.close()
+
+    fake._thread = threading.Thread(target=lambda: asyncio.run(run()), daemon=True)
+    fake._thread.start()
+    if not listening.wait(5):
+        raise RuntimeError(f"Fake memcached did not start on {host}:{port}")
+    return fake
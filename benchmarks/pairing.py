@@ -0,0 +1,1022 @@
+"""Pairing lifecycle benchmark.
+
+Drives `djMirror.asgi.application` in-process through initialize, complete,
+remaining, refresh and device toggle for N simulated device pairs, against
+fake memcached nodes on 127.0.0.1:11211 and up, then measures TTLTaskQueue
+costs as the number of live pairings grows. Results are printed (or written)
+as JSON:
+
+    python -m benchmarks.pairing --pairs 1000 --output bench.json
+
+The mirroring section holds a playback stream open per mirror and times how
+long play and seek commands take to reach them. The clock skew section syncs
+simulated devices with skewed clocks over jittery links and reports how far
+apart their scheduled starts land. The provisioning section sets up venues
+of many screens one request per screen and then through the batch endpoints.
+The groups section times joining, leaving and availability updates of group
+pairings already holding 2 to 200 receivers, next to joining a one-to-one
+pairing that has grown to the same size. The device fan-out section toggles
+and then removes a device that is in tens to hundreds of pairings.
+The overload section bursts initialize past the per-address rate limit and
+the live pairing capacity to time the shed responses. The codec section times
+request decoding and response encoding per call. The warm restart section
+snapshots live pairings to disk and times how long a fresh handler takes to
+validate them against memcached and restore them.
+`--nodes 3 --fail-node` spreads the cache over three stand-ins and then takes
+the last one down mid-run to measure failover and re-admission.
+"""
+
+import argparse
+import asyncio
+import gc
+import heapq
+import logging
+import os
+import platform
+import random
+import resource
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import orjson
+
+from core.pairing.clock import ClockSample, estimate_offset
+
+from .fake_memcached import FakeMemcached, serve_in_thread
+
+type Scenario = Callable[[int], Awaitable[int]]
+
+ENDPOINTS = ["initialize", "complete", "remaining", "refresh", "device_toggle"]
+TTL_SCALES = [1_000, 10_000, 100_000]
+RESTORE_SCALES = [10_000, 100_000]
+CLOCK_JITTER_MS = [0, 5, 20]
+CLOCK_SAMPLES = [1, 4, 8, 16]
+GROUP_SIZES = [2, 10, 50, 200]
+FANOUT_SCALES = [10, 100, 500]
+# One-way network delay before jitter, and the spread of device clocks
+BASE_DELAY_MS = 2
+CLOCK_SPREAD_MS = 2000
+
+
+async def call(
+    app, method: str, path: str, body: bytes = b"", query: bytes = b""
+) -> Tuple[int, bytes]:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    disconnect = asyncio.Event()
+    status, chunks = 0, list()
+
+    async def receive() -> Dict[str, Any]:
+        if messages:
+            return messages.pop()
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                disconnect.set()
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+async def listen(
+    app, path: str, query: bytes, on_chunk: Callable[[bytes], None]
+) -> asyncio.Event:
+    """Open a streaming GET, passing every body chunk to `on_chunk`; setting
+    the returned event disconnects it
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    disconnect, opened = asyncio.Event(), asyncio.Event()
+
+    async def receive() -> Dict[str, Any]:
+        if messages:
+            return messages.pop()
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.body":
+            on_chunk(message.get("body", b""))
+            opened.set()
+
+    asyncio.create_task(app(scope, receive, send))
+    await opened.wait()
+    return disconnect
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def max_rss_kib() -> int:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+async def measure(scenario: Scenario, count: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = list()
+    statuses: Dict[int, int] = dict()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(index: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            status = await scenario(index)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    gc.collect()
+    rss_before = max_rss_kib()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(index) for index in range(count)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "requests": count,
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "throughput_rps": round(count / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1e3, 3),
+            "p99": round(percentile(latencies, 0.99) * 1e3, 3),
+            "mean": round(statistics.fmean(latencies) * 1e3, 3),
+            "max": round(max(latencies) * 1e3, 3),
+        },
+        "max_rss_growth_kib": max_rss_kib() - rss_before,
+    }
+    if tracemalloc.is_tracing():
+        result["traced_growth_kib"] = (
+            tracemalloc.get_traced_memory()[0] - traced_before
+        ) // 1024
+    return result
+
+
+async def lifecycle(pairs: int, concurrency: int) -> Dict[str, Any]:
+    from djMirror.asgi import application
+
+    from core.pairing.apps import PairingConfig
+
+    initiators = [str(uuid.uuid4()) for _ in range(pairs)]
+    joiners = [str(uuid.uuid4()) for _ in range(pairs)]
+    tokens: List[str] = [""] * pairs
+
+    async def initialize(i: int) -> int:
+        status, body = await call(
+            application,
+            "POST",
+            "/pairing/initialize/",
+            orjson.dumps({"deviceId": initiators[i]}),
+        )
+        if status == 200:
+            tokens[i] = orjson.loads(body)["token"]
+        return status
+
+    async def complete(i: int) -> int:
+        payload = {"token": tokens[i], "device": {"deviceId": joiners[i]}}
+        status, _ = await call(
+            application, "POST", "/pairing/complete/", orjson.dumps(payload)
+        )
+        return status
+
+    async def remaining(i: int) -> int:
+        query = b"token=" + tokens[i].encode()
+        status, _ = await call(application, "GET", "/pairing/remaining/", query=query)
+        return status
+
+    async def refresh(i: int) -> int:
+        payload = {"token": tokens[i], "device": {"deviceId": initiators[i]}}
+        status, body = await call(
+            application, "POST", "/pairing/refresh/", orjson.dumps(payload)
+        )
+        if status == 200:
+            tokens[i] = orjson.loads(body)["token"]
+        return status
+
+    async def device_toggle(i: int) -> int:
+        status, _ = await call(
+            application,
+            "PUT",
+            "/pairing/device/toggle/",
+            orjson.dumps({"deviceId": joiners[i]}),
+        )
+        return status
+
+    processor = asyncio.create_task(PairingConfig.ttl_task_queue.process())
+    scenarios = [initialize, complete, remaining, refresh, device_toggle]
+    results = {
+        name: await measure(scenario, pairs, concurrency)
+        for name, scenario in zip(ENDPOINTS, scenarios)
+    }
+    PairingConfig.ttl_task_queue.shutdown()
+    await processor
+    return results
+
+
+async def mirroring(mirrors: int, rounds: int, concurrency: int) -> Dict[str, Any]:
+    """Pair `mirrors` sources with one destination each, hold every playback
+    stream open and time how long published commands take to reach them
+    """
+    from djMirror.asgi import application
+
+    sources = [str(uuid.uuid4()) for _ in range(mirrors)]
+    destinations = [str(uuid.uuid4()) for _ in range(mirrors)]
+    tokens: List[str] = [""] * mirrors
+    # (mirror, seq) -> when the command was sent / when its event arrived
+    published: Dict[Tuple[int, int], float] = dict()
+    delivered: Dict[Tuple[int, int], float] = dict()
+
+    async def pair(i: int) -> int:
+        _, body = await call(
+            application,
+            "POST",
+            "/pairing/initialize/",
+            orjson.dumps({"deviceId": sources[i]}),
+        )
+        tokens[i] = orjson.loads(body)["token"]
+        payload = {"token": tokens[i], "device": {"deviceId": destinations[i]}}
+        status, _ = await call(
+            application, "POST", "/pairing/complete/", orjson.dumps(payload)
+        )
+        return status
+
+    def receiver(i: int) -> Callable[[bytes], None]:
+        def on_chunk(chunk: bytes) -> None:
+            arrived = time.perf_counter()
+            for line in chunk.split(b"\n"):
+                if line.startswith(b"data: "):
+                    delivered[(i, orjson.loads(line[6:])["seq"])] = arrived
+
+        return on_chunk
+
+    async def start(i: int) -> int:
+        payload = {
+            "pairToken": tokens[i],
+            "node": {"deviceId": sources[i]},
+            "shareUrl": f"https://example.com/watch?v={i}",
+        }
+        published[(i, 1)] = time.perf_counter()
+        status, _ = await call(
+            application, "POST", "/pairing/playback/start/", orjson.dumps(payload)
+        )
+        return status
+
+    def command(seq: int, action: str) -> Scenario:
+        async def send(i: int) -> int:
+            payload = {
+                "pairToken": tokens[i],
+                "node": {"deviceId": sources[i]},
+                "action": action,
+                "position": float(seq),
+            }
+            published[(i, seq)] = time.perf_counter()
+            status, _ = await call(
+                application, "POST", "/pairing/playback/", orjson.dumps(payload)
+            )
+            return status
+
+        return send
+
+    await measure(pair, mirrors, concurrency)
+    streams = [
+        await listen(
+            application,
+            "/pairing/playback/events/",
+            f"token={tokens[i]}&deviceId={destinations[i]}".encode(),
+            receiver(i),
+        )
+        for i in range(mirrors)
+    ]
+    results = {"start": await measure(start, mirrors, concurrency)}
+    for seq in range(2, rounds + 2):
+        action = "seek" if seq % 2 else "play"
+        results[f"{action}_{seq}"] = await measure(
+            command(seq, action), mirrors, concurrency
+        )
+    await asyncio.sleep(0.1)
+    [disconnect.set() for disconnect in streams]
+    latencies = [
+        delivered[key] - sent for key, sent in published.items() if key in delivered
+    ]
+    results["delivery"] = {
+        "mirrors": mirrors,
+        "published": len(published),
+        "delivered": len(latencies),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1e3, 3),
+            "p99": round(percentile(latencies, 0.99) * 1e3, 3),
+            "max": round(max(latencies) * 1e3, 3),
+        },
+    }
+    return results
+
+
+async def clock_skew(
+    devices: int, samples: int, jitter_ms: float, concurrency: int
+) -> Dict[str, Any]:
+    """Devices with clocks up to CLOCK_SPREAD_MS off sync against
+    /pairing/clock/ over links adding exponentially distributed delay, each
+    direction drawn separately. A device starts a scheduled command when its
+    clock, corrected by the estimated offset, reads the command's time, so
+    the start lands `error` ms away from it in server time; skew compares
+    the starts of device pairs
+    """
+    from djMirror.asgi import application
+
+    rng = random.Random(jitter_ms * 1000 + samples)
+    skews = [rng.uniform(-CLOCK_SPREAD_MS, CLOCK_SPREAD_MS) for _ in range(devices)]
+    errors: List[float] = [0.0] * devices
+
+    def delay() -> float:
+        extra = rng.expovariate(1 / jitter_ms) if jitter_ms else 0
+        return (BASE_DELAY_MS + extra) / 1e3
+
+    async def sync(i: int) -> int:
+        collected: List[ClockSample] = list()
+        for _ in range(samples):
+            t0 = time.time() * 1e3 + skews[i]
+            await asyncio.sleep(delay())
+            status, body = await call(
+                application, "GET", "/pairing/clock/", query=b"t0=%f" % t0
+            )
+            await asyncio.sleep(delay())
+            reply = orjson.loads(body)
+            collected.append(
+                ClockSample(t0, reply["t1"], reply["t2"], time.time() * 1e3 + skews[i])
+            )
+        offset, _ = estimate_offset(collected)
+        errors[i] = offset + skews[i]
+        return status
+
+    result = await measure(sync, devices, concurrency)
+    pairs = [abs(errors[i] - errors[i + 1]) for i in range(0, devices - 1, 2)]
+    return {
+        "devices": devices,
+        "samples": samples,
+        "jitter_ms": jitter_ms,
+        "sync_ms_p50": result["latency_ms"]["p50"],
+        "offset_error_ms": {
+            "p50": round(percentile([abs(e) for e in errors], 0.50), 3),
+            "p99": round(percentile([abs(e) for e in errors], 0.99), 3),
+        },
+        "pair_skew_ms": {
+            "p50": round(percentile(pairs, 0.50), 3),
+            "p99": round(percentile(pairs, 0.99), 3),
+            "max": round(max(pairs), 3),
+        },
+    }
+
+
+async def initialize_new_device(_: int) -> int:
+    from djMirror.asgi import application
+
+    status, _ = await call(
+        application,
+        "POST",
+        "/pairing/initialize/",
+        orjson.dumps({"deviceId": str(uuid.uuid4())}),
+    )
+    return status
+
+
+async def provisioning(venues: int, screens: int, concurrency: int) -> Dict[str, Any]:
+    """Provision `venues` venues of `screens` screens: a pairing per screen and
+    a ttl check of every token, one request per screen and then one batch
+    request each; last every screen joins a single venue pairing. Latencies
+    are per venue
+    """
+    from djMirror.asgi import application
+
+    async def individually(_: int) -> int:
+        tokens: List[str] = list()
+        for _ in range(screens):
+            status, body = await call(
+                application,
+                "POST",
+                "/pairing/initialize/",
+                orjson.dumps({"deviceId": str(uuid.uuid4())}),
+            )
+            tokens.append(orjson.loads(body)["token"])
+        for token in tokens:
+            status, _ = await call(
+                application,
+                "GET",
+                "/pairing/remaining/",
+                query=b"token=" + token.encode(),
+            )
+        return status
+
+    async def batched(_: int) -> int:
+        devices = [{"deviceId": str(uuid.uuid4())} for _ in range(screens)]
+        _, body = await call(
+            application,
+            "POST",
+            "/pairing/batch/initialize/",
+            orjson.dumps({"devices": devices}),
+        )
+        tokens = [pair["token"] for pair in orjson.loads(body)["pairings"]]
+        status, _ = await call(
+            application,
+            "POST",
+            "/pairing/batch/remaining/",
+            orjson.dumps({"tokens": tokens}),
+        )
+        return status
+
+    async def joined(_: int) -> int:
+        _, body = await call(
+            application,
+            "POST",
+            "/pairing/initialize/",
+            orjson.dumps({"deviceId": str(uuid.uuid4())}),
+        )
+        payload = {
+            "token": orjson.loads(body)["token"],
+            "devices": [{"deviceId": str(uuid.uuid4())} for _ in range(screens)],
+        }
+        status, _ = await call(
+            application, "POST", "/pairing/batch/complete/", orjson.dumps(payload)
+        )
+        return status
+
+    return {
+        "screens": screens,
+        "individual": dict(
+            await measure(individually, venues, concurrency),
+            requests_per_venue=2 * screens,
+        ),
+        "batch": dict(
+            await measure(batched, venues, concurrency), requests_per_venue=2
+        ),
+        "join": dict(await measure(joined, venues, concurrency), requests_per_venue=2),
+    }
+
+
+async def groups(sizes: List[int], joins: int) -> Dict[str, Any]:
+    """Per group size: `joins` receivers joining, leaving and reporting their
+    availability once the group already holds that many receivers, and the
+    same number of devices joining a pairing that grew to that size one by one.
+    Requests go one at a time so latencies track the group size alone
+    """
+    from djMirror.asgi import application
+
+    async def post(path: str, payload: Dict[str, Any], method: str = "POST") -> int:
+        status, _ = await call(application, method, path, orjson.dumps(payload))
+        return status
+
+    async def grown(size: int, group: bool) -> str:
+        source = {"deviceId": str(uuid.uuid4())}
+        if group:
+            _, body = await call(
+                application,
+                "POST",
+                "/pairing/group/initialize/",
+                orjson.dumps({"source": source, "capacity": size + joins}),
+            )
+        else:
+            _, body = await call(
+                application, "POST", "/pairing/initialize/", orjson.dumps(source)
+            )
+        token = orjson.loads(body)["token"]
+        for _ in range(size):
+            if group:
+                await post(
+                    "/pairing/group/join/",
+                    {"token": token, "device": {"deviceId": str(uuid.uuid4())}},
+                )
+            else:
+                await post(
+                    "/pairing/batch/complete/",
+                    {
+                        "token": token,
+                        "devices": [{"deviceId": str(uuid.uuid4())}],
+                        "openToJoin": True,
+                    },
+                )
+        return token
+
+    results: List[Dict[str, Any]] = list()
+    for size in sizes:
+        token = await grown(size, group=True)
+        members = [{"deviceId": str(uuid.uuid4())} for _ in range(joins)]
+
+        def member(path: str, method: str = "POST") -> Scenario:
+            return lambda index: post(
+                path, {"token": token, "device": members[index]}, method
+            )
+
+        join = await measure(member("/pairing/group/join/"), joins, 1)
+        for device in members:
+            device["available"] = True
+        available = await measure(member("/pairing/group/available/", "PUT"), joins, 1)
+        leave = await measure(member("/pairing/group/leave/"), joins, 1)
+        pairing = await grown(size, group=False)
+        rewrite = await measure(
+            lambda _: post(
+                "/pairing/batch/complete/",
+                {
+                    "token": pairing,
+                    "devices": [{"deviceId": str(uuid.uuid4())}],
+                    "openToJoin": True,
+                },
+            ),
+            joins,
+            1,
+        )
+        results.append(
+            {
+                "receivers": size,
+                "group_join": join,
+                "group_available": available,
+                "group_leave": leave,
+                "one_to_one_join": rewrite,
+            }
+        )
+    return {"joins": joins, "sizes": results}
+
+
+async def device_fanout(scales: List[int], rounds: int) -> Dict[str, Any]:
+    """Per scale: `rounds` devices each in that many pairings, one of them a
+    group, toggled twice and then removed through the endpoints. `applied`
+    checks every pairing saw each change
+    """
+    from django.apps import apps
+
+    from core.pairing.schema import Device, Pair, PairInner
+    from djMirror.asgi import application
+
+    handler = apps.get_app_config("cacheManager").async_cache_handler
+    results: List[Dict[str, Any]] = list()
+    for scale in scales:
+        devices = [Device() for _ in range(rounds)]
+        pairings = {
+            str(device.deviceId): [
+                PairInner(**Pair().model_dump(), nodes=[device, Device()])
+                for _ in range(scale - 1)
+            ]
+            + [
+                PairInner(
+                    **Pair().model_dump(),
+                    capacity=4,
+                    nodes=[Device(), device, Device()],
+                )
+            ]
+            for device in devices
+        }
+        await handler.set_pairings(
+            [pair for pairs in pairings.values() for pair in pairs]
+        )
+
+        def action(path: str, method: str) -> Scenario:
+            async def run(index: int) -> int:
+                status, _ = await call(
+                    application,
+                    method,
+                    path,
+                    orjson.dumps({"deviceId": str(devices[index].deviceId)}),
+                )
+                return status
+
+            return run
+
+        async def applied(deviceId: str, expected: bool | None) -> bool:
+            for pair in pairings[deviceId]:
+                nodes = [
+                    node
+                    for node in (await handler.get_pairing(pair.token)).nodes
+                    if str(node.deviceId) == deviceId
+                ]
+                if [node.available for node in nodes] != (
+                    [] if expected is None else [expected]
+                ):
+                    return False
+            return True
+
+        toggle = action("/pairing/device/toggle/", "PUT")
+        toggled = await measure(toggle, rounds, 1)
+        toggled_ok = all([await applied(deviceId, True) for deviceId in pairings])
+        toggled_back = await measure(toggle, rounds, 1)
+        removed = await measure(action("/pairing/device/remove/", "POST"), rounds, 1)
+        removed_ok = all([await applied(deviceId, None) for deviceId in pairings])
+        results.append(
+            {
+                "pairings": scale,
+                "toggle": dict(toggled, applied=toggled_ok),
+                "toggle_back": toggled_back,
+                "remove": dict(removed, applied=removed_ok),
+            }
+        )
+    return {"devices": rounds, "scales": results}
+
+
+async def overload(pairs: int, concurrency: int) -> Dict[str, Any]:
+    """Burst initialize from one address past its rate limit, then past the
+    live pairing capacity; nearly every request is shed, so the latencies are
+    those of the 429 and 503 responses
+    """
+    from core.pairing import admission
+    from core.pairing.apps import PairingConfig
+
+    queue = PairingConfig.ttl_task_queue
+    limiter = admission.ip_limiter
+    limiter.rate, limiter.burst = 50.0, 100.0
+    rate_limited = await measure(initialize_new_device, pairs, concurrency)
+    limiter.rate = 0
+    queue.capacity = queue._queue_length + pairs // 10
+    at_capacity = await measure(initialize_new_device, pairs, concurrency)
+    queue.capacity = 0
+    return {"rate_limited": rate_limited, "at_capacity": at_capacity}
+
+
+async def failover(fake: FakeMemcached, pairs: int, concurrency: int) -> Dict[str, Any]:
+    """Initialize pairings while one node is down, then time its re-admission"""
+    from django.apps import apps
+
+    client = apps.get_app_config("cacheManager").async_cache_handler.task_client
+
+    fake.down = True
+    node_down = await measure(initialize_new_device, pairs, concurrency)
+    ejected = [name for name, node in client.nodes.items() if not node.alive]
+    fake.down = False
+    started = time.perf_counter()
+    deadline = started + 3 * client.health_interval
+    while ejected and time.perf_counter() < deadline:
+        if all(client.nodes[name].alive for name in ejected):
+            break
+        await asyncio.sleep(0.05)
+    return {
+        "node_down": node_down,
+        "ejected": ejected,
+        "readmitted": all(client.nodes[name].alive for name in ejected),
+        "readmit_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+async def session(
+    pairs: int,
+    concurrency: int,
+    mirrors: int,
+    mirror_rounds: int,
+    clock_devices: int,
+    venues: int,
+    screens: int,
+    group_sizes: List[int],
+    group_joins: int,
+    fanout_scales: List[int],
+    failing: FakeMemcached | None,
+) -> Dict[str, Any]:
+    results = {
+        "endpoints": await lifecycle(pairs, concurrency),
+        "mirroring": await mirroring(mirrors, mirror_rounds, concurrency),
+        "clock_skew": [
+            await clock_skew(clock_devices, samples, jitter, concurrency)
+            for jitter in CLOCK_JITTER_MS
+            for samples in CLOCK_SAMPLES
+        ],
+        "provisioning": await provisioning(venues, screens, concurrency),
+        "groups": await groups(group_sizes, group_joins),
+        "device_fanout": await device_fanout(fanout_scales, 10),
+        "overload": await overload(pairs, concurrency),
+    }
+    if failing is not None:
+        results["failover"] = await failover(failing, pairs, concurrency)
+    return results
+
+
+def ttl_queue_costs(live: int, batch: int) -> Dict[str, Any]:
+    from core.pairing.schema import Pair
+    from core.pairing.tasks import TaskState, TTLTaskQueue
+
+    pairs = [Pair(ttl=600 + i % 600) for i in range(live)]
+    gc.collect()
+    tracemalloc.start()
+    traced = TTLTaskQueue()
+    [traced.register_task(pair) for pair in pairs]
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del traced
+
+    queue = TTLTaskQueue()
+    started = time.perf_counter()
+    [queue.register_task(pair) for pair in pairs]
+    register_seconds = time.perf_counter() - started
+
+    rounds = 1000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        queue._expire_due()
+        queue.next_expiry()
+    idle_tick_seconds = (time.perf_counter() - started) / rounds
+
+    # Backdate a batch of the live tasks so the next tick expires exactly them
+    now = time.monotonic()
+    for pair in pairs[:batch]:
+        state = queue.task_states[pair.token]
+        queue.task_states[pair.token] = TaskState(
+            startdt=state.startdt, deadline=now - 1, object=pair
+        )
+        heapq.heappush(queue.deadlines, (now - 1, pair.token))
+    started = time.perf_counter()
+    expired = queue._expire_due()
+    expire_seconds = time.perf_counter() - started
+
+    return {
+        "live_pairings": live,
+        "register_us": round(register_seconds / live * 1e6, 3),
+        "idle_tick_us": round(idle_tick_seconds * 1e6, 3),
+        "expired": len(expired),
+        "expire_batch_us": round(expire_seconds * 1e6, 1),
+        "expire_per_task_us": round(expire_seconds / max(1, len(expired)) * 1e6, 3),
+        "bytes_per_pairing": retained // live,
+    }
+
+
+def codec_costs(rounds: int) -> Dict[str, Any]:
+    """CPU per request body decoded and response encoded: parsing to a dict
+    and building or dumping models against the pre-built codecs
+    """
+    from core.pairing.schema import (
+        DEVICE_PAIRED,
+        Device,
+        Pair,
+        PairComplete,
+        PairInner,
+        decode,
+        encode,
+        pair_reply,
+    )
+
+    device = orjson.dumps({"deviceId": str(uuid.uuid4())})
+    token = secrets.token_urlsafe(36)
+    complete = orjson.dumps({"token": token, "device": orjson.loads(device)})
+    pair = PairInner(token=token, nodes=[Device(), Device()])
+    cases: Dict[str, Tuple[Callable[[], Any], Callable[[], Any]]] = {
+        "decode_device": (
+            lambda: Device(**orjson.loads(device)),
+            lambda: decode(Device, device),
+        ),
+        "decode_complete": (
+            lambda: PairComplete(**orjson.loads(complete)),
+            lambda: decode(PairComplete, complete),
+        ),
+        "encode_remaining": (
+            lambda: Pair(token=token, ttl=600).model_dump_json().encode(),
+            lambda: pair_reply(token, 600),
+        ),
+        "encode_pairing": (
+            lambda: pair.model_dump_json().encode(),
+            lambda: encode(pair),
+        ),
+        "error_body": (
+            lambda: orjson.dumps(
+                {"reason": "Device already in another pairing session"}
+            ),
+            lambda: DEVICE_PAIRED,
+        ),
+    }
+
+    def cpu_us(fn: Callable[[], Any]) -> float:
+        started = time.process_time()
+        for _ in range(rounds):
+            fn()
+        return (time.process_time() - started) / rounds * 1e6
+
+    results: Dict[str, Any] = dict()
+    for name, (before, after) in cases.items():
+        before_us, after_us = cpu_us(before), cpu_us(after)
+        results[name] = {
+            "before_us": round(before_us, 3),
+            "after_us": round(after_us, 3),
+            "saved_us": round(before_us - after_us, 3),
+        }
+    return results
+
+
+def warm_restart(live: int, path: Path) -> Dict[str, Any]:
+    from core.cacheManager.snapshot import PairingSnapshot, SnapshotEntry
+    from core.cacheManager.tasks import PAIRING_LIVE, CacheTaskHandler
+    from core.pairing.tasks import TTLTaskQueue
+
+    handler = CacheTaskHandler()
+    now = time.time()
+    entries = [
+        SnapshotEntry(
+            secrets.token_urlsafe(36),
+            now + 600 + i % 600,
+            [str(uuid.uuid4()), str(uuid.uuid4())],
+        )
+        for i in range(live)
+    ]
+    # Every tenth pairing ends while the process is down and must be skipped
+    markers = [
+        handler._pairing_key(entry.token) for i, entry in enumerate(entries) if i % 10
+    ]
+    for start in range(0, len(markers), 1000):
+        handler.task_client.set_many(
+            {key: PAIRING_LIVE for key in markers[start : start + 1000]}, expire=1200
+        )
+
+    snapshot = PairingSnapshot(path, 0, TTLTaskQueue(), dict())
+    started = time.perf_counter()
+    snapshot.write(entries)
+    write_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    loaded = snapshot.load()
+    load_seconds = time.perf_counter() - started
+
+    handler.ttl_task_queue = TTLTaskQueue()
+    handler.pairingIndex, handler.deviceIndex = dict(), dict()
+    started = time.perf_counter()
+    restored = handler.restore(loaded)
+    restore_seconds = time.perf_counter() - started
+    return {
+        "snapshotted": live,
+        "restored": restored,
+        "snapshot_bytes": path.stat().st_size,
+        "write_ms": round(write_seconds * 1e3, 1),
+        "load_ms": round(load_seconds * 1e3, 1),
+        "restore_ms": round(restore_seconds * 1e3, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument(
+        "--ttl-scales",
+        type=lambda v: [int(n) for n in v.split(",")],
+        default=TTL_SCALES,
+    )
+    parser.add_argument("--expire-batch", type=int, default=512)
+    parser.add_argument(
+        "--mirrors", type=int, default=1000, help="concurrent playback mirrors"
+    )
+    parser.add_argument(
+        "--mirror-rounds", type=int, default=4, help="commands sent to each mirror"
+    )
+    parser.add_argument(
+        "--clock-devices", type=int, default=200, help="devices syncing their clock"
+    )
+    parser.add_argument(
+        "--venues", type=int, default=20, help="venues provisioned at once"
+    )
+    parser.add_argument(
+        "--screens", type=int, default=100, help="screens provisioned per venue"
+    )
+    parser.add_argument(
+        "--group-sizes",
+        type=lambda v: [int(n) for n in v.split(",")],
+        default=GROUP_SIZES,
+        help="receivers already in a group pairing when the timed joins start",
+    )
+    parser.add_argument(
+        "--group-joins", type=int, default=50, help="devices joining per group size"
+    )
+    parser.add_argument(
+        "--fanout-scales",
+        type=lambda v: [int(n) for n in v.split(",")],
+        default=FANOUT_SCALES,
+        help="pairings a toggled and removed device is in",
+    )
+    parser.add_argument(
+        "--restore-scales",
+        type=lambda v: [int(n) for n in v.split(",")],
+        default=RESTORE_SCALES,
+    )
+    parser.add_argument(
+        "--codec-rounds",
+        type=int,
+        default=100_000,
+        help="calls timed per request decode and response encode",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="report traced allocations per endpoint (slows every request)",
+    )
+    parser.add_argument(
+        "--memcached",
+        action="store_true",
+        help="use the memcached servers in MEMCACHED_SERVERS instead of stand-ins",
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=1, help="fake memcached nodes to spread keys over"
+    )
+    parser.add_argument(
+        "--fail-node",
+        action="store_true",
+        help="take the last fake node down after the lifecycle and measure failover",
+    )
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    if args.fail_node and args.memcached:
+        parser.error("--fail-node needs the fake memcached nodes")
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    # Per-request INFO lines would dominate the measurements
+    logging.disable(logging.WARNING)
+    fakes: List[FakeMemcached] = list()
+    if not args.memcached:
+        ports = [11211 + n for n in range(args.nodes)]
+        fakes = [serve_in_thread(port=port) for port in ports]
+        os.environ["MEMCACHED_SERVERS"] = ",".join(
+            f"127.0.0.1:{port}" for port in ports
+        )
+    if args.trace_memory:
+        tracemalloc.start()
+
+    results = asyncio.run(
+        session(
+            args.pairs,
+            args.concurrency,
+            args.mirrors,
+            args.mirror_rounds,
+            args.clock_devices,
+            args.venues,
+            args.screens,
+            args.group_sizes,
+            args.group_joins,
+            args.fanout_scales,
+            fakes[-1] if args.fail_node else None,
+        )
+    )
+    tracemalloc.stop()
+
+    from django.conf import settings
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pairs": args.pairs,
+            "concurrency": args.concurrency,
+            "index_mode": settings.PAIRING_INDEX_MODE,
+            "signed_tokens": settings.PAIRING_SIGNED_TOKENS,
+            "memcached": "external" if args.memcached else "fake",
+            "memcached_nodes": len(settings.MEMCACHED_SERVERS),
+            "playback_lead_ms": settings.PLAYBACK_LEAD_MS,
+        },
+        **results,
+        "ttl_queue": [
+            ttl_queue_costs(live, min(args.expire_batch, live))
+            for live in args.ttl_scales
+        ],
+    }
+    report["codec"] = codec_costs(args.codec_rounds)
+    with tempfile.TemporaryDirectory() as tmp:
+        report["warm_restart"] = [
+            warm_restart(live, Path(tmp) / "pairings.snapshot")
+            for live in args.restore_scales
+        ]
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(output)
+    else:
+        sys.stdout.buffer.write(output + b"\n")
+
+
+if __name__ == "__main__":
+    main()
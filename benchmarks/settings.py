@@ -0,0 +1,16 @@
+from pathlib import Path
+
+from djMirror.settings import *  # noqa: F403
+
+# The pairing template context reads the Vite manifest at import time; the
+# benchmarks never render it, so an empty one stands in for a frontend build
+STATIC_ROOT = Path(__file__).resolve().parent
+
+# Runs start from an empty cache; warm_restart times snapshots in a temp dir
+PAIRING_SNAPSHOT_PATH = ""
+
+# Every request comes from one address and the live set is the point of the
+# measurement; the overload section turns admission control on by itself
+PAIRING_CAPACITY = 0
+PAIRING_DEVICE_RATE = 0
+PAIRING_IP_RATE = 0
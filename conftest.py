@@ -0,0 +1,5 @@
+import os
+
+# The benchmark settings stand in for a frontend build and start from an
+# empty cache with snapshots and admission control off
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
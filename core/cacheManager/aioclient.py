@@ -0,0 +1,578 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Tuple
+
+from pymemcache.client.base import check_key_helper
+from pymemcache.exceptions import (
+    MemcacheClientError,
+    MemcacheError,
+    MemcacheServerError,
+    MemcacheUnexpectedCloseError,
+    MemcacheUnknownCommandError,
+    MemcacheUnknownError,
+)
+
+logger = logging.getLogger(__name__)
+
+type Parser = Callable[[asyncio.StreamReader], Awaitable[Any]]
+
+
+async def _read_line(reader: asyncio.StreamReader) -> bytes:
+    try:
+        line = await reader.readuntil(b"\r\n")
+    except asyncio.IncompleteReadError:
+        raise MemcacheUnexpectedCloseError()
+    line = line[:-2]
+    if line == b"ERROR":
+        raise MemcacheUnknownCommandError(line)
+    if line.startswith(b"CLIENT_ERROR"):
+        raise MemcacheClientError(line[13:])
+    if line.startswith(b"SERVER_ERROR"):
+        raise MemcacheServerError(line[13:])
+    return line
+
+
+async def _parse_stored(reader: asyncio.StreamReader) -> bool | None:
+    line = await _read_line(reader)
+    match line:
+        case b"STORED":
+            return True
+        case b"NOT_STORED" | b"EXISTS":
+            return False
+        case b"NOT_FOUND":
+            return None
+    raise MemcacheUnknownError(line)
+
+
+async def _parse_found(reader: asyncio.StreamReader) -> bool:
+    line = await _read_line(reader)
+    match line:
+        case b"DELETED" | b"TOUCHED":
+            return True
+        case b"NOT_FOUND":
+            return False
+    raise MemcacheUnknownError(line)
+
+
+async def _parse_values(
+    reader: asyncio.StreamReader,
+) -> Dict[bytes, Tuple[bytes, int, int | None]]:
+    values: Dict[bytes, Tuple[bytes, int, int | None]] = dict()
+    while True:
+        line = await _read_line(reader)
+        if line == b"END":
+            return values
+        if not line.startswith(b"VALUE "):
+            raise MemcacheUnknownError(line)
+        _, key, flags, size, *cas = line.split()
+        try:
+            data = await reader.readexactly(int(size) + 2)
+        except asyncio.IncompleteReadError:
+            raise MemcacheUnexpectedCloseError()
+        values[key] = (data[:-2], int(flags), int(cas[0]) if cas else None)
+
+
+async def _parse_counter(reader: asyncio.StreamReader) -> int | None:
+    line = await _read_line(reader)
+    if line == b"NOT_FOUND":
+        return None
+    try:
+        return int(line)
+    except ValueError:
+        raise MemcacheUnknownError(line)
+
+
+async def _parse_version(reader: asyncio.StreamReader) -> bytes:
+    line = await _read_line(reader)
+    if not line.startswith(b"VERSION "):
+        raise MemcacheUnknownError(line)
+    return line[8:]
+
+
+def _consume(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+class AsyncConnection:
+    """Single memcached socket; requests are pipelined and answered in order"""
+
+    def __init__(
+        self,
+        server: Tuple[str, int],
+        connect_timeout: float | None = None,
+        timeout: float | None = None,
+    ):
+        self.server = server
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.closed: bool = False
+        self._pending: Deque[Tuple[asyncio.Future, Parser]] = deque()
+        self._has_pending: asyncio.Event = asyncio.Event()
+        self._reader_task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(*self.server), self.connect_timeout
+        )
+        self._reader_task = asyncio.create_task(self._read_responses())
+
+    async def execute(self, commands: List[Tuple[bytes, Parser | None]]) -> List[Any]:
+        """Write every command in one batch and await the replies that are expected.
+        Commands without a parser are sent with `noreply` and resolve to None
+        """
+        if self.closed:
+            raise MemcacheUnexpectedCloseError()
+        loop = asyncio.get_running_loop()
+        futures: List[asyncio.Future | None] = list()
+        for _, parser in commands:
+            if parser is None:
+                futures.append(None)
+                continue
+            future = loop.create_future()
+            self._pending.append((future, parser))
+            futures.append(future)
+        self.writer.write(b"".join(command for command, _ in commands))
+        self._has_pending.set()
+        waiting = [future for future in futures if future is not None]
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self.writer.drain()
+                if waiting:
+                    await asyncio.wait(waiting)
+        except BaseException as e:
+            # The replies are abandoned; keep their failures out of the asyncio log
+            [future.add_done_callback(_consume) for future in waiting]
+            if isinstance(e, TimeoutError):
+                self.close()
+            raise
+        # Retrieve every failure so a dropped batch logs nothing for the rest
+        failures = [future.exception() for future in waiting]
+        failure = next((e for e in failures if e is not None), None)
+        if failure is not None:
+            raise failure
+        results = iter([future.result() for future in waiting])
+        return [None if future is None else next(results) for future in futures]
+
+    async def _read_responses(self) -> None:
+        try:
+            while True:
+                if not self._pending:
+                    self._has_pending.clear()
+                    await self._has_pending.wait()
+                    continue
+                future, parser = self._pending[0]
+                try:
+                    result = await parser(self.reader)
+                except (MemcacheClientError, MemcacheServerError) as e:
+                    self._pending.popleft()
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self._pending.popleft()
+                if not future.done():
+                    future.set_result(result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Memcached connection {self.server} lost: {e!r}")
+            self._fail_pending(e)
+            self.close()
+
+    def _fail_pending(self, exc: BaseException) -> None:
+        while self._pending:
+            future, _ = self._pending.popleft()
+            if not future.done():
+                future.set_exception(exc)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._fail_pending(MemcacheUnexpectedCloseError())
+        if self._reader_task is not None and not self._reader_task.done():
+            self._reader_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+    async def shutdown(self) -> None:
+        """Close once memcached has answered everything written so far;
+        the `version` round trip also fences trailing noreply commands
+        """
+        if self.closed:
+            return
+        try:
+            await self.execute([(b"version\r\n", _parse_version)])
+        except (MemcacheError, OSError, TimeoutError) as e:
+            logger.error(f"Memcached connection {self.server} not drained: {e!r}")
+        self.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+class AsyncPooledClient:
+    """asyncio counterpart of pymemcache's PooledClient speaking the text protocol.
+
+    Concurrent requests share up to `max_pool_size` sockets; once every socket
+    is busy new requests are pipelined onto the least loaded one. Sockets only
+    work on the event loop that opened them, so each loop gets its own pool;
+    sync servers run every request on a fresh loop. An optional
+    pymemcache-style `serde` maps values to and from (bytes, flags)
+    """
+
+    def __init__(
+        self,
+        server: Tuple[str, int],
+        max_pool_size: int = 16,
+        connect_timeout: float | None = None,
+        timeout: float | None = None,
+        allow_unicode_keys: bool = False,
+        serde: Any = None,
+    ):
+        self.server = server
+        self.max_pool_size = max_pool_size
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.allow_unicode_keys = allow_unicode_keys
+        self.serde = serde
+        self.observer: Callable[[float], None] | None = None
+        self._pools: Dict[asyncio.AbstractEventLoop, List[AsyncConnection]] = dict()
+        self._connecting: Dict[asyncio.AbstractEventLoop, int] = dict()
+
+    @property
+    def connections(self) -> List[AsyncConnection]:
+        return [conn for pool in self._pools.values() for conn in pool]
+
+    def _pool(self, loop: asyncio.AbstractEventLoop) -> List[AsyncConnection]:
+        # Sockets of closed loops can no longer be used, nor closed through them
+        for stale in [other for other in self._pools if other.is_closed()]:
+            del self._pools[stale]
+            self._connecting.pop(stale, None)
+        pool = [conn for conn in self._pools.get(loop, ()) if not conn.closed]
+        self._pools[loop] = pool
+        return pool
+
+    async def _acquire(self) -> AsyncConnection:
+        loop = asyncio.get_running_loop()
+        pool = self._pool(loop)
+        idle = next((conn for conn in pool if conn.pending == 0), None)
+        if idle is not None:
+            return idle
+        if len(pool) + self._connecting.get(loop, 0) < self.max_pool_size:
+            conn = AsyncConnection(self.server, self.connect_timeout, self.timeout)
+            self._connecting[loop] = self._connecting.get(loop, 0) + 1
+            try:
+                await conn.connect()
+            finally:
+                self._connecting[loop] -= 1
+            self._pools.setdefault(loop, list()).append(conn)
+            return conn
+        if not pool:
+            await asyncio.sleep(0.001)
+            return await self._acquire()
+        return min(pool, key=lambda conn: conn.pending)
+
+    async def _execute(self, commands: List[Tuple[bytes, Parser | None]]) -> List[Any]:
+        conn = await self._acquire()
+        if self.observer is None:
+            return await conn.execute(commands)
+        started = time.perf_counter()
+        try:
+            return await conn.execute(commands)
+        finally:
+            self.observer(time.perf_counter() - started)
+
+    @property
+    def pending(self) -> int:
+        return sum(conn.pending for conn in self.connections)
+
+    def _key(self, key: str | bytes) -> bytes:
+        return check_key_helper(key, self.allow_unicode_keys)
+
+    def _dump(self, key, value: Any) -> Tuple[bytes, int]:
+        if self.serde is not None:
+            value, flags = self.serde.serialize(key, value)
+        else:
+            flags = 0
+        if isinstance(value, bytes):
+            return value, flags
+        return str(value).encode("utf8"), flags
+
+    def _load(self, key, value: bytes, flags: int) -> Any:
+        if self.serde is None:
+            return value
+        return self.serde.deserialize(key, value, flags)
+
+    def _storage_command(
+        self,
+        name: bytes,
+        key: str | bytes,
+        value: Any,
+        expire: int,
+        noreply: bool,
+        cas: int | None = None,
+    ) -> Tuple[bytes, Parser | None]:
+        data, flags = self._dump(key, value)
+        parts = [name, self._key(key), b"%d" % flags, b"%d" % expire, b"%d" % len(data)]
+        if cas is not None:
+            parts.append(b"%d" % cas)
+        if noreply:
+            parts.append(b"noreply")
+        return b" ".join(parts) + b"\r\n" + data + b"\r\n", (
+            None if noreply else _parse_stored
+        )
+
+    async def _store(
+        self,
+        name: bytes,
+        key: str | bytes,
+        value: Any,
+        expire: int = 0,
+        noreply: bool = False,
+        cas: int | None = None,
+    ) -> bool | None:
+        (result,) = await self._execute(
+            [self._storage_command(name, key, value, expire, noreply, cas=cas)]
+        )
+        return True if noreply else result
+
+    async def set(self, key, value, expire: int = 0, noreply: bool = False) -> bool:
+        return await self._store(b"set", key, value, expire, noreply)
+
+    async def add(self, key, value, expire: int = 0, noreply: bool = False) -> bool:
+        return await self._store(b"add", key, value, expire, noreply)
+
+    async def replace(self, key, value, expire: int = 0, noreply: bool = False) -> bool:
+        return await self._store(b"replace", key, value, expire, noreply)
+
+    async def cas(
+        self, key, value, cas: int, expire: int = 0, noreply: bool = False
+    ) -> bool | None:
+        """True when stored, False when the item changed, None when it is gone"""
+        return await self._store(b"cas", key, value, expire, noreply, cas=cas)
+
+    async def append(self, key, value: bytes, noreply: bool = False) -> bool:
+        """Extend an existing item in place; False when there is none"""
+        return await self._store(b"append", key, value, 0, noreply)
+
+    def _counter_command(
+        self, name: bytes, key, delta: int, noreply: bool
+    ) -> Tuple[bytes, Parser | None]:
+        command = b"%s %s %d" % (name, self._key(key), delta)
+        if noreply:
+            return command + b" noreply\r\n", None
+        return command + b"\r\n", _parse_counter
+
+    async def incr(self, key, delta: int = 1, noreply: bool = False) -> int | None:
+        """The counter's new value, None when the item is gone"""
+        (result,) = await self._execute(
+            [self._counter_command(b"incr", key, delta, noreply)]
+        )
+        return result
+
+    async def decr(self, key, delta: int = 1, noreply: bool = False) -> int | None:
+        (result,) = await self._execute(
+            [self._counter_command(b"decr", key, delta, noreply)]
+        )
+        return result
+
+    async def set_many(
+        self, values: Dict[str, Any], expire: int = 0, noreply: bool = False
+    ) -> List[str]:
+        """Pipeline one `set` per item; returns the keys that failed to store"""
+        if not values:
+            return list()
+        keys = list(values.keys())
+        results = await self._execute(
+            [
+                self._storage_command(b"set", key, values[key], expire, noreply)
+                for key in keys
+            ]
+        )
+        if noreply:
+            return list()
+        return [key for key, stored in zip(keys, results) if not stored]
+
+    async def _retrieve(
+        self, name: bytes, keys: Iterable[str | bytes]
+    ) -> Dict[str | bytes, Tuple[bytes, int, int | None]]:
+        encoded = {self._key(key): key for key in keys}
+        if not encoded:
+            return dict()
+        (values,) = await self._execute(
+            [(name + b" " + b" ".join(encoded.keys()) + b"\r\n", _parse_values)]
+        )
+        return {encoded[key]: value for key, value in values.items()}
+
+    async def get(self, key, default: Any = None) -> Any:
+        values = await self._retrieve(b"get", [key])
+        if key not in values:
+            return default
+        value, flags, _ = values[key]
+        return self._load(key, value, flags)
+
+    async def get_many(self, keys: Iterable[str | bytes]) -> Dict[str | bytes, Any]:
+        values = await self._retrieve(b"get", keys)
+        return {
+            key: self._load(key, value, flags)
+            for key, (value, flags, _) in values.items()
+        }
+
+    async def gets(self, key) -> Tuple[Any, int | None]:
+        values = await self._retrieve(b"gets", [key])
+        if key not in values:
+            return None, None
+        value, flags, cas = values[key]
+        return self._load(key, value, flags), cas
+
+    async def gets_many(
+        self, keys: Iterable[str | bytes]
+    ) -> Dict[str | bytes, Tuple[Any, int | None]]:
+        values = await self._retrieve(b"gets", keys)
+        return {
+            key: (self._load(key, value, flags), cas)
+            for key, (value, flags, cas) in values.items()
+        }
+
+    def _delete_command(self, key, noreply: bool) -> Tuple[bytes, Parser | None]:
+        command = b"delete " + self._key(key) + (b" noreply" if noreply else b"")
+        return command + b"\r\n", None if noreply else _parse_found
+
+    async def delete(self, key, noreply: bool = False) -> bool:
+        (result,) = await self._execute([self._delete_command(key, noreply)])
+        return True if noreply else result
+
+    async def delete_many(
+        self, keys: Iterable[str | bytes], noreply: bool = False
+    ) -> bool:
+        commands = [self._delete_command(key, noreply) for key in keys]
+        if commands:
+            await self._execute(commands)
+        return True
+
+    async def touch(self, key, expire: int = 0, noreply: bool = False) -> bool:
+        command = b"touch %s %d" % (self._key(key), expire)
+        if noreply:
+            command += b" noreply"
+        (result,) = await self._execute(
+            [(command + b"\r\n", None if noreply else _parse_found)]
+        )
+        return True if noreply else result
+
+    async def version(self) -> bytes:
+        (result,) = await self._execute([(b"version\r\n", _parse_version)])
+        return result
+
+    def pipeline(self) -> "Pipeline":
+        return Pipeline(self)
+
+    def close(self) -> None:
+        pools, self._pools = self._pools, dict()
+        for loop, pool in pools.items():
+            if loop.is_closed():
+                continue
+            for conn in pool:
+                conn.close()
+
+    async def shutdown(self) -> None:
+        """Drain the connections of the running loop and close the rest"""
+        loop = asyncio.get_running_loop()
+        current = self._pools.pop(loop, list())
+        self.close()
+        await asyncio.gather(*(conn.shutdown() for conn in current))
+
+
+class Pipeline:
+    """Commands queued client side and written to one connection in one batch.
+
+    memcached answers a connection's commands in order, so an acknowledged
+    command confirms every `noreply` write queued before it; when nothing in
+    the batch expects a reply `execute` closes it with a `version` fence
+    """
+
+    def __init__(self, client: AsyncPooledClient):
+        self.client = client
+        self.commands: List[Tuple[bytes, Parser | None]] = list()
+        self.decoders: List[Callable[[Any], Any] | None] = list()
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def _queue(
+        self,
+        command: Tuple[bytes, Parser | None],
+        decode: Callable[[Any], Any] | None = None,
+    ) -> "Pipeline":
+        self.commands.append(command)
+        self.decoders.append(decode)
+        return self
+
+    def set(self, key, value, expire: int = 0, noreply: bool = False) -> "Pipeline":
+        return self._queue(
+            self.client._storage_command(b"set", key, value, expire, noreply)
+        )
+
+    def add(self, key, value, expire: int = 0, noreply: bool = False) -> "Pipeline":
+        return self._queue(
+            self.client._storage_command(b"add", key, value, expire, noreply)
+        )
+
+    def cas(
+        self, key, value, cas: int, expire: int = 0, noreply: bool = False
+    ) -> "Pipeline":
+        return self._queue(
+            self.client._storage_command(b"cas", key, value, expire, noreply, cas=cas)
+        )
+
+    def append(self, key, value: bytes, noreply: bool = False) -> "Pipeline":
+        return self._queue(
+            self.client._storage_command(b"append", key, value, 0, noreply)
+        )
+
+    def incr(self, key, delta: int = 1, noreply: bool = False) -> "Pipeline":
+        return self._queue(self.client._counter_command(b"incr", key, delta, noreply))
+
+    def decr(self, key, delta: int = 1, noreply: bool = False) -> "Pipeline":
+        return self._queue(self.client._counter_command(b"decr", key, delta, noreply))
+
+    def delete(self, key, noreply: bool = False) -> "Pipeline":
+        return self._queue(self.client._delete_command(key, noreply))
+
+    def gets_many(self, keys: Iterable[str | bytes]) -> "Pipeline":
+        encoded = {self.client._key(key): key for key in keys}
+        if not encoded:
+            raise MemcacheClientError("gets_many needs at least one key")
+
+        def decode(values: Dict[bytes, Tuple[bytes, int, int | None]]):
+            return {
+                encoded[key]: (self.client._load(encoded[key], value, flags), cas)
+                for key, (value, flags, cas) in values.items()
+            }
+
+        return self._queue(
+            (b"gets " + b" ".join(encoded.keys()) + b"\r\n", _parse_values), decode
+        )
+
+    async def execute(self) -> List[Any]:
+        """Results in queue order; `noreply` commands resolve to None"""
+        commands, decoders = self.commands, self.decoders
+        self.commands, self.decoders = list(), list()
+        if not commands:
+            return list()
+        if all(parser is None for _, parser in commands):
+            commands = commands + [(b"version\r\n", _parse_version)]
+        results = await self.client._execute(commands)
+        return [
+            result if decode is None else decode(result)
+            for result, decode in zip(results, decoders)
+        ]
@@ -1,8 +1,17 @@
+import asyncio
+import atexit
 import logging
+import time
+
+from typing import Dict, Tuple
 
 from django.apps import AppConfig
+from django.conf import settings
+
+from core.metrics.registry import registry
 
-from .tasks import CacheTaskHandler
+from .snapshot import PairingSnapshot
+from .tasks import AsyncCacheTaskHandler, CacheTaskHandler
 
 logger = logging.getLogger(__name__)
 
@@ -11,14 +20,113 @@ class CachemanagerConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core.cacheManager"
     cache_handler: CacheTaskHandler | None = None
+    async_cache_handler: AsyncCacheTaskHandler | None = None
+    snapshot: PairingSnapshot | None = None
+    snapshot_task: asyncio.Task | None = None
 
     def ready(self):
         super().ready()
         try:
             self.cache_handler = CacheTaskHandler()
             self.cache_handler.initIndexes()
+            if settings.PAIRING_SNAPSHOT_PATH:
+                self.restore_snapshot()
+            self.async_cache_handler = AsyncCacheTaskHandler(
+                pairingIndex=self.cache_handler.pairingIndex,
+                deviceIndex=self.cache_handler.deviceIndex,
+            )
+            self.cache_handler.ttl_task_queue.add_expiry_listener(
+                self.async_cache_handler.evict_expired
+            )
+            self.register_gauges()
             logger.info(
-                f"Cache client ready; connected server -> {':'.join([str(el) for el in self.cache_handler.task_client.server])}"
+                f"Cache client ready; memcached ring -> {', '.join(self.async_cache_handler.task_client.nodes)}"
             )
         except GeneratorExit:
             logger.error("Memcached client generator exhausted")
+
+    def restore_snapshot(self) -> None:
+        self.snapshot = PairingSnapshot(
+            settings.PAIRING_SNAPSHOT_PATH,
+            settings.PAIRING_SNAPSHOT_INTERVAL,
+            self.cache_handler.ttl_task_queue,
+            self.cache_handler.pairingIndex,
+        )
+        started = time.perf_counter()
+        entries = self.snapshot.load()
+        restored = self.cache_handler.restore(entries)
+        logger.info(
+            f"Restored {restored} of {len(entries)} snapshotted pairings in {time.perf_counter() - started:.3f}s"
+        )
+        # Fallback for servers that never run the ASGI lifespan shutdown
+        atexit.register(self.snapshot.save)
+
+    async def startup(self) -> None:
+        if self.snapshot is not None:
+            self.snapshot_task = asyncio.create_task(self.snapshot.run())
+
+    async def shutdown(self) -> None:
+        """Snapshot the pairings left and close the memcached clients once
+        the writes already sent are acknowledged
+        """
+        if self.snapshot_task is not None:
+            self.snapshot_task.cancel()
+            try:
+                await self.snapshot_task
+            except asyncio.CancelledError:
+                pass
+        if self.snapshot is not None:
+            saved = self.snapshot.save()
+            atexit.unregister(self.snapshot.save)
+            logger.info(f"Snapshotted {saved} pairings")
+        if self.async_cache_handler is not None:
+            await self.async_cache_handler.task_client.shutdown()
+        if self.cache_handler is not None:
+            self.cache_handler.task_client.close()
+
+    def register_gauges(self) -> None:
+        registry.gauge(
+            "memcached_pool_connections",
+            "Memcached connections per client; busy ones have requests in flight",
+            self.pool_connections,
+            ["client", "state"],
+        )
+        registry.gauge(
+            "memcached_pool_max_size",
+            "Connection limit per memcached client and node",
+            lambda: {
+                ("sync",): settings.MEMCACHED_POOL_SIZE,
+                ("async",): self.async_cache_handler.task_client.max_pool_size,
+            },
+            ["client"],
+        )
+        registry.gauge(
+            "memcached_node_up",
+            "1 while a memcached node is on the async client's hash ring",
+            lambda: {
+                (name,): int(node.alive)
+                for name, node in self.async_cache_handler.task_client.nodes.items()
+            },
+            ["server"],
+        )
+        registry.gauge(
+            "pairing_cache_entries",
+            "Decoded pairings held by the async handler's local cache",
+            lambda: {(): len(self.async_cache_handler.pairing_cache)},
+        )
+        registry.gauge(
+            "memcached_pending_requests",
+            "Requests awaiting a reply on the asyncio memcached client",
+            lambda: {(): self.async_cache_handler.task_client.pending},
+        )
+
+    def pool_connections(self) -> Dict[Tuple[str, ...], float]:
+        sync_client = self.cache_handler.task_client
+        connections = self.async_cache_handler.task_client.connections
+        busy = sum(1 for conn in connections if conn.pending)
+        return {
+            ("sync", "busy"): sync_client.busy_connections,
+            ("sync", "idle"): sync_client.idle_connections,
+            ("async", "busy"): busy,
+            ("async", "idle"): len(connections) - busy,
+        }
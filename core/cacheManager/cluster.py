@@ -0,0 +1,421 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from pymemcache.client.hash import HashClient
+from pymemcache.exceptions import (
+    MemcacheClientError,
+    MemcacheError,
+    MemcacheUnexpectedCloseError,
+)
+
+from .aioclient import AsyncConnection, AsyncPooledClient
+from .ring import KetamaRing
+
+logger = logging.getLogger(__name__)
+
+# Failures that say the node is unreachable rather than that the request was bad
+NODE_ERRORS = (MemcacheUnexpectedCloseError, OSError, TimeoutError)
+
+type NodeCall[R] = Callable[[AsyncPooledClient], Awaitable[R]]
+
+
+class CacheNode:
+    """One memcached server of the ring and its connection pool"""
+
+    def __init__(self, server: Tuple[str, int], client: AsyncPooledClient):
+        self.server = server
+        self.name = f"{server[0]}:{server[1]}"
+        self.client = client
+        self.alive: bool = True
+        self.failures: int = 0
+
+
+class SyncHashClient(HashClient):
+    """pymemcache's HashClient over pooled clients, counting their connections
+    through the pools' public views, so the gauges skip pymemcache internals
+    """
+
+    def _pools(self) -> List[Any]:
+        return [
+            client.client_pool
+            for client in self.clients.values()
+            if hasattr(client, "client_pool")
+        ]
+
+    @property
+    def busy_connections(self) -> int:
+        return sum(len(pool.used) for pool in self._pools())
+
+    @property
+    def idle_connections(self) -> int:
+        return sum(len(pool.free) for pool in self._pools())
+
+
+class AsyncHashClient:
+    """AsyncPooledClient interface spread over several memcached servers.
+
+    Keys are placed on a KetamaRing and every node keeps its own pool. A node
+    failing `failure_limit` requests or health probes in a row is ejected and
+    its keys fall to the next node on the ring; the request that ejected it is
+    retried there once. Every `health_interval` seconds all nodes are probed
+    with `version`, and ejected ones are re-admitted when they answer again
+    """
+
+    def __init__(
+        self,
+        servers: List[Tuple[str, int]],
+        max_pool_size: int = 16,
+        connect_timeout: float | None = None,
+        timeout: float | None = None,
+        failure_limit: int = 2,
+        health_interval: float = 5,
+        serde: Any = None,
+    ):
+        self.max_pool_size = max_pool_size
+        self.failure_limit = failure_limit
+        self.health_interval = health_interval
+        self.ring = KetamaRing()
+        self.nodes: Dict[str, CacheNode] = dict()
+        for server in servers:
+            node = CacheNode(
+                tuple(server),
+                AsyncPooledClient(
+                    tuple(server),
+                    max_pool_size=max_pool_size,
+                    connect_timeout=connect_timeout,
+                    timeout=timeout,
+                    serde=serde,
+                ),
+            )
+            self.nodes[node.name] = node
+            self.ring.add_node(node.name)
+        self._observer: Callable[[float], None] | None = None
+        self._probe: asyncio.Task | None = None
+
+    @property
+    def servers(self) -> List[Tuple[str, int]]:
+        return [node.server for node in self.nodes.values()]
+
+    @property
+    def observer(self) -> Callable[[float], None] | None:
+        return self._observer
+
+    @observer.setter
+    def observer(self, observer: Callable[[float], None] | None) -> None:
+        self._observer = observer
+        for node in self.nodes.values():
+            node.client.observer = observer
+
+    @property
+    def connections(self) -> List[AsyncConnection]:
+        return [
+            conn for node in self.nodes.values() for conn in node.client.connections
+        ]
+
+    @property
+    def pending(self) -> int:
+        return sum(node.client.pending for node in self.nodes.values())
+
+    def _node(self, key: str | bytes) -> CacheNode:
+        self._start_probe()
+        name = self.ring.get_node(key)
+        if name is None:
+            raise MemcacheError("All memcached servers seem to be down right now")
+        return self.nodes[name]
+
+    def _failed(self, node: CacheNode, error: BaseException) -> None:
+        node.failures += 1
+        if node.alive and node.failures >= self.failure_limit:
+            node.alive = False
+            self.ring.remove_node(node.name)
+            node.client.close()
+            logger.error(
+                f"Memcached {node.name} ejected after {node.failures} failures: {error!r}"
+            )
+
+    def _admit(self, node: CacheNode) -> None:
+        node.failures = 0
+        if not node.alive:
+            node.alive = True
+            self.ring.add_node(node.name)
+            logger.info(f"Memcached {node.name} re-admitted")
+
+    async def _on_node[R](self, node: CacheNode, call: NodeCall[R]) -> R:
+        try:
+            result = await call(node.client)
+        except NODE_ERRORS as e:
+            self._failed(node, e)
+            raise
+        node.failures = 0
+        return result
+
+    async def _routed[R](self, key: str | bytes, call: NodeCall[R]) -> R:
+        node = self._node(key)
+        try:
+            return await self._on_node(node, call)
+        except NODE_ERRORS:
+            if node.alive:
+                raise
+            # Ejected by this very request; its keys now live on the next node
+            return await self._on_node(self._node(key), call)
+
+    async def _fan_out[T, R](
+        self,
+        items: Iterable[T],
+        call: Callable[[AsyncPooledClient, List[T]], Awaitable[R]],
+        key: Callable[[T], str | bytes] = lambda item: item,
+        retry: bool = True,
+    ) -> List[R]:
+        """Run `call` once per node with the items whose key it owns"""
+        groups: Dict[str, List[T]] = dict()
+        for item in items:
+            groups.setdefault(self._node(key(item)).name, list()).append(item)
+        results = await asyncio.gather(
+            *(
+                self._on_node(
+                    self.nodes[name], lambda client, part=part: call(client, part)
+                )
+                for name, part in groups.items()
+            ),
+            return_exceptions=True,
+        )
+        done, moved = list(), list()
+        for name, result in zip(groups, results):
+            if not isinstance(result, BaseException):
+                done.append(result)
+            elif (
+                retry and isinstance(result, NODE_ERRORS) and not self.nodes[name].alive
+            ):
+                moved.extend(groups[name])
+            else:
+                raise result
+        if moved:
+            done.extend(await self._fan_out(moved, call, key, retry=False))
+        return done
+
+    def _start_probe(self) -> None:
+        if self.health_interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if (
+            self._probe is None
+            or self._probe.done()
+            or self._probe.get_loop() is not loop
+        ):
+            self._probe = loop.create_task(self._probe_nodes())
+
+    async def _probe_nodes(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self._check(node) for node in self.nodes.values()))
+
+    async def _check(self, node: CacheNode) -> None:
+        try:
+            await node.client.version()
+        except (*NODE_ERRORS, MemcacheError) as e:
+            self._failed(node, e)
+            return
+        self._admit(node)
+
+    async def set(self, key, value, expire: int = 0, noreply: bool = False) -> bool:
+        return await self._routed(
+            key, lambda client: client.set(key, value, expire, noreply)
+        )
+
+    async def add(self, key, value, expire: int = 0, noreply: bool = False) -> bool:
+        return await self._routed(
+            key, lambda client: client.add(key, value, expire, noreply)
+        )
+
+    async def replace(self, key, value, expire: int = 0, noreply: bool = False) -> bool:
+        return await self._routed(
+            key, lambda client: client.replace(key, value, expire, noreply)
+        )
+
+    async def cas(
+        self, key, value, cas: int, expire: int = 0, noreply: bool = False
+    ) -> bool | None:
+        return await self._routed(
+            key, lambda client: client.cas(key, value, cas, expire, noreply)
+        )
+
+    async def append(self, key, value: bytes, noreply: bool = False) -> bool:
+        return await self._routed(
+            key, lambda client: client.append(key, value, noreply)
+        )
+
+    async def incr(self, key, delta: int = 1, noreply: bool = False) -> int | None:
+        return await self._routed(key, lambda client: client.incr(key, delta, noreply))
+
+    async def decr(self, key, delta: int = 1, noreply: bool = False) -> int | None:
+        return await self._routed(key, lambda client: client.decr(key, delta, noreply))
+
+    async def set_many(
+        self, values: Dict[str, Any], expire: int = 0, noreply: bool = False
+    ) -> List[str]:
+        failed = await self._fan_out(
+            values,
+            lambda client, keys: client.set_many(
+                {key: values[key] for key in keys}, expire, noreply
+            ),
+        )
+        return [key for keys in failed for key in keys]
+
+    async def get(self, key, default: Any = None) -> Any:
+        return await self._routed(key, lambda client: client.get(key, default))
+
+    async def get_many(self, keys: Iterable[str | bytes]) -> Dict[str | bytes, Any]:
+        values = dict()
+        [
+            values.update(part)
+            for part in await self._fan_out(
+                keys, lambda client, part: client.get_many(part)
+            )
+        ]
+        return values
+
+    async def gets(self, key) -> Tuple[Any, int | None]:
+        return await self._routed(key, lambda client: client.gets(key))
+
+    async def gets_many(
+        self, keys: Iterable[str | bytes]
+    ) -> Dict[str | bytes, Tuple[Any, int | None]]:
+        values = dict()
+        [
+            values.update(part)
+            for part in await self._fan_out(
+                keys, lambda client, part: client.gets_many(part)
+            )
+        ]
+        return values
+
+    async def delete(self, key, noreply: bool = False) -> bool:
+        return await self._routed(key, lambda client: client.delete(key, noreply))
+
+    async def delete_many(
+        self, keys: Iterable[str | bytes], noreply: bool = False
+    ) -> bool:
+        await self._fan_out(
+            keys, lambda client, part: client.delete_many(part, noreply)
+        )
+        return True
+
+    async def touch(self, key, expire: int = 0, noreply: bool = False) -> bool:
+        return await self._routed(
+            key, lambda client: client.touch(key, expire, noreply)
+        )
+
+    async def version(self) -> Dict[str, bytes]:
+        """Version of every live node"""
+        live = [node for node in self.nodes.values() if node.alive]
+        versions = await asyncio.gather(
+            *(self._on_node(node, lambda client: client.version()) for node in live)
+        )
+        return {node.name: version for node, version in zip(live, versions)}
+
+    def pipeline(self) -> "ClusterPipeline":
+        return ClusterPipeline(self)
+
+    def close(self) -> None:
+        if self._probe is not None and not self._probe.done():
+            self._probe.cancel()
+        self._probe = None
+        for node in self.nodes.values():
+            node.client.close()
+
+    async def shutdown(self) -> None:
+        """Stop probing and close every node once its replies are in"""
+        probe, self._probe = self._probe, None
+        if probe is not None and not probe.done():
+            probe.cancel()
+            try:
+                await probe
+            except asyncio.CancelledError:
+                pass
+        await asyncio.gather(*(node.client.shutdown() for node in self.nodes.values()))
+
+
+class ClusterPipeline:
+    """Pipeline split into one batch per node, the batches written concurrently"""
+
+    def __init__(self, client: AsyncHashClient):
+        self.client = client
+        self.ops: List[Tuple[str, List[str | bytes], Tuple]] = list()
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def set(self, key, value, expire: int = 0, noreply: bool = False):
+        self.ops.append(("set", [key], (value, expire, noreply)))
+        return self
+
+    def add(self, key, value, expire: int = 0, noreply: bool = False):
+        self.ops.append(("add", [key], (value, expire, noreply)))
+        return self
+
+    def cas(self, key, value, cas: int, expire: int = 0, noreply: bool = False):
+        self.ops.append(("cas", [key], (value, cas, expire, noreply)))
+        return self
+
+    def append(self, key, value: bytes, noreply: bool = False):
+        self.ops.append(("append", [key], (value, noreply)))
+        return self
+
+    def incr(self, key, delta: int = 1, noreply: bool = False):
+        self.ops.append(("incr", [key], (delta, noreply)))
+        return self
+
+    def decr(self, key, delta: int = 1, noreply: bool = False):
+        self.ops.append(("decr", [key], (delta, noreply)))
+        return self
+
+    def delete(self, key, noreply: bool = False):
+        self.ops.append(("delete", [key], (noreply,)))
+        return self
+
+    def gets_many(self, keys: Iterable[str | bytes]):
+        keys = list(keys)
+        if not keys:
+            raise MemcacheClientError("gets_many needs at least one key")
+        self.ops.append(("gets_many", keys, ()))
+        return self
+
+    @staticmethod
+    async def _run(
+        client: AsyncPooledClient, units: List[Tuple[int, str, str | bytes, Tuple]]
+    ) -> List[Tuple[int, str, Any]]:
+        queued: List[Tuple[int, str, Any, Tuple]] = list()
+        for index, name, key, args in units:
+            if name == "gets_many" and queued and queued[-1][0] == index:
+                queued[-1][2].append(key)
+                continue
+            queued.append((index, name, [key] if name == "gets_many" else key, args))
+        pipeline = client.pipeline()
+        [getattr(pipeline, name)(key, *args) for _, name, key, args in queued]
+        results = await pipeline.execute()
+        return [
+            (index, name, result)
+            for (index, name, _, _), result in zip(queued, results)
+        ]
+
+    async def execute(self) -> List[Any]:
+        """Results in queue order; `noreply` commands resolve to None"""
+        ops, self.ops = self.ops, list()
+        results: List[Any] = [
+            dict() if name == "gets_many" else None for name, _, _ in ops
+        ]
+        units = [
+            (index, name, key, args)
+            for index, (name, keys, args) in enumerate(ops)
+            for key in keys
+        ]
+        for part in await self.client._fan_out(
+            units, self._run, key=lambda unit: unit[2]
+        ):
+            for index, name, result in part:
+                if name == "gets_many":
+                    results[index].update(result)
+                else:
+                    results[index] = result
+        return results
@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Tuple
+
+from core.metrics.registry import registry
+from core.pairing.schema import PairInner
+
+PAIRING_CACHE_REQUESTS = registry.counter(
+    "pairing_cache_requests_total",
+    "Local pairing object cache lookups by result",
+    ["result"],
+)
+PAIRING_CACHE_CAS_CONFLICTS = registry.counter(
+    "pairing_cache_cas_conflicts_total",
+    "Optimistic writes from a cached CAS version that lost to another writer",
+)
+
+# expires, fresh until, cas, pairing
+type Entry = Tuple[float, float, Any, PairInner]
+
+
+def detach(pair: PairInner) -> PairInner:
+    """Copy deep enough that callers may edit the pairing and its nodes"""
+    return pair.model_copy(update={"nodes": [node.model_copy() for node in pair.nodes]})
+
+
+class PairingLRU:
+    """Bounded LRU of decoded pairings.
+
+    Entries live until the pairing's own deadline. Reads only trust them until
+    `fresh until`, which in shared index mode is capped by the read cache ttl;
+    past that they still hold the CAS version of the last read, which lets the
+    next update skip its `gets` and fall back to one when the `cas` loses
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict[str, Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _entry(self, pairToken: str) -> Entry | None:
+        entry = self.entries.get(pairToken)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[pairToken]
+            return None
+        self.entries.move_to_end(pairToken)
+        return entry
+
+    def get(self, pairToken: str) -> PairInner | None:
+        entry = self._entry(pairToken)
+        if entry is None or entry[1] < time.monotonic():
+            PAIRING_CACHE_REQUESTS.inc("miss")
+            return None
+        PAIRING_CACHE_REQUESTS.inc("hit")
+        return detach(entry[3])
+
+    def versioned(self, pairToken: str) -> Tuple[Any, PairInner] | None:
+        entry = self._entry(pairToken)
+        if entry is None or entry[2] is None:
+            return None
+        return entry[2], detach(entry[3])
+
+    def put(
+        self, pair: PairInner, ttl: float, fresh_for: float, cas: Any = None
+    ) -> None:
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        now = time.monotonic()
+        self.entries[pair.token] = (
+            now + ttl,
+            now + min(ttl, fresh_for),
+            cas,
+            detach(pair),
+        )
+        self.entries.move_to_end(pair.token)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def conflict(self, pairToken: str) -> None:
+        PAIRING_CACHE_CAS_CONFLICTS.inc()
+        self.invalidate([pairToken])
+
+    def invalidate(self, pairTokens: Iterable[str]) -> None:
+        [self.entries.pop(pairToken, None) for pairToken in pairTokens]
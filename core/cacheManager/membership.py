@@ -0,0 +1,65 @@
+from typing import Dict, Iterable, List
+from uuid import UUID
+
+from core.pairing.schema import Device
+
+# State byte of a record: a join carries the member's availability, an update
+# only changes that of a current member, so it cannot revive one that left
+MEMBER_LEFT = 0
+MEMBER_JOINED = 1
+MEMBER_AVAILABLE = 2
+MEMBER_UPDATE = 4
+RECORD_SIZE = 17
+# Logs are rewritten once they hold this many records per live member
+COMPACT_RATIO = 2
+COMPACT_SLACK = 32
+
+
+def member_record(
+    deviceId: UUID, joined: bool = True, available: bool = False
+) -> bytes:
+    state = MEMBER_JOINED | MEMBER_AVAILABLE * available if joined else MEMBER_LEFT
+    return deviceId.bytes + bytes((state,))
+
+
+def availability_record(deviceId: UUID, available: bool) -> bytes:
+    return deviceId.bytes + bytes((MEMBER_UPDATE | MEMBER_AVAILABLE * available,))
+
+
+def encode_members(devices: Iterable[Device]) -> bytes:
+    return b"".join(
+        member_record(device.deviceId, available=device.available) for device in devices
+    )
+
+
+def fold_members(log: bytes) -> Dict[bytes, int]:
+    """Replay a membership log into device UUID bytes -> state, in join order"""
+    members: Dict[bytes, int] = dict()
+    for offset in range(0, len(log) - RECORD_SIZE + 1, RECORD_SIZE):
+        raw, state = log[offset : offset + 16], log[offset + 16]
+        if state & MEMBER_UPDATE:
+            if raw in members:
+                members[raw] = MEMBER_JOINED | state & MEMBER_AVAILABLE
+        elif state & MEMBER_JOINED:
+            members[raw] = state
+        else:
+            members.pop(raw, None)
+    return members
+
+
+def compacted(members: Dict[bytes, int]) -> bytes:
+    return b"".join(raw + bytes((state,)) for raw, state in members.items())
+
+
+def needs_compaction(log: bytes, members: Dict[bytes, int]) -> bool:
+    return len(log) // RECORD_SIZE > COMPACT_RATIO * len(members) + COMPACT_SLACK
+
+
+def member_devices(members: Dict[bytes, int]) -> List[Device]:
+    # Records were validated when written, so skip pydantic validation here
+    return [
+        Device.model_construct(
+            deviceId=UUID(bytes=raw), available=bool(state & MEMBER_AVAILABLE)
+        )
+        for raw, state in members.items()
+    ]
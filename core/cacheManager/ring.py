@@ -0,0 +1,57 @@
+import bisect
+import hashlib
+from typing import Dict, List
+
+POINTS_PER_NODE = 160
+
+
+def _digest(value: str | bytes) -> bytes:
+    if isinstance(value, str):
+        value = value.encode("utf8")
+    return hashlib.md5(value, usedforsecurity=False).digest()
+
+
+class KetamaRing:
+    """Consistent-hash ring laid out like libketama: every node owns
+    POINTS_PER_NODE points, four per md5 digest of "<node>-<n>", and a key
+    belongs to the first point at or after the first four bytes of its md5.
+
+    Adding or ejecting a node only moves the keys on the arcs it owned. The
+    interface is the `hasher` one pymemcache's HashClient expects
+    """
+
+    def __init__(self, nodes: List[str] | None = None):
+        self.nodes: List[str] = list()
+        self._points: List[int] = list()
+        self._owners: List[str] = list()
+        [self.add_node(node) for node in nodes or list()]
+
+    def _build(self) -> None:
+        ring: Dict[int, str] = dict()
+        for node in sorted(self.nodes):
+            for n in range(POINTS_PER_NODE // 4):
+                digest = _digest(f"{node}-{n}")
+                for i in range(4):
+                    ring.setdefault(
+                        int.from_bytes(digest[i * 4 : i * 4 + 4], "little"), node
+                    )
+        self._points = sorted(ring)
+        self._owners = [ring[point] for point in self._points]
+
+    def add_node(self, node: str) -> None:
+        if node not in self.nodes:
+            self.nodes.append(node)
+            self._build()
+
+    def remove_node(self, node: str) -> None:
+        if node not in self.nodes:
+            raise ValueError(f"No such node {node} to remove")
+        self.nodes.remove(node)
+        self._build()
+
+    def get_node(self, key: str | bytes) -> str | None:
+        if not self._points:
+            return None
+        point = int.from_bytes(_digest(key)[:4], "little")
+        index = bisect.bisect_left(self._points, point)
+        return self._owners[index % len(self._owners)]
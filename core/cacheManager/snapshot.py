@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import struct
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Set
+
+from core.pairing.tasks import ITaskQueue
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"MPS1"
+
+# magic, written at (unix time), entry count
+_HEADER = struct.Struct(">4sdI")
+# expires at (unix time), token length, device count
+_ENTRY = struct.Struct(">dHH")
+
+
+class SnapshotEntry(NamedTuple):
+    token: str
+    expires_at: float
+    deviceIds: List[str]
+
+
+# Device ids are canonical UUID strings; hex slicing beats building UUID objects
+def _uuid_bytes(deviceId: str) -> bytes:
+    return bytes.fromhex(deviceId.replace("-", ""))
+
+
+def _uuid_str(raw: bytes) -> str:
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def encode_snapshot(entries: Iterable[SnapshotEntry]) -> bytes:
+    """Pack entries as fixed headers, ascii tokens and 16-byte device UUIDs"""
+    body: List[bytes] = list()
+    count = 0
+    for token, expires_at, deviceIds in entries:
+        raw = token.encode("ascii")
+        body.append(_ENTRY.pack(expires_at, len(raw), len(deviceIds)))
+        body.append(raw)
+        body.extend(_uuid_bytes(deviceId) for deviceId in deviceIds)
+        count += 1
+    return _HEADER.pack(SNAPSHOT_MAGIC, time.time(), count) + b"".join(body)
+
+
+def decode_snapshot(data: bytes) -> List[SnapshotEntry]:
+    magic, _, count = _HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"Unknown snapshot format {magic!r}")
+    entries: List[SnapshotEntry] = list()
+    offset = _HEADER.size
+    for _ in range(count):
+        expires_at, token_length, node_count = _ENTRY.unpack_from(data, offset)
+        offset += _ENTRY.size
+        token = data[offset : offset + token_length].decode("ascii")
+        offset += token_length
+        deviceIds = [
+            _uuid_str(data[start : start + 16])
+            for start in range(offset, offset + 16 * node_count, 16)
+        ]
+        offset += 16 * node_count
+        entries.append(SnapshotEntry(token, expires_at, deviceIds))
+    return entries
+
+
+class PairingSnapshot:
+    """Live pairings of this process written to `path`, so a restart can
+    restore its TTL schedule and local indexes instead of orphaning them.
+
+    Written atomically every `interval` seconds by `run` and once more on
+    shutdown; every process needs a path of its own
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        interval: float,
+        ttl_task_queue: ITaskQueue,
+        pairingIndex: Dict[str, Set[str]],
+    ):
+        self.path = Path(path)
+        self.interval = interval
+        self.ttl_task_queue = ttl_task_queue
+        self.pairingIndex = pairingIndex
+
+    def collect(self) -> List[SnapshotEntry]:
+        # monotonic deadlines mean nothing to the next process; store wall time
+        offset = time.time() - time.monotonic()
+        return [
+            SnapshotEntry(
+                token,
+                state.deadline + offset,
+                list(self.pairingIndex.get(token, set())),
+            )
+            for token, state in list(self.ttl_task_queue.task_states.items())
+        ]
+
+    def write(self, entries: List[SnapshotEntry]) -> None:
+        # A temp file of its own, so an overlapping write cannot interleave
+        fd, partial = tempfile.mkstemp(
+            dir=self.path.parent, prefix=self.path.name, suffix=".partial"
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(encode_snapshot(entries))
+            os.replace(partial, self.path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+    def save(self) -> int:
+        entries = self.collect()
+        try:
+            self.write(entries)
+        except OSError as e:
+            logger.error(f"Pairing snapshot not written: {e!r}")
+            return 0
+        return len(entries)
+
+    def load(self) -> List[SnapshotEntry]:
+        try:
+            entries = decode_snapshot(self.path.read_bytes())
+        except FileNotFoundError:
+            return list()
+        except (OSError, ValueError, UnicodeDecodeError, struct.error) as e:
+            logger.error(f"Pairing snapshot {self.path} unreadable: {e!r}")
+            return list()
+        now = time.time()
+        return [entry for entry in entries if entry.expires_at > now]
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            # Collect on the loop, which owns the indexes; encode and write off it
+            entries = self.collect()
+            try:
+                await asyncio.to_thread(self.write, entries)
+            except OSError as e:
+                logger.error(f"Pairing snapshot not written: {e!r}")
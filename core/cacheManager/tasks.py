@@ -1,212 +1,1162 @@
+import functools
+import gc
 import logging
-from typing import Dict, List, Protocol
+import math
+import time
+from typing import Any, Callable, Dict, Iterable, List, Protocol, Set, Tuple
+from uuid import UUID
 
 import orjson
 from django.apps import apps
-from pymemcache.client.base import PooledClient
+from django.conf import settings
 from pymemcache.exceptions import MemcacheError
 
-from core.pairing.schema import Device, PairInner
+from core.metrics.registry import Phase, add_phase, phased, registry
+from core.pairing.events import IEventBroker
+from core.pairing.playback import IPlaybackBroker
+from core.pairing.schema import Device, Pair, PairInner
 from core.pairing.tasks import ITaskQueue
+from core.pairing.tokens import is_signed, read_token, signing_enabled
 
-from .connection import generateClient
+from .cluster import AsyncHashClient, SyncHashClient
+from .connection import SERDE, generateAsyncClient, generateClient
+from .lru import PairingLRU
+from .membership import (
+    MEMBER_AVAILABLE,
+    availability_record,
+    compacted,
+    encode_members,
+    fold_members,
+    member_devices,
+    member_record,
+    needs_compaction,
+)
+from .snapshot import SnapshotEntry
 
 logger = logging.getLogger(__name__)
 
+DEVICE_KEY_PREFIX = "dev:"
+PAIRING_KEY_PREFIX = "pair:"
+MEMBERS_KEY_PREFIX = "grp:"
+MEMBER_COUNT_KEY_PREFIX = "grpn:"
+PAIRING_LIVE = b"1"
+PAIRING_CLAIMED = b"0"
+CAS_RETRIES = 8
+READ_CACHE_MAX_SIZE = 4096
+RESTORE_BATCH_SIZE = 1000
+
+MEMCACHED = "memcached"
+
+type TokenUpdate = Callable[[List[str]], List[str]]
+type PairingUpdate = Callable[[PairInner], bool]
+
+
+class PairingContention(Exception):
+    """A pairing update lost every compare-and-swap to concurrent writers"""
+
+
+CACHE_HANDLER_SECONDS = registry.histogram(
+    "cache_handler_seconds",
+    "Async cache handler calls; phase total, summed memcached round-trips or serde",
+    ["method", "phase"],
+)
+MEMCACHED_ROUNDTRIP_SECONDS = registry.histogram(
+    "memcached_roundtrip_seconds",
+    "One pipelined batch of memcached commands, from write to last reply",
+)
+
+
+def _observe_roundtrip(seconds: float) -> None:
+    MEMCACHED_ROUNDTRIP_SECONDS.observe(seconds)
+    add_phase(MEMCACHED, seconds)
+
 
 class ICacheTaskHandler(Protocol):
-    task_client: PooledClient
+    """Blocking handler used at startup only, before the event loop serves
+    requests: it clears legacy index keys and restores the snapshot
+    """
+
+    task_client: SyncHashClient
     ttl_task_queue: ITaskQueue
-    pairingIndex: List[str]
-    deviceIndex: Dict[str, List[str]]
+    pairingIndex: Dict[str, Set[str]]
+    deviceIndex: Dict[str, Set[str]]
 
     def initIndexes(self) -> None: ...
 
-    def add_device(self, deviceId: str, pairToken: str) -> None: ...
+    def restore(self, entries: List[SnapshotEntry]) -> int:
+        """Reschedule snapshotted pairings that memcached still holds"""
+        ...
+
 
-    def add_pairing(self, pairToken: str) -> None: ...
+class IAsyncCacheTaskHandler(Protocol):
+    """Pairing operations behind the async views"""
 
-    def get_pairing(self, pairToken: str) -> PairInner:
+    task_client: AsyncHashClient
+    ttl_task_queue: ITaskQueue
+    pairingIndex: Dict[str, Set[str]]
+    deviceIndex: Dict[str, Set[str]]
+
+    async def pairing_exists(self, pairToken: str) -> bool: ...
+
+    async def device_exists(self, deviceId: str) -> bool: ...
+
+    async def device_pairings(self, deviceId: str) -> List[str]: ...
+
+    async def get_device_pairings(self, deviceIds: List[str]) -> Dict[str, List[str]]:
+        """Bulk lookup of the pairing tokens stored under each device key"""
+        ...
+
+    async def paired_devices(self, deviceIds: List[str]) -> Set[str]:
+        """The devices among `deviceIds` in a live pairing; bulk device_exists"""
+        ...
+
+    async def get_pairing(self, pairToken: str) -> PairInner:
         """Return pairing information of a known pairing token"""
         ...
 
-    def set_pairing(self, pair: PairInner) -> None: ...
+    async def find_pairing(self, pairToken: str) -> PairInner | None:
+        """The live pairing under `pairToken`, None when it ended or expired"""
+        ...
 
-    def update_pairing_ttl(self, pairToken: str) -> None: ...
+    async def set_pairing(self, pair: PairInner) -> None: ...
 
-    def update_pairing_devices(self, pairToken: str, devices: List[Device]) -> None: ...
+    async def set_pairings(self, pairs: List[PairInner]) -> None:
+        """Store many pairings with one batch of memcached writes"""
+        ...
 
-    def toggle_pairing_open(self, pairToken: str) -> None:
-        """Toggle pairing availability to join a new device"""
+    async def update_pairing_devices(
+        self, pairToken: str, devices: List[Device], openToJoin: bool | None = None
+    ) -> PairInner | None:
+        """Join the devices not yet part of the pairing, optionally closing it.
+        Returns the stored pairing, None when it is gone or closed to joins.
+        Raises PairingContention when concurrent writers keep winning
+        """
         ...
 
-    def cancel_pairing(self, pairToken: str) -> None:
-        """Removes pairing token from the pairing index.
+    async def cancel_pairing(self, pairToken: str) -> None:
+        """Removes pairing token from the pairing index and the TTL queue.
         The pairing object will be left to expire on its own
         """
         ...
 
-    def transfer_pairing(self, oldPairToken: str, newPairToken: str, ttl: int) -> None:
-        """Transfer pairing information from one token to another"""
+    async def transfer_pairing(
+        self, oldPairToken: str, newPairToken: str, ttl: int
+    ) -> bool:
+        """Transfer pairing information from one token to another. Returns
+        False when the old token is gone or another transfer claimed it
+        """
+        ...
+
+    async def remove_device(self, deviceId: str) -> int:
+        """Take a device out of every pairing it is in with one read and one
+        write batch. Returns the number of pairings it left
+        """
+        ...
+
+    async def toggle_device(self, deviceId: str) -> bool | None:
+        """Flip a device's availability in every pairing it is in. Returns the
+        new availability, None when the device is in no pairing
+        """
+        ...
+
+    async def join_group(self, pairToken: str, device: Device) -> int | None:
+        """Add a receiver to a group pairing. Returns its receiver count,
+        0 when the group is full and None when it is gone or closed
+        """
+        ...
+
+    async def leave_group(self, pairToken: str, deviceId: str) -> bool:
+        """Remove a receiver from a group pairing; its source cannot leave"""
         ...
 
-    def remove_device(self, deviceId: str) -> None: ...
+    async def set_member_available(self, pairToken: str, device: Device) -> bool:
+        """Record a group member's availability"""
+        ...
+
+    async def evict_expired(self, pairTokens: List[str]) -> int:
+        """Drop expired pairings from every index in one batch.
+        Shared indexes prune themselves on read, so only local mode reclaims here
+        """
+        ...
+
+
+def _link(pairToken: str) -> TokenUpdate:
+    return lambda tokens: tokens + [pairToken]
+
+
+def _unlink(pairToken: str) -> TokenUpdate:
+    return lambda tokens: [token for token in tokens if token != pairToken]
+
+
+def _unlink_all(pairTokens: Set[str]) -> TokenUpdate:
+    return lambda tokens: [token for token in tokens if token not in pairTokens]
+
+
+def _chain(updates: List[TokenUpdate]) -> TokenUpdate:
+    return lambda tokens: functools.reduce(
+        lambda acc, update: update(acc), updates, tokens
+    )
 
 
-class CacheTaskHandler:
+class UnitOfWork:
+    """Memcached writes of one logical operation, flushed as one batch.
+
+    A later write to a key replaces the earlier one, so a device moving from
+    the old token to the new one on refresh has its key written once
+    """
+
     def __init__(self):
-        self.task_client: PooledClient = next(generateClient())
+        self.sets: Dict[str, Tuple[Any, int]] = dict()
+        self.deletes: Set[str] = set()
+        # local index mode: device keys rewritten from deviceIndex on flush
+        self.devices: Set[str] = set()
+        # shared index mode: token updates per device key, applied in order by cas
+        self.device_updates: Dict[str, List[TokenUpdate]] = dict()
+        # group membership records and receiver count deltas, after the sets
+        self.appends: Dict[str, bytes] = dict()
+        self.counters: Dict[str, int] = dict()
+
+    def set(self, key: str, value: Any, expire: int = 0) -> None:
+        self.deletes.discard(key)
+        self.sets[key] = (value, expire)
+
+    def delete(self, key: str) -> None:
+        self.sets.pop(key, None)
+        self.deletes.add(key)
+
+    def append(self, key: str, data: bytes) -> None:
+        self.appends[key] = self.appends.get(key, b"") + data
+
+    def count(self, key: str, delta: int) -> None:
+        self.counters[key] = self.counters.get(key, 0) + delta
+
+
+class BaseCacheTaskHandler:
+    """Index bookkeeping shared by the blocking and the asyncio handlers.
+
+    In `local` index mode the in-process pairingIndex (token -> deviceIds) and
+    deviceIndex (deviceId -> tokens) answer every membership check in O(1) and
+    memcached only mirrors them. In `shared` mode memcached
+    is the source of truth, read-modify-write paths go through gets/cas and the
+    local structures stay unused, so any worker can serve any pairing
+    """
+
+    def __init__(
+        self,
+        pairingIndex: Dict[str, Set[str]] | None = None,
+        deviceIndex: Dict[str, Set[str]] | None = None,
+    ):
         self.ttl_task_queue: ITaskQueue = apps.get_app_config("pairing").ttl_task_queue
-        self.pairingIndex: List[str] = list()
-        self.deviceIndex: Dict[str, List[str]] = dict()
+        self.event_broker: IEventBroker = apps.get_app_config("pairing").event_broker
+        self.playback_broker: IPlaybackBroker = apps.get_app_config(
+            "pairing"
+        ).playback_broker
+        self.pairingIndex: Dict[str, Set[str]] = (
+            dict() if pairingIndex is None else pairingIndex
+        )
+        self.deviceIndex: Dict[str, Set[str]] = (
+            dict() if deviceIndex is None else deviceIndex
+        )
+        self.shared: bool = settings.PAIRING_INDEX_MODE == "shared"
+        self.read_cache_ttl: float = settings.PAIRING_INDEX_READ_CACHE_TTL
+        self._read_cache: Dict[str, Tuple[float, Any]] = dict()
+        self.pairing_cache: PairingLRU = PairingLRU(settings.PAIRING_OBJECT_CACHE_SIZE)
 
-    def initIndexes(self) -> None:
-        self._initDeviceIndex()
-        self._initPairingIndex()
+    @staticmethod
+    def _device_key(deviceId: str) -> str:
+        return f"{DEVICE_KEY_PREFIX}{deviceId}"
 
-    def _initDeviceIndex(self) -> None:
-        try:
-            self.task_client.set(
-                "deviceIndex",
-                orjson.dumps({"deviceId": ["pairingToken"]}),
-            )
-        except MemcacheError:
-            logger.error("Device Index initiation failed")
+    @staticmethod
+    def _pairing_key(pairToken: str) -> str:
+        return f"{PAIRING_KEY_PREFIX}{pairToken}"
+
+    @staticmethod
+    def _members_key(pairToken: str) -> str:
+        return f"{MEMBERS_KEY_PREFIX}{pairToken}"
+
+    @staticmethod
+    def _member_count_key(pairToken: str) -> str:
+        return f"{MEMBER_COUNT_KEY_PREFIX}{pairToken}"
 
-    def _initPairingIndex(self) -> None:
+    @staticmethod
+    def _group_header(pair: PairInner) -> PairInner:
+        """A group pairing as stored under its token: only the source node"""
+        return pair.model_copy(update={"nodes": pair.nodes[:1]})
+
+    @staticmethod
+    def _decode_pairing(value: PairInner | bytes | str) -> PairInner:
+        if isinstance(value, PairInner):
+            return value
+        # Entries written before CacheSerde are plain JSON
+        with Phase(SERDE):
+            return PairInner(**orjson.loads(value))
+
+    @staticmethod
+    def _decode_tokens(value: List[str] | bytes | None) -> List[str]:
+        if value is None:
+            return list()
+        if isinstance(value, list):
+            return list(value)
+        with Phase(SERDE):
+            return orjson.loads(value)
+
+    def _remaining_ttl(self, pair: PairInner) -> int:
+        """Seconds the pairing has left, 0 once it expired or when unknown.
+        Callers skip their write at 0: memcached reads expire 0 as never
+        """
+        if pair.expires:
+            return max(0, math.ceil(pair.expires - time.time()))
         try:
-            self.task_client.set(
-                "pairingIndex",
-                orjson.dumps(["pairingToken"]),
+            return self.ttl_task_queue.get_task_state(pair.token).remaining_ttl
+        except KeyError:
+            pass
+        # Pairings created on another worker are not scheduled here
+        if signing_enabled() and is_signed(pair.token):
+            claims = read_token(pair.token)
+            return 0 if claims is None else claims.remaining_ttl
+        return 0
+
+    def _cached(self, key: str) -> Tuple[bool, Any]:
+        entry = self._read_cache.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] < time.monotonic():
+            del self._read_cache[key]
+            return False, None
+        return True, entry[1]
+
+    def _remember(self, key: str, value: Any) -> None:
+        if self.read_cache_ttl <= 0:
+            return
+        now = time.monotonic()
+        if len(self._read_cache) >= READ_CACHE_MAX_SIZE:
+            self._read_cache = {
+                k: entry for k, entry in self._read_cache.items() if entry[0] >= now
+            }
+        if len(self._read_cache) >= READ_CACHE_MAX_SIZE:
+            self._read_cache.clear()
+        self._read_cache[key] = (now + self.read_cache_ttl, value)
+
+    def _forget(self, keys: List[str]) -> None:
+        [self._read_cache.pop(key, None) for key in keys]
+
+    def _cache_pairing(self, pair: PairInner, cas: Any = None) -> None:
+        ttl = self._remaining_ttl(pair)
+        if not ttl:
+            return
+        if pair.capacity:
+            pair = self._group_header(pair)
+        self.pairing_cache.put(
+            pair, ttl, self.read_cache_ttl if self.shared else ttl, cas
+        )
+
+    def _index_devices(
+        self, deviceIds: Iterable[str], pairToken: str, linked: bool
+    ) -> None:
+        members = self.pairingIndex.get(pairToken)
+        for deviceId in deviceIds:
+            if linked:
+                self.deviceIndex.setdefault(deviceId, set()).add(pairToken)
+                if members is not None:
+                    members.add(deviceId)
+                continue
+            tokens = self.deviceIndex.get(deviceId)
+            if tokens is not None:
+                tokens.discard(pairToken)
+                if not tokens:
+                    del self.deviceIndex[deviceId]
+            if members is not None:
+                members.discard(deviceId)
+
+    def _evict_local(self, pairTokens: List[str]) -> Tuple[int, Set[str]]:
+        """Drop expired tokens from the local indexes.
+        Returns the number of index entries reclaimed and the devices touched
+        """
+        reclaimed, touched = 0, set()
+        for pairToken in pairTokens:
+            deviceIds = self.pairingIndex.pop(pairToken, None)
+            if deviceIds is None:
+                continue
+            self._index_devices(deviceIds, pairToken, linked=False)
+            reclaimed += 1 + len(deviceIds)
+            touched |= deviceIds
+        return reclaimed, touched
+
+    def _unindex_device(self, deviceId: str) -> None:
+        for pairToken in self.deviceIndex.pop(deviceId, set()):
+            self.pairingIndex.get(pairToken, set()).discard(deviceId)
+
+    def _device_payloads(
+        self, deviceIds: List[str]
+    ) -> Tuple[Dict[str, List[str]], List[str]]:
+        """Split devices into keys to rewrite and keys left without pairings"""
+        live = {
+            self._device_key(deviceId): list(self.deviceIndex[deviceId])
+            for deviceId in deviceIds
+            if self.deviceIndex.get(deviceId)
+        }
+        stale = [
+            self._device_key(deviceId)
+            for deviceId in deviceIds
+            if not self.deviceIndex.get(deviceId)
+        ]
+        return live, stale
+
+    def _stage_devices(
+        self, uow: UnitOfWork, deviceIds: List[str], pairToken: str, linked: bool
+    ) -> None:
+        if not self.shared:
+            self._index_devices(deviceIds, pairToken, linked)
+            uow.devices.update(deviceIds)
+            return
+        update = _link(pairToken) if linked else _unlink(pairToken)
+        [
+            uow.device_updates.setdefault(self._device_key(deviceId), list()).append(
+                update
             )
-        except MemcacheError:
-            logger.error("Pairing Index initiation failed")
+            for deviceId in deviceIds
+        ]
+
+    def _stage_marker(self, uow: UnitOfWork, pairToken: str, expire: int) -> None:
+        if not self.shared:
+            self.pairingIndex.setdefault(pairToken, set())
+        uow.set(self._pairing_key(pairToken), PAIRING_LIVE, expire)
+
+    def _stage_pairing(self, uow: UnitOfWork, pair: PairInner) -> None:
+        if not pair.expires:
+            pair.expires = int(time.time()) + pair.ttl
+        self._stage_marker(uow, pair.token, pair.ttl)
+        self._stage_devices(
+            uow, [str(node.deviceId) for node in pair.nodes], pair.token, linked=True
+        )
+        if not pair.capacity:
+            uow.set(pair.token, pair, pair.ttl)
+            return
+        # Group members live in a log of their own, so joins never rewrite the pairing
+        uow.set(self._members_key(pair.token), encode_members(pair.nodes), pair.ttl)
+        uow.set(
+            self._member_count_key(pair.token),
+            b"%d" % (len(pair.nodes) - 1),
+            pair.ttl,
+        )
+        uow.set(pair.token, self._group_header(pair), pair.ttl)
+
+    def _stage_drop(
+        self, uow: UnitOfWork, pairToken: str, deviceIds: List[str]
+    ) -> None:
+        self._stage_devices(uow, deviceIds, pairToken, linked=False)
+        self.pairingIndex.pop(pairToken, None)
+        self.pairing_cache.invalidate([pairToken])
+        self._forget([self._pairing_key(pairToken)])
+        uow.delete(self._pairing_key(pairToken))
 
-    def add_device(self, deviceId: str, pairToken: str) -> None:
-        self.deviceIndex[deviceId] = (
-            list()
-            if deviceId not in self.deviceIndex.keys()
-            else self.deviceIndex[deviceId]
+    def _device_writes(self, uow: UnitOfWork) -> Dict[str, TokenUpdate]:
+        """Fold local device keys into the plain writes of the unit of work.
+        Returns the shared mode updates, which still need a gets/cas round
+        """
+        if uow.devices:
+            live, stale = self._device_payloads(list(uow.devices))
+            [uow.set(key, tokens) for key, tokens in live.items()]
+            [uow.delete(key) for key in stale]
+            uow.devices.clear()
+        return {key: _chain(updates) for key, updates in uow.device_updates.items()}
+
+    @staticmethod
+    def _join_devices(
+        devices: List[Device], openToJoin: bool | None, joined: List[Device]
+    ) -> PairingUpdate:
+        def join(pair_obj: PairInner) -> bool:
+            if not pair_obj.openToJoin:
+                logger.info("Pairing not open to add new devices")
+                return False
+            if pair_obj.capacity:
+                logger.info("Group pairings are joined through join_group")
+                return False
+            known = {str(node.deviceId) for node in pair_obj.nodes}
+            joined[:] = [
+                device for device in devices if str(device.deviceId) not in known
+            ]
+            pair_obj.nodes.extend(joined)
+            if openToJoin is not None:
+                pair_obj.openToJoin = openToJoin
+            return True
+
+        return join
+
+    def _stage_join(self, uow: UnitOfWork, pairToken: str, device: Device) -> None:
+        uow.append(
+            self._members_key(pairToken),
+            member_record(device.deviceId, available=device.available),
+        )
+        self._stage_devices(uow, [str(device.deviceId)], pairToken, linked=True)
+
+    def _stage_leave(self, uow: UnitOfWork, pairToken: str, deviceId: str) -> None:
+        uow.append(
+            self._members_key(pairToken), member_record(UUID(deviceId), joined=False)
+        )
+        uow.count(self._member_count_key(pairToken), -1)
+        self._stage_devices(uow, [deviceId], pairToken, linked=False)
+
+    @staticmethod
+    def _leaves(group: PairInner | None, deviceId: str) -> bool:
+        """Whether `deviceId` may leave `group`: a receiver of a group pairing"""
+        return (
+            group is not None
+            and group.capacity > 0
+            and str(group.nodes[0].deviceId) != deviceId
         )
-        self.deviceIndex[deviceId].append(pairToken)
-        self.task_client.replace("deviceIndex", orjson.dumps(self.deviceIndex))
 
-    def add_pairing(self, pairToken: str) -> None:
-        self.pairingIndex.append(pairToken)
-        self.task_client.replace("pairingIndex", self.pairingIndex)
+    def _decode_device(
+        self, pairTokens: List[str], stored: Dict[str, Tuple[Any, Any]]
+    ) -> Tuple[Dict[str, Tuple[PairInner, Any]], Dict[str, Dict[bytes, int]]]:
+        """Split one gets_many of a device's pairings and their member logs into
+        versioned pairings and the member maps of the groups among them
+        """
+        pairs = {
+            pairToken: (
+                self._decode_pairing(stored[pairToken][0]),
+                stored[pairToken][1],
+            )
+            for pairToken in pairTokens
+            if pairToken in stored
+        }
+        members = {
+            pairToken: fold_members(
+                stored.get(self._members_key(pairToken), (None, None))[0] or b""
+            )
+            for pairToken, (pair, _) in pairs.items()
+            if pair.capacity
+        }
+        return pairs, members
+
+    @staticmethod
+    def _available_in(
+        deviceId: str,
+        pairs: Dict[str, Tuple[PairInner, Any]],
+        members: Dict[str, Dict[bytes, int]],
+    ) -> bool:
+        """The device's availability as the first pairing holding it records it"""
+        for pairToken, (pair, _) in pairs.items():
+            if pair.capacity:
+                state = members[pairToken].get(UUID(deviceId).bytes)
+                if state is not None:
+                    return bool(state & MEMBER_AVAILABLE)
+                continue
+            for node in pair.nodes:
+                if str(node.deviceId) == deviceId:
+                    return node.available
+        return False
+
+    @staticmethod
+    def _edit_node(pair: PairInner, deviceId: str, available: bool | None) -> bool:
+        """Drop `deviceId` from the pairing, or set its availability when
+        `available` is given. Returns whether the pairing changed
+        """
+        if available is None:
+            nodes = [node for node in pair.nodes if str(node.deviceId) != deviceId]
+            changed = len(nodes) != len(pair.nodes)
+            pair.nodes = nodes
+            return changed
+        changed = False
+        for node in pair.nodes:
+            if str(node.deviceId) == deviceId and node.available != available:
+                node.available, changed = available, True
+        return changed
 
-    def get_pairing(self, pairToken: str) -> PairInner:
-        return PairInner(**orjson.loads(self.task_client.get(pairToken)))
+    def _stage_device(
+        self,
+        uow: UnitOfWork,
+        deviceId: str,
+        pairs: Dict[str, Tuple[PairInner, Any]],
+        members: Dict[str, Dict[bytes, int]],
+        available: bool | None,
+    ) -> Tuple[Dict[str, Tuple[PairInner, Any]], List[str]]:
+        """Stage a device's removal, or its new availability, across its pairings.
+        Groups only get a member record; returns the one-to-one pairings to
+        rewrite by cas and the pairings that end
+        """
+        rewrites: Dict[str, Tuple[PairInner, Any]] = dict()
+        ended: List[str] = list()
+        uuid = UUID(deviceId)
+        for pairToken, (pair, cas) in pairs.items():
+            if pair.capacity and available is not None:
+                uow.append(
+                    self._members_key(pairToken), availability_record(uuid, available)
+                )
+            elif pair.capacity and str(pair.nodes[0].deviceId) != deviceId:
+                if uuid.bytes in members[pairToken]:
+                    self._stage_leave(uow, pairToken, deviceId)
+            elif not self._edit_node(pair, deviceId, available):
+                continue
+            elif pair.nodes:
+                rewrites[pairToken] = (pair, cas)
+            else:
+                # A pairing left without devices, or a group without its source, ends
+                deviceIds = (
+                    [str(node.deviceId) for node in member_devices(members[pairToken])]
+                    if pair.capacity
+                    else [deviceId]
+                )
+                self._stage_drop(uow, pairToken, deviceIds)
+                ended.append(pairToken)
+        if available is None:
+            # The device leaves every pairing, so its key goes as a whole
+            key = self._device_key(deviceId)
+            self._unindex_device(deviceId)
+            uow.devices.discard(deviceId)
+            uow.device_updates.pop(key, None)
+            uow.delete(key)
+        return rewrites, ended
 
-    def set_pairing(self, pair: PairInner) -> None:
-        self.add_pairing(pair.token)
+    def _device_changed(
+        self,
+        deviceId: str,
+        pairTokens: Iterable[str],
+        written: Dict[str, PairInner],
+        ended: List[str],
+        available: bool | None,
+    ) -> None:
+        self.pairing_cache.invalidate(pairTokens)
+        [self._cache_pairing(pair) for pair in written.values()]
+        device = Device(deviceId=deviceId, available=bool(available))
+        event = "member_left" if available is None else "member_updated"
         [
-            self.add_device(str(node.deviceId), pairToken=pair.token)
-            for node in pair.nodes
+            self.event_broker.member_changed(pairToken, event, device)
+            for pairToken in pairTokens
+            if pairToken not in ended
         ]
-        self.task_client.set(
-            pair.token,
-            pair.model_dump_json(),
-            expire=pair.ttl,
+        for pairToken in ended:
+            self.ttl_task_queue.remove_task(pairToken)
+            self.event_broker.cancelled(pairToken)
+            self.playback_broker.end(pairToken)
+
+    def _live_devices(
+        self, stored: Dict[str, List[str]], markers: Dict[str, Any]
+    ) -> Set[str]:
+        return {
+            deviceId
+            for deviceId, tokens in stored.items()
+            if any(self._pairing_key(pairToken) in markers for pairToken in tokens)
+        }
+
+    def _marker_keys(self, stored: Dict[str, List[str]]) -> List[str]:
+        return list(
+            {
+                self._pairing_key(pairToken)
+                for tokens in stored.values()
+                for pairToken in tokens
+            }
         )
 
-    def update_pairing_ttl(self, pairToken: str) -> None:
-        if not self._check_pairToken_exists(pairToken):
-            logger.error("Token not in pairing index")
-            return
-        pair_obj = PairInner(**orjson.loads(self.task_client.get(pairToken)))
-        pair_obj.ttl = self.ttl_task_queue.get_task_state(pairToken).remaining_ttl
-        self.task_client.replace(
-            pairToken,
-            pair_obj.model_dump_json(),
-            expire=pair_obj.ttl,
+    def _check_pairToken_exists(self, pairToken: str) -> bool:
+        return pairToken in self.pairingIndex
+
+    def _check_deviceId_exists(self, deviceId: str) -> bool:
+        return deviceId in self.deviceIndex
+
+
+class CacheTaskHandler(BaseCacheTaskHandler):
+    """Startup work that runs before the event loop: legacy index cleanup and
+    snapshot restore. Requests go through AsyncCacheTaskHandler
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.task_client: SyncHashClient = next(generateClient())
+
+    def initIndexes(self) -> None:
+        self._dropLegacyIndexes()
+
+    def _dropLegacyIndexes(self) -> None:
+        try:
+            self.task_client.delete_many(["deviceIndex", "pairingIndex"])
+        except MemcacheError:
+            logger.error("Legacy index cleanup failed")
+
+    def restore(self, entries: List[SnapshotEntry]) -> int:
+        # Everything restored is long-lived; collecting mid-load only rescans it
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return self._restore(entries)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _restore(self, entries: List[SnapshotEntry]) -> int:
+        restored = 0
+        for start in range(0, len(entries), RESTORE_BATCH_SIZE):
+            batch = entries[start : start + RESTORE_BATCH_SIZE]
+            try:
+                markers = self.task_client.get_many(
+                    [self._pairing_key(entry.token) for entry in batch]
+                )
+            except MemcacheError as me:
+                logger.error(f"Pairing restore stopped: {me}")
+                break
+            now = time.time()
+            pairs: List[Pair] = list()
+            for token, expires_at, deviceIds in batch:
+                ttl = math.ceil(expires_at - now)
+                # Cancelled, transferred or evicted while this process was down
+                if ttl <= 0 or markers.get(self._pairing_key(token)) != PAIRING_LIVE:
+                    continue
+                # Snapshot entries were validated when first created
+                pairs.append(Pair.model_construct(token=token, ttl=ttl))
+                if not self.shared:
+                    self.pairingIndex[token] = set(deviceIds)
+                    [
+                        self.deviceIndex.setdefault(deviceId, set()).add(token)
+                        for deviceId in deviceIds
+                    ]
+                restored += 1
+            self.ttl_task_queue.register_tasks(pairs)
+        return restored
+
+
+class AsyncCacheTaskHandler(BaseCacheTaskHandler):
+    def __init__(
+        self,
+        pairingIndex: Dict[str, Set[str]] | None = None,
+        deviceIndex: Dict[str, Set[str]] | None = None,
+    ):
+        super().__init__(pairingIndex=pairingIndex, deviceIndex=deviceIndex)
+        self.task_client: AsyncHashClient = next(generateAsyncClient())
+        if registry.enabled:
+            self.task_client.observer = _observe_roundtrip
+
+    async def _read(self, key: str) -> Any:
+        hit, value = self._cached(key)
+        if not hit:
+            value = await self.task_client.get(key)
+            self._remember(key, value)
+        return value
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def pairing_exists(self, pairToken: str) -> bool:
+        if not self.shared:
+            return self._check_pairToken_exists(pairToken)
+        return await self._read(self._pairing_key(pairToken)) == PAIRING_LIVE
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def device_pairings(self, deviceId: str) -> List[str]:
+        if not self.shared:
+            return list(self.deviceIndex.get(deviceId, set()))
+        tokens = self._decode_tokens(await self._read(self._device_key(deviceId)))
+        if not tokens:
+            return tokens
+        # Device keys outlive their pairings; prune tokens whose marker expired
+        markers = await self.task_client.get_many(
+            [self._pairing_key(pairToken) for pairToken in tokens]
         )
+        expired = {
+            pairToken
+            for pairToken in tokens
+            if self._pairing_key(pairToken) not in markers
+        }
+        if expired:
+            await self._cas_devices({self._device_key(deviceId): _unlink_all(expired)})
+            logger.info(f"Pruned {len(expired)} expired pairings of device {deviceId}")
+        return [pairToken for pairToken in tokens if pairToken not in expired]
 
-    def update_pairing_devices(self, pairToken: str, devices: List[Device]) -> None:
-        if not self._check_pairToken_exists(pairToken):
-            logger.error("Token not in pairing index")
-            return
-        pair_obj = PairInner(**orjson.loads(self.task_client.get(pairToken)))
-        if not pair_obj.openToJoin:
-            logger.info("Pairing not open to add new devices")
-            return
+    @phased(CACHE_HANDLER_SECONDS)
+    async def device_exists(self, deviceId: str) -> bool:
+        if not self.shared:
+            return self._check_deviceId_exists(deviceId)
+        return len(await self.device_pairings(deviceId)) > 0
+
+    async def _flush(self, uow: UnitOfWork) -> None:
+        """Write the unit of work in one pipelined batch.
+        Plain writes go out `noreply`; in shared mode the device read rides
+        along as the acknowledged command and the cas round follows
+        """
+        updates = self._device_writes(uow)
+        pipeline = self.task_client.pipeline()
         [
-            self.add_device(str(device.deviceId), pairToken)
-            for device in devices
-            if str(device.deviceId) not in self.deviceIndex
+            pipeline.set(key, value, expire, noreply=True)
+            for key, (value, expire) in uow.sets.items()
         ]
-        pair_obj.nodes = devices
-        self.task_client.replace(
-            pairToken,
-            pair_obj.model_dump_json(),
-            expire=self.ttl_task_queue.get_task_state(pairToken).remaining_ttl,
+        [pipeline.append(key, data, noreply=True) for key, data in uow.appends.items()]
+        [
+            pipeline.incr(key, delta, noreply=True)
+            if delta > 0
+            else pipeline.decr(key, -delta, noreply=True)
+            for key, delta in uow.counters.items()
+            if delta
+        ]
+        [pipeline.delete(key, noreply=True) for key in uow.deletes]
+        if not updates:
+            await pipeline.execute()
+            return
+        pipeline.gets_many(list(updates))
+        stored = (await pipeline.execute())[-1]
+        await self._cas_devices(updates, stored)
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def evict_expired(self, pairTokens: List[str]) -> int:
+        self.pairing_cache.invalidate(pairTokens)
+        if self.shared:
+            return 0
+        reclaimed, touched = self._evict_local(pairTokens)
+        uow = UnitOfWork()
+        uow.devices.update(touched)
+        await self._flush(uow)
+        if reclaimed:
+            logger.info(f"Reclaimed {reclaimed} index entries of expired pairings")
+        return reclaimed
+
+    async def _cas_devices(
+        self,
+        updates: Dict[str, TokenUpdate],
+        stored: Dict[str, Tuple[Any, int | None]] | None = None,
+    ) -> None:
+        self._forget(list(updates))
+        for _ in range(CAS_RETRIES):
+            if not updates:
+                return
+            if stored is None:
+                stored = await self.task_client.gets_many(list(updates))
+            pipeline, writes = self.task_client.pipeline(), list()
+            for key, update in updates.items():
+                value, cas = stored.get(key, (None, None))
+                tokens = update(self._decode_tokens(value))
+                if value is None and tokens:
+                    pipeline.add(key, tokens)
+                    writes.append(key)
+                elif value is not None:
+                    # Emptied keys linger briefly so a racing writer still sees them
+                    pipeline.cas(key, tokens, cas, expire=0 if tokens else 1)
+                    writes.append(key)
+            results = await pipeline.execute()
+            updates = {
+                key: updates[key]
+                for key, stored_ok in zip(writes, results)
+                if not stored_ok
+            }
+            stored = None
+        logger.error(f"Device index update gave up after {CAS_RETRIES} attempts")
+
+    async def _update_pairing(
+        self, pairToken: str, update: PairingUpdate
+    ) -> PairInner | None:
+        # A cached CAS version saves the `gets` unless another writer got there first
+        versioned = self.pairing_cache.versioned(pairToken)
+        for _ in range(CAS_RETRIES):
+            cached = versioned is not None
+            if cached:
+                (cas, pair_obj), versioned = versioned, None
+            else:
+                value, cas = await self.task_client.gets(pairToken)
+                if value is None:
+                    self.pairing_cache.invalidate([pairToken])
+                    return None
+                pair_obj = self._decode_pairing(value)
+            if not update(pair_obj):
+                if cached:
+                    continue
+                return None
+            remaining = self._remaining_ttl(pair_obj)
+            if not remaining:
+                # Past its deadline the pairing is a miss, whatever memcached holds
+                self.pairing_cache.invalidate([pairToken])
+                return None
+            if await self.task_client.cas(pairToken, pair_obj, cas, expire=remaining):
+                self._cache_pairing(pair_obj)
+                return pair_obj
+            self.pairing_cache.conflict(pairToken)
+        logger.error(f"Pairing update gave up after {CAS_RETRIES} attempts")
+        raise PairingContention(pairToken)
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def get_device_pairings(self, deviceIds: List[str]) -> Dict[str, List[str]]:
+        stored = await self.task_client.get_many(
+            [self._device_key(deviceId) for deviceId in deviceIds]
         )
+        return {
+            deviceId: self._decode_tokens(stored[self._device_key(deviceId)])
+            for deviceId in deviceIds
+            if self._device_key(deviceId) in stored
+        }
+
+    async def _stored_pairing(self, pairToken: str) -> PairInner | None:
+        """The pairing as stored under its token, so groups without members"""
+        pair = self.pairing_cache.get(pairToken)
+        if pair is None:
+            value, cas = await self.task_client.gets(pairToken)
+            if value is None:
+                return None
+            pair = self._decode_pairing(value)
+            self._cache_pairing(pair, cas)
+        return pair
+
+    async def _group_members(self, group: PairInner) -> List[Device]:
+        key = self._members_key(group.token)
+        log, cas = await self.task_client.gets(key)
+        members = fold_members(log or b"")
+        remaining = self._remaining_ttl(group)
+        if log and remaining and needs_compaction(log, members):
+            # A lost race only leaves the compaction to the next read
+            await self.task_client.cas(key, compacted(members), cas, expire=remaining)
+        return member_devices(members)
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def get_pairing(self, pairToken: str) -> PairInner:
+        pair = await self._stored_pairing(pairToken)
+        if pair is None:
+            raise KeyError(pairToken)
+        if pair.capacity:
+            pair.nodes = await self._group_members(pair)
+        return pair
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def find_pairing(self, pairToken: str) -> PairInner | None:
+        # The value outlives an ended pairing's marker and vanishes on expiry
+        if not await self.pairing_exists(pairToken):
+            return None
+        try:
+            return await self.get_pairing(pairToken)
+        except KeyError:
+            return None
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def paired_devices(self, deviceIds: List[str]) -> Set[str]:
+        if not self.shared:
+            return {
+                deviceId
+                for deviceId in deviceIds
+                if self._check_deviceId_exists(deviceId)
+            }
+        # Stale tokens are left for device_pairings to prune
+        stored = await self.get_device_pairings(deviceIds)
+        markers = await self.task_client.get_many(self._marker_keys(stored))
+        return self._live_devices(stored, markers)
 
-    def toggle_pairing_open(self, pairToken: str) -> None:
-        if not self._check_pairToken_exists(pairToken):
+    @phased(CACHE_HANDLER_SECONDS)
+    async def set_pairing(self, pair: PairInner) -> None:
+        uow = UnitOfWork()
+        self._stage_pairing(uow, pair)
+        await self._flush(uow)
+        self._cache_pairing(pair)
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def set_pairings(self, pairs: List[PairInner]) -> None:
+        uow = UnitOfWork()
+        [self._stage_pairing(uow, pair) for pair in pairs]
+        await self._flush(uow)
+        [self._cache_pairing(pair) for pair in pairs]
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def update_pairing_devices(
+        self, pairToken: str, devices: List[Device], openToJoin: bool | None = None
+    ) -> PairInner | None:
+        if not await self.pairing_exists(pairToken):
             logger.error("Token not in pairing index")
-            return
-        pair_obj = PairInner(**orjson.loads(self.task_client.get(pairToken)))
-        pair_obj.openToJoin != pair_obj.openToJoin
-        self.task_client.replace(
-            pairToken,
-            pair_obj.model_dump_json,
-            expire=self.ttl_task_queue.get_task_state(pairToken).remaining_ttl,
+            return None
+        joined: List[Device] = list()
+        pair_obj = await self._update_pairing(
+            pairToken, self._join_devices(devices, openToJoin, joined)
         )
+        if pair_obj is None:
+            return None
+        uow = UnitOfWork()
+        self._stage_devices(
+            uow, [str(device.deviceId) for device in joined], pairToken, linked=True
+        )
+        await self._flush(uow)
+        self.event_broker.device_joined(pairToken, pair_obj.nodes)
+        return pair_obj
 
-    def cancel_pairing(self, pairToken: str) -> None:
-        if not self._check_pairToken_exists(pairToken):
+    @phased(CACHE_HANDLER_SECONDS)
+    async def cancel_pairing(self, pairToken: str) -> None:
+        if not await self.pairing_exists(pairToken):
             logger.error("Token not in pairing index")
             return
-        pair_obj = PairInner(**orjson.loads(self.task_client.get(pairToken)))
-        [
-            self.deviceIndex[str(node.deviceId)].remove(pairToken)
-            for node in pair_obj.nodes
-        ]
-        self.pairingIndex.remove(pairToken)
-        self.task_client.replace("pairingIndex", orjson.dumps(self.pairingIndex))
+        if self.shared:
+            try:
+                pair_obj = await self.get_pairing(pairToken)
+            except KeyError:
+                logger.info("Pairing expired before it was cancelled")
+                return
+            deviceIds = [str(node.deviceId) for node in pair_obj.nodes]
+        else:
+            deviceIds = list(self.pairingIndex[pairToken])
+        uow = UnitOfWork()
+        self._stage_drop(uow, pairToken, deviceIds)
+        await self._flush(uow)
+        self.ttl_task_queue.remove_task(pairToken)
+        self.event_broker.cancelled(pairToken)
+        self.playback_broker.end(pairToken)
 
-    def transfer_pairing(self, oldPairToken: str, newPairToken: str, ttl: int) -> None:
-        if not self._check_pairToken_exists(oldPairToken):
+    @phased(CACHE_HANDLER_SECONDS)
+    async def transfer_pairing(
+        self, oldPairToken: str, newPairToken: str, ttl: int
+    ) -> bool:
+        if not await self.pairing_exists(oldPairToken):
             logger.error("Token not in pairing index")
-            return
-        self.add_pairing(newPairToken)
-        replacement: PairInner = self.get_pairing(oldPairToken)
+            return False
+        # Claim the old token first so concurrent refreshes cannot fork it
+        marker, cas = await self.task_client.gets(self._pairing_key(oldPairToken))
+        if marker != PAIRING_LIVE or not await self.task_client.cas(
+            self._pairing_key(oldPairToken), PAIRING_CLAIMED, cas
+        ):
+            logger.info("Pairing already transferred")
+            return False
+        replacement: PairInner = await self.get_pairing(oldPairToken)
+        # Dropping the old token and storing the new one is a single batch
+        uow = UnitOfWork()
+        self._stage_drop(
+            uow, oldPairToken, [str(node.deviceId) for node in replacement.nodes]
+        )
         replacement.token = newPairToken
         replacement.ttl = ttl
-        self.task_client.set(newPairToken, replacement.model_dump_json())
-        [
-            self.add_device(str(device.deviceId), newPairToken)
-            for device in replacement.nodes
-        ]
-        self.cancel_pairing(oldPairToken)
+        replacement.expires = int(time.time()) + ttl
+        self._stage_pairing(uow, replacement)
+        await self._flush(uow)
+        self._cache_pairing(replacement)
+        self.event_broker.transferred(oldPairToken, newPairToken, ttl)
+        self.playback_broker.transferred(oldPairToken, newPairToken)
+        return True
 
-    def remove_device(self, deviceId: str) -> None:
-        if not self._check_deviceId_exists(deviceId):
-            logger.error("DeviceId not in device index")
-            return
-        try:
-            pair_objects = [
-                PairInner(**orjson.loads(self.task_client.get(obj)))
-                for obj in self.task_client.get_many(self.deviceIndex[deviceId])
+    async def _read_device(
+        self, deviceId: str
+    ) -> Tuple[Dict[str, Tuple[PairInner, Any]], Dict[str, Dict[bytes, int]]]:
+        """The device's pairings with their cas versions, and the member maps
+        of its groups, from a single gets_many
+        """
+        pairTokens = await self.device_pairings(deviceId)
+        if not pairTokens:
+            return dict(), dict()
+        stored = await self.task_client.gets_many(
+            pairTokens + [self._members_key(pairToken) for pairToken in pairTokens]
+        )
+        return self._decode_device(pairTokens, stored)
+
+    async def _cas_pairings(
+        self,
+        deviceId: str,
+        rewrites: Dict[str, Tuple[PairInner, Any]],
+        available: bool | None,
+    ) -> Dict[str, PairInner]:
+        """Write the rewritten pairings in one pipelined cas batch; pairings
+        another writer changed meanwhile are read again and retried together
+        """
+        written: Dict[str, PairInner] = dict()
+        for _ in range(CAS_RETRIES):
+            # Pairings past their deadline are left to expire, not rewritten
+            remaining = {
+                pairToken: self._remaining_ttl(pair)
+                for pairToken, (pair, _) in rewrites.items()
+            }
+            rewrites = {
+                pairToken: rewrite
+                for pairToken, rewrite in rewrites.items()
+                if remaining[pairToken]
+            }
+            if not rewrites:
+                return written
+            pipeline = self.task_client.pipeline()
+            for pairToken, (pair, cas) in rewrites.items():
+                pipeline.cas(pairToken, pair, cas, expire=remaining[pairToken])
+            results = await pipeline.execute()
+            written.update(
+                {
+                    pairToken: pair
+                    for (pairToken, (pair, _)), stored_ok in zip(
+                        rewrites.items(), results
+                    )
+                    if stored_ok
+                }
+            )
+            conflicts = [
+                pairToken
+                for pairToken, stored_ok in zip(rewrites, results)
+                if not stored_ok
             ]
-            pair_json_objects = {
-                pair.token: pair.model_dump_json()
-                for pair in pair_objects
-                for node in pair.nodes
-                if self._check_pairToken_exists(pair.token)
-                and str(node.deviceId) != deviceId
+            stored = (
+                await self.task_client.gets_many(conflicts) if conflicts else dict()
+            )
+            reread, _ = self._decode_device(conflicts, stored)
+            rewrites = {
+                pairToken: (pair, cas)
+                for pairToken, (pair, cas) in reread.items()
+                if self._edit_node(pair, deviceId, available)
             }
-            self.task_client.set_many(pair_json_objects)
-            del self.deviceIndex[str(deviceId)]
-            self.task_client.replace("deviceIndex", orjson.dumps(self.deviceIndex))
-        except KeyError as ke:
-            logger.error(ke)
-        except MemcacheError as me:
-            logger.error(me)
+        logger.error(f"Device update gave up after {CAS_RETRIES} attempts")
+        return written
 
-    def _check_pairToken_exists(self, pairToken: str) -> bool:
-        return pairToken in self.pairingIndex
+    async def _change_device(
+        self,
+        deviceId: str,
+        pairs: Dict[str, Tuple[PairInner, Any]],
+        members: Dict[str, Dict[bytes, int]],
+        available: bool | None,
+    ) -> None:
+        uow = UnitOfWork()
+        rewrites, ended = self._stage_device(uow, deviceId, pairs, members, available)
+        await self._flush(uow)
+        written = await self._cas_pairings(deviceId, rewrites, available)
+        self._device_changed(deviceId, pairs, written, ended, available)
 
-    def _check_deviceId_exists(self, deviceId: str) -> bool:
-        return deviceId in self.deviceIndex.keys()
+    @phased(CACHE_HANDLER_SECONDS)
+    async def remove_device(self, deviceId: str) -> int:
+        pairs, members = await self._read_device(deviceId)
+        if not pairs and not await self.device_exists(deviceId):
+            logger.error("DeviceId not in device index")
+            return 0
+        await self._change_device(deviceId, pairs, members, None)
+        return len(pairs)
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def toggle_device(self, deviceId: str) -> bool | None:
+        pairs, members = await self._read_device(deviceId)
+        if not pairs:
+            return None
+        available = not self._available_in(deviceId, pairs, members)
+        await self._change_device(deviceId, pairs, members, available)
+        return available
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def join_group(self, pairToken: str, device: Device) -> int | None:
+        group = await self._stored_pairing(pairToken)
+        if group is None or not group.capacity or not group.openToJoin:
+            logger.info("Pairing not open to add new devices")
+            return None
+        # The counter admits receivers atomically across workers
+        count_key = self._member_count_key(pairToken)
+        receivers = await self.task_client.incr(count_key)
+        if receivers is None:
+            return None
+        if receivers > group.capacity:
+            await self.task_client.decr(count_key, noreply=True)
+            return 0
+        uow = UnitOfWork()
+        self._stage_join(uow, pairToken, device)
+        await self._flush(uow)
+        self.event_broker.member_changed(pairToken, "member_joined", device)
+        return receivers
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def leave_group(self, pairToken: str, deviceId: str) -> bool:
+        if not self._leaves(await self._stored_pairing(pairToken), deviceId):
+            return False
+        uow = UnitOfWork()
+        self._stage_leave(uow, pairToken, deviceId)
+        await self._flush(uow)
+        self.event_broker.member_changed(
+            pairToken, "member_left", Device(deviceId=deviceId)
+        )
+        return True
+
+    @phased(CACHE_HANDLER_SECONDS)
+    async def set_member_available(self, pairToken: str, device: Device) -> bool:
+        group = await self._stored_pairing(pairToken)
+        if group is None or not group.capacity:
+            return False
+        uow = UnitOfWork()
+        uow.append(
+            self._members_key(pairToken),
+            availability_record(device.deviceId, device.available),
+        )
+        await self._flush(uow)
+        self.event_broker.member_changed(pairToken, "member_updated", device)
+        return True
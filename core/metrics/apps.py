@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+from .registry import MetricsRegistry, registry
+
+
+class MetricsConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "core.metrics"
+    registry: MetricsRegistry = registry
@@ -0,0 +1,259 @@
+import functools
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from django.conf import settings
+
+# Latency buckets in seconds, from sub-millisecond memcached hits to slow requests
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+type Labels = Tuple[str, ...]
+type Collector = Callable[[], Dict[Labels, float]]
+
+_phases: ContextVar[Dict[str, float] | None] = ContextVar("metric_phases", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class HistogramSeries:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int):
+        self.counts: List[int] = [0] * size
+        self.sum: float = 0.0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Labels, HistogramSeries] = dict()
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = HistogramSeries(len(self.buckets) + 1)
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(
+                    self.labelnames + ("le",), labels + (le,)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {series.sum}")
+            lines.append(f"{self.name}_count{series_labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Labels, float] = dict()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        lines.extend(
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.values.items()
+        )
+        return lines
+
+
+class Gauge:
+    """Sampled on every scrape from `collect`, so the hot path pays nothing"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Collector,
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        lines.extend(
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.collect().items()
+        )
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.metrics: Dict[str, Histogram | Counter | Gauge] = dict()
+
+    def _register[M: (Histogram, Counter, Gauge)](self, metric: M) -> M:
+        # Re-registering keeps the first instance so module reloads share series
+        return self.metrics.setdefault(metric.name, metric)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        collect: Collector,
+        labelnames: Sequence[str] = (),
+    ) -> Gauge:
+        # Gauges are replaced so the collector always points at live objects
+        self.metrics[name] = Gauge(name, documentation, collect, labelnames)
+        return self.metrics[name]
+
+    def render(self) -> bytes:
+        """Prometheus text exposition format 0.0.4"""
+        lines: List[str] = list()
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode()
+
+
+registry = MetricsRegistry(enabled=getattr(settings, "METRICS_ENABLED", True))
+
+
+def add_phase(phase: str, seconds: float) -> None:
+    """Attribute time to a phase of the innermost `phased` call, if any"""
+    phases = _phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class Phase:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        add_phase(self.name, time.perf_counter() - self.started)
+
+
+def timed[**P, R](
+    histogram: Histogram, *labels: str
+) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    """Observe the wall time of every call of a coroutine function"""
+
+    def decorate(fn: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        if not registry.enabled:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+
+        return wrapper
+
+    return decorate
+
+
+def phased[**P, R](
+    histogram: Histogram, label: str | None = None
+) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    """Like `timed`, labelled with the function name by default and with the
+    time split into phases reported through `Phase` or `add_phase` while the
+    call runs; phases also roll up into the caller
+    """
+
+    def decorate(fn: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        if not registry.enabled:
+            return fn
+        name = label or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            phases: Dict[str, float] = dict()
+            token = _phases.set(phases)
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                _phases.reset(token)
+                histogram.observe(elapsed, name, "total")
+                for phase, seconds in phases.items():
+                    histogram.observe(seconds, name, phase)
+                    add_phase(phase, seconds)
+
+        return wrapper
+
+    return decorate
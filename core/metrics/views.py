@@ -0,0 +1,12 @@
+from django.http import HttpResponse, HttpResponseNotAllowed
+
+from .registry import registry
+
+
+async def metrics(request) -> HttpResponse | HttpResponseNotAllowed:
+    if request.method not in ["GET"]:
+        return HttpResponseNotAllowed(permitted_methods=["GET"])
+    return HttpResponse(
+        content=registry.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
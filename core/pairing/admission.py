@@ -0,0 +1,76 @@
+import math
+import time
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.http import HttpRequest
+
+MAX_BUCKETS = 65536
+
+
+class TokenBucket:
+    """Per-key token buckets refilling at `rate` tokens per second up to `burst`.
+
+    Buckets live in one dict of (tokens, updated) pairs; once it holds
+    `max_keys` entries the full ones, which are no different from fresh ones,
+    are dropped
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = MAX_BUCKETS):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self.buckets: Dict[str, Tuple[float, float]] = dict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _level(self, key: str, now: float) -> float:
+        entry = self.buckets.get(key)
+        if entry is None:
+            return self.burst
+        return min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+
+    def acquire(self, key: str) -> float:
+        """Take a token for `key`. Returns 0 when granted, otherwise the
+        seconds until one will be available
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        tokens = self._level(key, now)
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+        if key not in self.buckets and len(self.buckets) >= self.max_keys:
+            self._prune(now)
+        self.buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def _prune(self, now: float) -> None:
+        self.buckets = {
+            key: entry
+            for key, entry in self.buckets.items()
+            if self._level(key, now) < self.burst
+        }
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.clear()
+
+
+device_limiter = TokenBucket(
+    getattr(settings, "PAIRING_DEVICE_RATE", 0),
+    getattr(settings, "PAIRING_DEVICE_BURST", 1),
+)
+ip_limiter = TokenBucket(
+    getattr(settings, "PAIRING_IP_RATE", 0),
+    getattr(settings, "PAIRING_IP_BURST", 1),
+)
+
+
+def client_ip(request: HttpRequest) -> str:
+    return request.META.get("REMOTE_ADDR") or ""
+
+
+def retry_after(seconds: float) -> str:
+    """Retry-After header value; whole seconds, at least one"""
+    return str(max(1, math.ceil(seconds)))
@@ -1,8 +1,13 @@
 import asyncio
 import logging
 
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
+from django.conf import settings
 
+from core.metrics.registry import registry
+
+from .events import IEventBroker, PairingEventBroker
+from .playback import PLAYBACK_LEAD_MS, IPlaybackBroker, PlaybackBroker
 from .schema import Pair
 from .tasks import ITaskQueue, TTLTaskQueue
 
@@ -13,12 +18,68 @@ logger = logging.getLogger(__name__)
 class PairingConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core.pairing"
-    ttl_task_queue: ITaskQueue[Pair] = TTLTaskQueue()
+    ttl_task_queue: ITaskQueue[Pair] = TTLTaskQueue(
+        capacity=getattr(settings, "PAIRING_CAPACITY", 0)
+    )
+    event_broker: IEventBroker = PairingEventBroker(ttl_task_queue)
+    playback_broker: IPlaybackBroker = PlaybackBroker(
+        lead_ms=getattr(settings, "PLAYBACK_LEAD_MS", PLAYBACK_LEAD_MS)
+    )
+    processor: asyncio.Task | None = None
+    sweeper: asyncio.Task | None = None
 
     def ready(self):
         super().ready()
-        try:
-            # TODO: Handle graceful shutdown on SIGINT signal
-            processor = asyncio.create_task(self.ttl_task_queue.process())
-        except Exception as e:
-            logger.error(str(e))
+        self.ttl_task_queue.add_expiry_listener(self.event_broker.expire)
+        self.ttl_task_queue.add_expiry_listener(self.playback_broker.expire)
+        registry.gauge(
+            "ttl_queue_depth",
+            "Live pairings scheduled for expiry",
+            lambda: {(): self.ttl_task_queue._queue_length},
+        )
+        registry.gauge(
+            "ttl_queue_heap_entries",
+            "Deadline heap entries, including superseded ones awaiting compaction",
+            lambda: {(): len(self.ttl_task_queue.deadlines)},
+        )
+        registry.gauge(
+            "pairing_event_subscribers",
+            "Open Server-Sent-Events streams",
+            lambda: {
+                (): sum(len(subs) for subs in self.event_broker.subscribers.values())
+            },
+        )
+        registry.gauge(
+            "playback_mirrors",
+            "Pairings with playback being mirrored",
+            lambda: {(): len(self.playback_broker.mirrors)},
+        )
+        registry.gauge(
+            "playback_subscribers",
+            "Open playback streams of destination devices",
+            lambda: {
+                (): sum(len(subs) for subs in self.playback_broker.subscribers.values())
+            },
+        )
+
+    async def startup(self) -> None:
+        # Started on the server's loop by the ASGI lifespan, see djMirror.asgi
+        self.processor = asyncio.create_task(self.ttl_task_queue.process())
+        cache_handler = apps.get_app_config("cacheManager").async_cache_handler
+        self.sweeper = asyncio.create_task(
+            self.event_broker.run_sweeps(cache_handler.pairing_exists)
+        )
+
+    async def drain(self) -> None:
+        """End push streams and let the scheduler finish its current tick"""
+        self.event_broker.close()
+        self.playback_broker.close()
+        self.ttl_task_queue.shutdown()
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            try:
+                await self.sweeper
+            except asyncio.CancelledError:
+                pass
+        if self.processor is not None:
+            await self.processor
@@ -0,0 +1,43 @@
+import statistics
+import time
+from typing import List, NamedTuple, Tuple
+
+# Fraction of the samples, lowest round trip first, the offset is taken from.
+# The player's src/pairing/clock.ts estimates the same way
+BEST_SAMPLES = 0.25
+
+
+def server_time_ms() -> float:
+    """Epoch milliseconds on the server clock, the time base of scheduled playback"""
+    return time.time() * 1e3
+
+
+class ClockSample(NamedTuple):
+    """One NTP-style exchange in milliseconds: client send (t0), server
+    receive (t1), server send (t2) and client receive (t3)
+    """
+
+    t0: float
+    t1: float
+    t2: float
+    t3: float
+
+    @property
+    def offset(self) -> float:
+        """Server clock minus client clock, assuming symmetric network delays"""
+        return ((self.t1 - self.t0) + (self.t2 - self.t3)) / 2
+
+    @property
+    def rtt(self) -> float:
+        return (self.t3 - self.t0) - (self.t2 - self.t1)
+
+
+def estimate_offset(samples: List[ClockSample]) -> Tuple[float, float]:
+    """Median offset of the lowest-RTT samples, and the lowest RTT.
+
+    Queueing delay inflates the round trip and is rarely symmetric, so the
+    fastest exchanges carry the least offset error
+    """
+    best = sorted(samples, key=lambda sample: sample.rtt)
+    best = best[: max(1, int(len(best) * BEST_SAMPLES))]
+    return statistics.median(sample.offset for sample in best), best[0].rtt
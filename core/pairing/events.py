@@ -0,0 +1,279 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Protocol, Set
+
+from .schema import Device, Pair, PairingEvent, codec
+from .tasks import ITaskQueue
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_BUFFER = 32
+HEARTBEAT_SECONDS = 30
+LONG_POLL_SECONDS = 25
+# Pairings scheduled on other workers expire without this one hearing of it
+WATCH_SWEEP_SECONDS = 60
+FINAL_EVENTS = ("cancelled", "expired")
+PAIRING_EVENT_JSON = codec(PairingEvent)
+
+
+class Subscription:
+    def __init__(self, token: str):
+        self.token: str = token
+        self.queue: asyncio.Queue[PairingEvent] = asyncio.Queue(SUBSCRIBER_BUFFER)
+
+    def offer(self, event: PairingEvent) -> None:
+        # Slow readers lose their oldest event instead of stalling publishers
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class PairingWatch:
+    """Version counter of one pairing; waiters hold the event of the current version"""
+
+    def __init__(self):
+        self.version: int = 0
+        self.last: PairingEvent | None = None
+        self.changed: asyncio.Event = asyncio.Event()
+        self.waiters: int = 0
+
+    def notify(self, event: PairingEvent) -> PairingEvent:
+        self.version += 1
+        self.last = event.model_copy(update={"version": self.version})
+        # Swap the event so late waiters block until the next change
+        self.changed.set()
+        self.changed = asyncio.Event()
+        return self.last
+
+
+class IEventBroker(Protocol):
+    ttl_task_queue: ITaskQueue[Pair]
+    subscribers: Dict[str, Set[Subscription]]
+    watches: Dict[str, PairingWatch]
+    available: bool
+
+    def subscribe(self, token: str) -> Subscription: ...
+
+    def unsubscribe(self, subscription: Subscription) -> None: ...
+
+    def publish(self, event: PairingEvent) -> None: ...
+
+    def device_joined(self, token: str, nodes: List[Device]) -> None: ...
+
+    def member_changed(self, token: str, event: str, device: Device) -> None:
+        """Change of one pairing member; the event carries only that member"""
+        ...
+
+    def transferred(self, oldToken: str, newToken: str, ttl: int) -> None:
+        """Move subscribers of the old token to the new one and notify them"""
+        ...
+
+    def cancelled(self, token: str) -> None: ...
+
+    async def expire(self, tokens: List[str]) -> int: ...
+
+    async def sweep(self, exists: Callable[[str], Awaitable[bool]]) -> int:
+        """End the watches and streams of pairings not scheduled on this worker
+        that `exists` no longer finds
+        """
+        ...
+
+    async def run_sweeps(
+        self,
+        exists: Callable[[str], Awaitable[bool]],
+        interval: float = WATCH_SWEEP_SECONDS,
+    ) -> None: ...
+
+    async def wait(
+        self, token: str, version: int, timeout: float = LONG_POLL_SECONDS
+    ) -> PairingEvent:
+        """Return the latest change once its version differs from `version`,
+        or the current ttl when nothing changed within `timeout` seconds
+        """
+        ...
+
+    def stream(self, token: str) -> AsyncIterator[bytes]:
+        """Server-Sent-Events byte stream of one pairing, ending on expiry"""
+        ...
+
+    def close(self) -> None:
+        """End every stream and long poll so shutdown is not held by them"""
+        ...
+
+
+class PairingEventBroker:
+    def __init__(self, ttl_task_queue: ITaskQueue[Pair]):
+        self.ttl_task_queue: ITaskQueue[Pair] = ttl_task_queue
+        self.subscribers: Dict[str, Set[Subscription]] = dict()
+        self.watches: Dict[str, PairingWatch] = dict()
+        self.available: bool = True
+
+    def subscribe(self, token: str) -> Subscription:
+        subscription = Subscription(token)
+        self.subscribers.setdefault(token, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self.subscribers.get(subscription.token)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.subscribers[subscription.token]
+
+    def publish(self, event: PairingEvent) -> None:
+        event = self._signal(event.token, event)
+        for subscription in self.subscribers.get(event.token, set()):
+            subscription.offer(event)
+
+    def _signal(self, token: str, event: PairingEvent) -> PairingEvent:
+        watch = self.watches.setdefault(token, PairingWatch())
+        event = watch.notify(event)
+        if event.event in FINAL_EVENTS:
+            del self.watches[token]
+        return event
+
+    def device_joined(self, token: str, nodes: List[Device]) -> None:
+        self.publish(
+            PairingEvent(event="joined", token=token, ttl=self._ttl(token), nodes=nodes)
+        )
+
+    def member_changed(self, token: str, event: str, device: Device) -> None:
+        self.publish(
+            PairingEvent(event=event, token=token, ttl=self._ttl(token), nodes=[device])
+        )
+
+    def transferred(self, oldToken: str, newToken: str, ttl: int) -> None:
+        subscriptions = self.subscribers.pop(oldToken, set())
+        for subscription in subscriptions:
+            subscription.token = newToken
+        if subscriptions:
+            self.subscribers.setdefault(newToken, set()).update(subscriptions)
+        # The watch follows the pairing so versions keep counting across refreshes
+        watch = self.watches.pop(oldToken, None)
+        if watch is not None:
+            self.watches[newToken] = watch
+        self.publish(PairingEvent(event="refresh", token=newToken, ttl=ttl))
+
+    def cancelled(self, token: str) -> None:
+        self.publish(PairingEvent(event="cancelled", token=token))
+
+    async def expire(self, tokens: List[str]) -> int:
+        notified = 0
+        for token in tokens:
+            if token in self.subscribers or token in self.watches:
+                self.publish(PairingEvent(event="expired", token=token))
+                notified += 1
+        return notified
+
+    async def sweep(self, exists: Callable[[str], Awaitable[bool]]) -> int:
+        # Local expiries reach expire() through the TTL queue listener
+        tokens = [
+            token
+            for token in set(self.watches) | set(self.subscribers)
+            if not self._ttl(token)
+        ]
+        ended = 0
+        for token in tokens:
+            if not await exists(token):
+                self.publish(PairingEvent(event="expired", token=token))
+                ended += 1
+        if ended:
+            logger.info(f"Swept {ended} watches of pairings gone elsewhere")
+        return ended
+
+    async def run_sweeps(
+        self,
+        exists: Callable[[str], Awaitable[bool]],
+        interval: float = WATCH_SWEEP_SECONDS,
+    ) -> None:
+        while self.available:
+            await asyncio.sleep(interval)
+            await self.sweep(exists)
+
+    async def wait(
+        self, token: str, version: int, timeout: float = LONG_POLL_SECONDS
+    ) -> PairingEvent:
+        watch = self.watches.setdefault(token, PairingWatch())
+        if watch.version == version and self.available:
+            changed = watch.changed
+            watch.waiters += 1
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except TimeoutError:
+                pass
+            finally:
+                watch.waiters -= 1
+            # Watches that never saw a change belong to no one once idle
+            if (
+                not (watch.waiters or watch.version)
+                and self.watches.get(token) is watch
+            ):
+                del self.watches[token]
+        if watch.last is not None and watch.version != version:
+            return watch.last
+        return PairingEvent(
+            event="ttl", token=token, ttl=self._ttl(token), version=watch.version
+        )
+
+    def _ttl(self, token: str) -> int:
+        try:
+            return self.ttl_task_queue.get_task_state(token).remaining_ttl
+        except KeyError:
+            return 0
+
+    @staticmethod
+    def encode(event: PairingEvent) -> bytes:
+        return b"event: %s\ndata: %s\n\n" % (
+            event.event.encode(),
+            PAIRING_EVENT_JSON.encode(event),
+        )
+
+    async def stream(self, token: str) -> AsyncIterator[bytes]:
+        subscription = self.subscribe(token)
+        try:
+            yield self.encode(
+                PairingEvent(event="ttl", token=token, ttl=self._ttl(token))
+            )
+            while self.available:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.queue.get(), HEARTBEAT_SECONDS
+                    )
+                except TimeoutError:
+                    event = PairingEvent(
+                        event="ttl",
+                        token=subscription.token,
+                        ttl=self._ttl(subscription.token),
+                    )
+                yield self.encode(event)
+                if event.event in FINAL_EVENTS:
+                    return
+        finally:
+            self.unsubscribe(subscription)
+            self._release(subscription.token)
+
+    def _release(self, token: str) -> None:
+        """Drop the watch of a pairing nobody streams or long polls anymore"""
+        watch = self.watches.get(token)
+        if watch is not None and not watch.waiters and token not in self.subscribers:
+            del self.watches[token]
+
+    def close(self) -> None:
+        if not self.available:
+            return
+        logger.info("Closing pairing event streams")
+        self.available = False
+        # A last ttl event wakes each stream, which then ends; EventSource reconnects
+        for subscriptions in self.subscribers.values():
+            for subscription in subscriptions:
+                subscription.offer(
+                    PairingEvent(
+                        event="ttl",
+                        token=subscription.token,
+                        ttl=self._ttl(subscription.token),
+                    )
+                )
+        # Long polls answer with the current ttl, as if they had timed out
+        for watch in self.watches.values():
+            watch.changed.set()
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Protocol, Set, Tuple
+
+from .clock import server_time_ms
+from .events import HEARTBEAT_SECONDS
+from .schema import Mirror, PlaybackEvent, codec
+
+logger = logging.getLogger(__name__)
+
+MIRROR_BUFFER = 64
+# Commands without a start time take effect this long after the server gets
+# them, so every device has received them by then
+PLAYBACK_LEAD_MS = 150
+PLAYBACK_EVENT_JSON = codec(PlaybackEvent)
+
+
+class MirrorState:
+    """Playback of one mirror: at server time `at` (ms) it is at `position`
+    seconds, advancing from there while playing
+    """
+
+    def __init__(self, mirror: Mirror, seq: int = 0):
+        self.mirror: Mirror = mirror
+        self.playing: bool = False
+        self.position: float = 0.0
+        self.at: float = server_time_ms()
+        self.seq: int = seq
+
+    def position_at(self, at: float) -> float:
+        if not self.playing:
+            return self.position
+        return self.position + max(0.0, at - self.at) / 1e3
+
+    def apply(self, action: str, position: float, at: float) -> PlaybackEvent:
+        self.position, self.at = position, at
+        if action == "play":
+            self.playing = True
+        elif action in ("pause", "stop"):
+            self.playing = False
+        self.seq += 1
+        return self.event(action)
+
+    def event(self, action: str) -> PlaybackEvent:
+        return PlaybackEvent.model_construct(
+            event=action,
+            pairToken=self.mirror.pairToken,
+            shareUrl=self.mirror.shareUrl,
+            position=round(self.position, 3),
+            at=round(self.at, 3),
+            playing=self.playing,
+            seq=self.seq,
+            platformArgs=self.mirror.platformArgs if action == "load" else dict(),
+        )
+
+
+class MirrorSubscriber:
+    """Undelivered events of one destination device, at most MIRROR_BUFFER.
+
+    A newer seek replaces the pending ones and a load replaces everything; a
+    subscriber that still overflows is resynced from the mirror state once it
+    reads again, so a slow device never holds up the publisher
+    """
+
+    def __init__(self, token: str, deviceId: str):
+        self.token: str = token
+        self.deviceId: str = deviceId
+        self.pending: Deque[Tuple[str, bytes]] = deque()
+        self.ready: asyncio.Event = asyncio.Event()
+        self.resync: bool = False
+        self.closed: bool = False
+
+    def offer(self, action: str, data: bytes) -> None:
+        if action == "load":
+            self.pending.clear()
+            self.resync = False
+        elif action == "seek" and self.pending:
+            self.pending = deque(entry for entry in self.pending if entry[0] != "seek")
+        if len(self.pending) >= MIRROR_BUFFER:
+            self.pending.clear()
+            self.resync = True
+        else:
+            self.pending.append((action, data))
+        self.ready.set()
+
+
+class IPlaybackBroker(Protocol):
+    mirrors: Dict[str, MirrorState]
+    subscribers: Dict[str, Set[MirrorSubscriber]]
+    available: bool
+
+    def start(self, mirror: Mirror) -> PlaybackEvent:
+        """Replace the pairing's mirror and send `load` to its destinations"""
+        ...
+
+    def command(
+        self, token: str, action: str, position: float, at: float | None = None
+    ) -> PlaybackEvent | None:
+        """Apply an action at server time `at`, by default PLAYBACK_LEAD_MS from now"""
+        ...
+
+    def source(self, token: str) -> str | None:
+        """Device id publishing the pairing's mirror, if one is running"""
+        ...
+
+    def transferred(self, oldToken: str, newToken: str) -> None: ...
+
+    def end(self, token: str) -> None:
+        """Stop the mirror and end the streams of a pairing that is gone"""
+        ...
+
+    async def expire(self, tokens: List[str]) -> int: ...
+
+    def stream(self, token: str, deviceId: str) -> AsyncIterator[bytes]:
+        """Server-Sent-Events byte stream of a pairing's playback for one device"""
+        ...
+
+    def close(self) -> None: ...
+
+
+class PlaybackBroker:
+    def __init__(self, lead_ms: float = PLAYBACK_LEAD_MS):
+        self.lead_ms = lead_ms
+        self.mirrors: Dict[str, MirrorState] = dict()
+        self.subscribers: Dict[str, Set[MirrorSubscriber]] = dict()
+        self.available: bool = True
+
+    @staticmethod
+    def encode(event: PlaybackEvent) -> bytes:
+        return b"event: %s\ndata: %s\n\n" % (
+            event.event.encode(),
+            PLAYBACK_EVENT_JSON.encode(event),
+        )
+
+    def _publish(
+        self, state: MirrorState, action: str, position: float, at: float | None
+    ) -> PlaybackEvent:
+        if at is None:
+            at = server_time_ms() + self.lead_ms
+        event = state.apply(action, position, at)
+        # Encoded once however many devices mirror it
+        data = self.encode(event)
+        for subscriber in self.subscribers.get(state.mirror.pairToken, set()):
+            subscriber.offer(action, data)
+        return event
+
+    def start(self, mirror: Mirror) -> PlaybackEvent:
+        previous = self.mirrors.get(mirror.pairToken)
+        state = MirrorState(mirror, seq=0 if previous is None else previous.seq)
+        self.mirrors[mirror.pairToken] = state
+        return self._publish(state, "load", 0.0, None)
+
+    def command(
+        self, token: str, action: str, position: float, at: float | None = None
+    ) -> PlaybackEvent | None:
+        state = self.mirrors.get(token)
+        if state is None:
+            return None
+        event = self._publish(state, action, position, at)
+        if action == "stop":
+            del self.mirrors[token]
+        return event
+
+    def source(self, token: str) -> str | None:
+        state = self.mirrors.get(token)
+        return None if state is None else str(state.mirror.nodeSource.deviceId)
+
+    def subscribe(self, token: str, deviceId: str) -> MirrorSubscriber:
+        subscriber = MirrorSubscriber(token, deviceId)
+        self.subscribers.setdefault(token, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: MirrorSubscriber) -> None:
+        subscribers = self.subscribers.get(subscriber.token)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.subscribers[subscriber.token]
+
+    def transferred(self, oldToken: str, newToken: str) -> None:
+        state = self.mirrors.pop(oldToken, None)
+        if state is not None:
+            state.mirror.pairToken = newToken
+            self.mirrors[newToken] = state
+        subscribers = self.subscribers.pop(oldToken, set())
+        for subscriber in subscribers:
+            subscriber.token = newToken
+        if subscribers:
+            self.subscribers.setdefault(newToken, set()).update(subscribers)
+
+    def end(self, token: str) -> None:
+        state = self.mirrors.get(token)
+        if state is not None:
+            # Not before a command still scheduled to happen
+            at = max(server_time_ms(), state.at)
+            self.command(token, "stop", state.position_at(at), at)
+        for subscriber in self.subscribers.get(token, set()):
+            subscriber.closed = True
+            subscriber.ready.set()
+
+    async def expire(self, tokens: List[str]) -> int:
+        ended = [token for token in tokens if token in self.subscribers]
+        [self.end(token) for token in tokens]
+        return len(ended)
+
+    async def stream(self, token: str, deviceId: str) -> AsyncIterator[bytes]:
+        subscriber = self.subscribe(token, deviceId)
+        try:
+            state = self.mirrors.get(token)
+            # Late joiners start from the current state; the comment flushes headers
+            yield b": mirror\n\n" if state is None else self.encode(state.event("load"))
+            while self.available and not subscriber.closed:
+                if not (subscriber.pending or subscriber.resync):
+                    subscriber.ready.clear()
+                    try:
+                        await asyncio.wait_for(
+                            subscriber.ready.wait(), HEARTBEAT_SECONDS
+                        )
+                    except TimeoutError:
+                        yield b": heartbeat\n\n"
+                    continue
+                chunks: List[bytes] = list()
+                if subscriber.resync:
+                    subscriber.resync = False
+                    state = self.mirrors.get(subscriber.token)
+                    if state is not None:
+                        chunks.append(self.encode(state.event("load")))
+                chunks.extend(data for _, data in subscriber.pending)
+                subscriber.pending.clear()
+                # Everything pending goes out in one write
+                yield b"".join(chunks)
+            if subscriber.pending:
+                yield b"".join(data for _, data in subscriber.pending)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def close(self) -> None:
+        if not self.available:
+            return
+        logger.info("Closing playback streams")
+        self.available = False
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                subscriber.ready.set()
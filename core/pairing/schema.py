@@ -1,12 +1,21 @@
 import secrets
-from functools import partial
+from functools import cache, partial
 from pathlib import Path
-from typing import Dict, List
+from typing import Annotated, Any, Dict, List, Literal
 from uuid import UUID, uuid4
 
 import orjson
 from django.conf import settings
-from pydantic import BaseModel, Field, PositiveInt
+from pydantic import (
+    BaseModel,
+    Field,
+    PositiveInt,
+    StringConstraints,
+    TypeAdapter,
+    model_validator,
+)
+
+from .tokens import sign_token, signing_enabled
 
 
 def get_static_manifest_contents(
@@ -20,6 +29,16 @@ def get_static_manifest_contents(
 
 static_file_info = get_static_manifest_contents()
 
+BATCH_LIMIT = getattr(settings, "PAIRING_BATCH_LIMIT", 500)
+GROUP_CAPACITY = getattr(settings, "PAIRING_GROUP_CAPACITY", 64)
+GROUP_MAX_CAPACITY = getattr(settings, "PAIRING_GROUP_MAX_CAPACITY", 1024)
+
+# Issued tokens are URL-safe base64, signed ones dot separated; the bound keeps
+# the `pair:` and `grp:` keys within memcached's 250 byte key limit
+PairToken = Annotated[
+    str, StringConstraints(pattern=r"^[A-Za-z0-9_.-]+$", max_length=200)
+]
+
 
 class DeviceId(BaseModel):
     deviceId: UUID
@@ -34,21 +53,95 @@ class Pair(BaseModel):
     token: str = Field(default_factory=partial(secrets.token_urlsafe, 36))
     ttl: PositiveInt = Field(default=600)
 
+    @model_validator(mode="before")
+    @classmethod
+    def sign_new_token(cls, data: Any) -> Any:
+        if isinstance(data, dict) and "token" not in data and signing_enabled():
+            ttl = data.get("ttl", cls.model_fields["ttl"].default)
+            return dict(data, token=sign_token(int(ttl)))
+        return data
+
 
 class PairInner(Pair):
     openToJoin: bool = Field(default=True)
+    # Receivers a group pairing admits; 0 for a one-to-one pairing
+    capacity: int = Field(default=0, ge=0)
     nodes: List[Device] = Field(default_factory=list)
+    # Unix time the pairing expires at, so any worker can keep its cache
+    # entries on the same deadline; stored, never sent to clients
+    expires: int = Field(default=0, ge=0, exclude=True)
 
 
 class PairComplete(BaseModel):
-    token: str
+    token: PairToken
     device: Device
 
 
+class GroupInitialize(BaseModel):
+    """One source device mirroring to up to `capacity` receivers"""
+
+    source: Device
+    capacity: int = Field(default=GROUP_CAPACITY, ge=1, le=GROUP_MAX_CAPACITY)
+
+
+class BatchInitialize(BaseModel):
+    devices: List[Device] = Field(min_length=1, max_length=BATCH_LIMIT)
+
+
+class BatchComplete(BaseModel):
+    token: PairToken
+    devices: List[Device] = Field(min_length=1, max_length=BATCH_LIMIT)
+    openToJoin: bool = Field(default=False)
+
+
+class BatchTokens(BaseModel):
+    tokens: List[PairToken] = Field(min_length=1, max_length=BATCH_LIMIT)
+
+
+class BatchPairings(BaseModel):
+    """One pairing per device; devices already in a pairing are conflicts"""
+
+    pairings: List[PairInner] = Field(default_factory=list)
+    conflicts: List[UUID] = Field(default_factory=list)
+
+
+class BatchJoined(BaseModel):
+    pairing: PairInner
+    conflicts: List[UUID] = Field(default_factory=list)
+
+
+class EventsQuery(BaseModel):
+    """Query string of the pairing event stream and long poll"""
+
+    token: PairToken
+
+
+class PlaybackEventsQuery(DeviceId):
+    token: PairToken
+
+
+class PairingEvent(BaseModel):
+    event: Literal[
+        "ttl",
+        "joined",
+        "refresh",
+        "cancelled",
+        "expired",
+        "member_joined",
+        "member_left",
+        "member_updated",
+    ]
+    token: str
+    ttl: int = Field(default=0)
+    version: int = Field(default=0)
+    nodes: List[Device] = Field(default_factory=list)
+
+
 class PlaybackInfo(BaseModel):
-    pairToken: str = Field(default_factory=str)
+    pairToken: PairToken = Field(default_factory=str)
     node: Device
     shareUrl: str
+    platformArgs: Dict[str, str] = Field(default_factory=dict)
 
 
 class Mirror(BaseModel):
@@ -59,6 +152,30 @@ class Mirror(BaseModel):
     platformArgs: Dict[str, str] = Field(default_factory=dict)
 
 
+class PlaybackCommand(BaseModel):
+    pairToken: PairToken
+    node: Device
+    action: Literal["play", "pause", "seek", "stop"]
+    position: float = Field(default=0, ge=0)
+    # Server clock epoch milliseconds the action takes effect at, see /pairing/clock/
+    at: float | None = Field(default=None, ge=0)
+
+
+class PlaybackEvent(BaseModel):
+    """A change of the mirrored playback, carrying the whole resulting state:
+    at server time `at` (epoch ms) playback is at `position` seconds
+    """
+
+    event: Literal["load", "play", "pause", "seek", "stop"]
+    pairToken: str
+    shareUrl: str = Field(default_factory=str)
+    position: float = Field(default=0)
+    at: float = Field(default=0)
+    playing: bool = Field(default=False)
+    seq: int = Field(default=0)
+    platformArgs: Dict[str, str] = Field(default_factory=dict)
+
+
 class PairCtx(BaseModel):
     page_title: str = Field(default_factory=str)
     js_file: str = Field(
@@ -67,3 +184,83 @@ class PairCtx(BaseModel):
     css_file: str = Field(
         default_factory=lambda x: static_file_info["src/pairing/main.ts"]["css"][0]
     )
+
+
+class JsonCodec[M: BaseModel]:
+    """Pre-built pydantic-core validator and serializer of one model, working
+    on raw bytes: no intermediate dict on the way in, no str on the way out
+    """
+
+    def __init__(self, model: type[M]):
+        adapter = TypeAdapter(model)
+        self.validator = adapter.validator
+        self.serializer = adapter.serializer
+
+    def decode(self, body: bytes) -> M:
+        return self.validator.validate_json(body)
+
+    def encode(self, obj: M) -> bytes:
+        return self.serializer.to_json(obj)
+
+
+@cache
+def codec[M: BaseModel](model: type[M]) -> JsonCodec[M]:
+    return JsonCodec(model)
+
+
+def decode[M: BaseModel](model: type[M], body: bytes) -> M:
+    """Validate a request body straight from its bytes; malformed JSON is a
+    ValidationError of type `json_invalid`
+    """
+    return codec(model).decode(body)
+
+
+def encode(obj: BaseModel) -> bytes:
+    return codec(type(obj)).encode(obj)
+
+
+def pair_reply(token: str, ttl: int) -> bytes:
+    """A Pair body for a token already known to be valid"""
+    return orjson.dumps({"token": token, "ttl": ttl})
+
+
+def reason(message: str) -> bytes:
+    return orjson.dumps({"reason": message})
+
+
+# Static error bodies, serialized once
+TOKEN_NOT_FOUND = reason("Pairing token not found")
+DEVICE_PAIRED = reason("Device already in another pairing session")
+DEVICE_NOT_FOUND = reason("Device id not found")
+NOT_IN_PAIRING = reason("Device not part of pairing")
+NOT_OPEN = reason("Pairing not open to join")
+REFRESHED = reason("Pairing already refreshed")
+CONTENDED = reason("Pairing busy, retry")
+AT_CAPACITY = reason("Pairing capacity reached")
+RATE_LIMITED = reason("Too many requests")
+NOT_SOURCE = reason("Device not the source of the mirror")
+NO_MIRROR = reason("No playback mirrored for pairing")
+GROUP_FULL = reason("Group pairing at capacity")
+GROUP_ONLY = reason("Not a group pairing, or the device is its source")
+JOIN_GROUP = reason("Group pairings are joined through /pairing/group/join/")
+
+# Codecs of the request and event models, built at import rather than on
+# the first request
+[
+    codec(model)
+    for model in (
+        Device,
+        DeviceId,
+        PairComplete,
+        PairInner,
+        GroupInitialize,
+        PlaybackInfo,
+        PlaybackCommand,
+        PlaybackEvent,
+        PairingEvent,
+        Mirror,
+        BatchInitialize,
+        BatchComplete,
+        BatchTokens,
+    )
+]
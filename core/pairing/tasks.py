@@ -1,110 +1,228 @@
 import asyncio
+import heapq
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime, timedelta
-from typing import Dict, Protocol
+import math
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Protocol, Tuple
 
 from pydantic import BaseModel
 
+from core.metrics.registry import registry, timed
+
 from .schema import Pair
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EXPIRY_BATCH_SIZE = 512
+
+type ExpiryListener = Callable[[List[str]], Awaitable[int]]
+
+TTL_TICK_SECONDS = registry.histogram(
+    "ttl_queue_tick_seconds",
+    "One scheduler wake-up: popping due deadlines and notifying expiry listeners",
+)
+TTL_EXPIRED_TOTAL = registry.counter(
+    "ttl_queue_expired_total", "Pairings expired by the ttl scheduler"
+)
+
 
 class TaskState[T](BaseModel):
     startdt: datetime
-    remaining_ttl: int
+    deadline: float
     object: T
 
+    @property
+    def remaining_ttl(self) -> int:
+        return max(0, math.ceil(self.deadline - time.monotonic()))
+
 
 class ITaskQueue[T](Protocol):
-    queue: asyncio.Queue[T]
-    pool: ThreadPoolExecutor
+    deadlines: List[Tuple[float, str]]
     available: bool
+    capacity: int
+    reserved: int
     task_states: Dict[str, TaskState[T]]
+    expiry_listeners: List[ExpiryListener]
 
     def __init__(self): ...
 
     async def add_task(self, obj: T) -> None: ...
 
-    async def get_task(self) -> T: ...
+    async def add_tasks(self, objs: List[T]) -> None: ...
 
     def get_task_state(self, token: str) -> TaskState: ...
 
     @property
     def _queue_length(self) -> int: ...
 
+    @property
+    def full(self) -> bool:
+        """Whether live and reserved tasks fill `capacity`; 0 means unbounded"""
+        ...
+
+    def fits(self, count: int) -> bool:
+        """Whether `count` more tasks stay within `capacity`"""
+        ...
+
+    def next_expiry(self) -> float | None:
+        """Seconds until the earliest deadline, None when nothing is scheduled"""
+        ...
+
     def register_task(self, obj: T) -> None: ...
 
-    def task_complete(self, obj: T) -> None: ...
+    def register_tasks(self, objs: List[T]) -> None:
+        """Schedule many tasks in one pass over the deadline heap"""
+        ...
 
-    async def process(self) -> None: ...
+    def remove_task(self, token: str) -> None:
+        """Forget a task before its deadline; the heap entry is dropped lazily"""
+        ...
+
+    def task_complete(self, token: str) -> None: ...
 
-    def calc_remaining(self, obj: T, start_dt: datetime) -> None: ...
+    def add_expiry_listener(self, listener: ExpiryListener) -> None:
+        """Register a coroutine called with batches of expired tokens"""
+        ...
+
+    async def process(self) -> None: ...
 
     def shutdown(self) -> None: ...
 
 
 class TTLTaskQueue:
-    def __init__(self):
-        self.queue: asyncio.Queue[Pair] = asyncio.Queue()
-        self.pool = ThreadPoolExecutor()
+    def __init__(self, capacity: int = 0):
+        self.deadlines: List[Tuple[float, str]] = list()
         self.available: bool = True
+        self.capacity: int = capacity
+        # Slots held by admitted requests still writing to the cache
+        self.reserved: int = 0
         self.task_states: Dict[str, TaskState[Pair]] = dict()
+        self.expiry_listeners: List[ExpiryListener] = list()
+        self._wakeup: asyncio.Event = asyncio.Event()
 
     async def add_task(self, obj: Pair) -> None:
         logger.info(f"Appended task\t{obj.token}; ttl = {obj.ttl} seconds")
-        await self.queue.put(obj)
+        self.register_task(obj)
 
-    async def get_task(self) -> Pair:
-        task: Pair = await self.queue.get()
-        return task
+    async def add_tasks(self, objs: List[Pair]) -> None:
+        logger.info(f"Appended {len(objs)} tasks")
+        self.register_tasks(objs)
 
     def get_task_state(self, token: str) -> TaskState:
         return self.task_states[token]
 
     @property
     def _queue_length(self) -> int:
-        return self.queue.qsize()
+        return len(self.task_states)
+
+    @property
+    def full(self) -> bool:
+        return 0 < self.capacity <= len(self.task_states) + self.reserved
+
+    def fits(self, count: int) -> bool:
+        return (
+            not self.capacity
+            or len(self.task_states) + self.reserved + count <= self.capacity
+        )
 
     def register_task(self, obj: Pair) -> None:
+        deadline = time.monotonic() + obj.ttl
         self.task_states[obj.token] = TaskState(
-            startdt=datetime.now(), remaining_ttl=obj.ttl, object=obj
+            startdt=datetime.now(), deadline=deadline, object=obj
         )
+        heapq.heappush(self.deadlines, (deadline, obj.token))
+        if self.deadlines[0][1] == obj.token:
+            self._wakeup.set()
+        self._compact()
+
+    def register_tasks(self, objs: List[Pair]) -> None:
+        now, startdt = time.monotonic(), datetime.now()
+        entries = list()
+        for obj in objs:
+            deadline = now + obj.ttl
+            self.task_states[obj.token] = TaskState(
+                startdt=startdt, deadline=deadline, object=obj
+            )
+            entries.append((deadline, obj.token))
+        earliest = self.deadlines[0] if self.deadlines else None
+        size = len(self.deadlines) + len(entries)
+        # Rebuilding is linear; pushing costs a log per entry
+        if len(entries) * math.log2(size + 1) > size:
+            self.deadlines.extend(entries)
+            heapq.heapify(self.deadlines)
+        else:
+            for entry in entries:
+                heapq.heappush(self.deadlines, entry)
+        if self.deadlines and self.deadlines[0] != earliest:
+            self._wakeup.set()
+        self._compact()
+
+    def remove_task(self, token: str) -> None:
+        self.task_states.pop(token, None)
 
     def task_complete(self, token: str) -> None:
         logger.info(f"Completed task\t{token}")
         del self.task_states[token]
-        self.queue.task_done()
 
-    async def process(self):
+    def add_expiry_listener(self, listener: ExpiryListener) -> None:
+        self.expiry_listeners.append(listener)
+
+    async def process(self) -> None:
         while self.available:
-            if self._queue_length == 0 and len(self.task_states.keys()) == 0:
-                await asyncio.sleep(0.5)
-                continue
-
-            for _ in range(self._queue_length):
-                task_obj: Pair = await self.get_task()
-                self.register_task(task_obj)
-            [_ for _ in self.pool.map(self._ttl_calc, self.task_states.keys())]
-            await asyncio.sleep(1)
-
-    def _ttl_calc(self, task_token: str):
-        self.calc_remaining(task_token, self.task_states[task_token].startdt)
-        if self.task_states[task_token].remaining_ttl <= 0:
-            self.task_complete(task_token)
-
-    def calc_remaining(self, task_token: str, start_dt: datetime) -> None:
-        self.task_states[task_token].remaining_ttl = int(
-            (
-                start_dt
-                + timedelta(seconds=self.task_states[task_token].object.ttl)
-                - datetime.now()
-            ).total_seconds()
-        )
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.next_expiry())
+            except TimeoutError:
+                pass
+            await self._tick()
+
+    @timed(TTL_TICK_SECONDS)
+    async def _tick(self) -> None:
+        expired = self._expire_due()
+        if expired:
+            TTL_EXPIRED_TOTAL.inc(amount=len(expired))
+            await self._notify_expired(expired)
+
+    async def _notify_expired(self, tokens: List[str]) -> None:
+        for start in range(0, len(tokens), EXPIRY_BATCH_SIZE):
+            batch = tokens[start : start + EXPIRY_BATCH_SIZE]
+            for listener in self.expiry_listeners:
+                try:
+                    await listener(batch)
+                except Exception as e:
+                    logger.error(f"Expiry listener failed: {e!r}")
+
+    def next_expiry(self) -> float | None:
+        if not self.deadlines:
+            return None
+        return max(0.0, self.deadlines[0][0] - time.monotonic())
+
+    def _expire_due(self) -> List[str]:
+        now = time.monotonic()
+        expired: List[str] = list()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, token = heapq.heappop(self.deadlines)
+            state = self.task_states.get(token)
+            # Entries superseded by a refresh or removal are skipped here
+            if state is not None and state.deadline == deadline:
+                self.task_complete(token)
+                expired.append(token)
+        return expired
+
+    def _compact(self) -> None:
+        if len(self.deadlines) <= 2 * len(self.task_states) + 64:
+            return
+        self.deadlines = [
+            (deadline, token)
+            for deadline, token in self.deadlines
+            if token in self.task_states
+            and self.task_states[token].deadline == deadline
+        ]
+        heapq.heapify(self.deadlines)
 
     def shutdown(self) -> None:
         logger.info("Shutting down ttl task queue")
         self.available = False
-        self.pool.shutdown(wait=False)
+        self._wakeup.set()
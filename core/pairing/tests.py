@@ -0,0 +1,343 @@
+import asyncio
+import socket
+import time
+import uuid
+from typing import Iterator, List
+
+import django
+import orjson
+import pytest
+from django.apps import apps
+from django.conf import settings
+from django.test import AsyncClient
+
+from benchmarks.fake_memcached import FakeMemcached, serve_in_thread
+from core.cacheManager.membership import MEMBER_AVAILABLE, fold_members
+from core.pairing.schema import (
+    DEVICE_NOT_FOUND,
+    TOKEN_NOT_FOUND,
+    Device,
+    Pair,
+    PairInner,
+    PairingEvent,
+)
+
+# A device in this many pairings is the case toggle and remove batch for
+FANOUT = 300
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class Harness:
+    """The app's async handler driven from synchronous tests"""
+
+    def __init__(self, memcached: FakeMemcached, loop: asyncio.AbstractEventLoop):
+        self.memcached = memcached
+        self.loop = loop
+        self.cache_handler = apps.get_app_config("cacheManager").async_cache_handler
+        self.ttl_task_queue = apps.get_app_config("pairing").ttl_task_queue
+        self.event_broker = apps.get_app_config("pairing").event_broker
+        self.client = AsyncClient()
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def stored(self, key: str) -> bytes | None:
+        item = self.memcached.items.get(key.encode())
+        return None if item is None else item[0]
+
+    def seed(self, *pairs: PairInner) -> None:
+        self.run(self.cache_handler.set_pairings(list(pairs)))
+        for pair in pairs:
+            self.run(self.ttl_task_queue.add_task(Pair(token=pair.token, ttl=pair.ttl)))
+
+    def toggle(self, deviceId: str):
+        return self.run(
+            self.client.put(
+                "/pairing/device/toggle/",
+                orjson.dumps({"deviceId": deviceId}),
+                content_type="application/json",
+            )
+        )
+
+    def remove(self, deviceId: str):
+        return self.run(
+            self.client.post(
+                "/pairing/device/remove/",
+                orjson.dumps({"deviceId": deviceId}),
+                content_type="application/json",
+            )
+        )
+
+    def availability(self, pairToken: str) -> dict:
+        pair = self.run(self.cache_handler.get_pairing(pairToken))
+        return {str(node.deviceId): node.available for node in pair.nodes}
+
+
+def pairing(*deviceIds: str, capacity: int = 0) -> PairInner:
+    return PairInner(
+        **Pair().model_dump(),
+        capacity=capacity,
+        nodes=[Device(deviceId=deviceId) for deviceId in deviceIds],
+    )
+
+
+def devices(count: int) -> List[str]:
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+@pytest.fixture(scope="module")
+def memcached() -> Iterator[FakeMemcached]:
+    fake = serve_in_thread(port=free_port())
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture(scope="module")
+def harness(memcached: FakeMemcached) -> Iterator[Harness]:
+    # The handlers connect when the apps load, so the fake listens first
+    settings.MEMCACHED_SERVERS = [memcached.address]
+    django.setup()
+    loop = asyncio.new_event_loop()
+    harness = Harness(memcached, loop)
+    yield harness
+    loop.run_until_complete(harness.cache_handler.task_client.shutdown())
+    loop.close()
+
+
+@pytest.fixture(params=["local", "shared"])
+def h(request, harness: Harness) -> Iterator[Harness]:
+    shared = harness.cache_handler.shared
+    harness.cache_handler.shared = request.param == "shared"
+    yield harness
+    harness.cache_handler.shared = shared
+
+
+def test_toggle_device_flips_every_pairing(h: Harness):
+    device, peer, source = devices(3)
+    mirror, other, group = (
+        pairing(device, peer),
+        pairing(peer, device),
+        pairing(source, device, capacity=4),
+    )
+    h.seed(mirror, other, group)
+
+    response = h.toggle(device)
+    assert response.status_code == 200
+    assert orjson.loads(response.content) == {"deviceId": device, "available": True}
+    for pairToken in (mirror.token, other.token, group.token):
+        assert h.availability(pairToken)[device] is True
+    assert h.availability(mirror.token)[peer] is False
+    members = fold_members(h.stored(f"grp:{group.token}"))
+    assert members[uuid.UUID(device).bytes] & MEMBER_AVAILABLE
+
+    response = h.toggle(device)
+    assert orjson.loads(response.content)["available"] is False
+    assert h.availability(other.token)[device] is False
+    # Availability changes leave the indexes alone
+    assert set(h.run(h.cache_handler.device_pairings(device))) == {
+        mirror.token,
+        other.token,
+        group.token,
+    }
+    assert h.stored(f"dev:{device}") is not None
+
+
+def test_toggle_unknown_device(h: Harness):
+    response = h.toggle(str(uuid.uuid4()))
+    assert response.status_code == 404
+    assert response.content == DEVICE_NOT_FOUND
+    assert h.run(h.cache_handler.toggle_device(str(uuid.uuid4()))) is None
+
+
+def test_remove_device_leaves_every_pairing(h: Harness):
+    device, peer, source = devices(3)
+    mirror, alone, group = (
+        pairing(device, peer),
+        pairing(device),
+        pairing(source, device, capacity=4),
+    )
+    h.seed(mirror, alone, group)
+
+    response = h.remove(device)
+    assert response.status_code == 200
+    assert orjson.loads(response.content) == {"deviceId": device, "pairings": 3}
+
+    assert h.stored(f"dev:{device}") is None
+    assert not h.run(h.cache_handler.device_exists(device))
+    assert list(h.availability(mirror.token)) == [peer]
+    assert h.run(h.cache_handler.device_pairings(peer)) == [mirror.token]
+    assert list(h.availability(group.token)) == [source]
+    # A pairing the device was the last node of ends with it; its value expires
+    assert h.stored(f"pair:{alone.token}") is None
+    assert alone.token not in h.ttl_task_queue.task_states
+    assert mirror.token in h.ttl_task_queue.task_states
+    if not h.cache_handler.shared:
+        assert device not in h.cache_handler.deviceIndex
+        assert h.cache_handler.pairingIndex[mirror.token] == {peer}
+        assert alone.token not in h.cache_handler.pairingIndex
+    assert not h.run(h.cache_handler.pairing_exists(alone.token))
+
+
+def test_remove_unknown_device(h: Harness):
+    response = h.remove(str(uuid.uuid4()))
+    assert response.status_code == 404
+    assert response.content == DEVICE_NOT_FOUND
+    assert h.run(h.cache_handler.remove_device(str(uuid.uuid4()))) == 0
+
+
+def test_device_in_hundreds_of_pairings(h: Harness):
+    device, source = devices(2)
+    peers = devices(FANOUT)
+    mirrors = [pairing(device, peer) for peer in peers]
+    receivers = devices(10)
+    groups = [pairing(source, device, peer, capacity=4) for peer in receivers]
+    h.seed(*mirrors, *groups)
+    tokens = [pair.token for pair in mirrors + groups]
+
+    response = h.toggle(device)
+    assert orjson.loads(response.content) == {"deviceId": device, "available": True}
+    for pair in mirrors + groups:
+        assert h.availability(pair.token)[device] is True
+    for group in groups:
+        members = fold_members(h.stored(f"grp:{group.token}"))
+        assert members[uuid.UUID(device).bytes] & MEMBER_AVAILABLE
+
+    response = h.remove(device)
+    assert orjson.loads(response.content) == {
+        "deviceId": device,
+        "pairings": len(tokens),
+    }
+    assert h.stored(f"dev:{device}") is None
+    for peer, pair in zip(peers, mirrors):
+        assert list(h.availability(pair.token)) == [peer]
+        assert h.run(h.cache_handler.device_pairings(peer)) == [pair.token]
+    for peer, group in zip(receivers, groups):
+        assert list(h.availability(group.token)) == [source, peer]
+    assert all(h.run(h.cache_handler.pairing_exists(token)) for token in tokens)
+
+
+def test_cancel_pairing_drops_its_task(h: Harness):
+    device, peer = devices(2)
+    pair = pairing(device, peer)
+    h.seed(pair)
+
+    h.run(h.cache_handler.cancel_pairing(pair.token))
+    assert pair.token not in h.ttl_task_queue.task_states
+    assert h.stored(f"pair:{pair.token}") is None
+    assert not h.run(h.cache_handler.device_exists(device))
+    assert not h.run(h.cache_handler.device_exists(peer))
+
+
+def test_writes_keep_the_pairing_deadline(h: Harness):
+    device, peer = devices(2)
+    # Scheduled on another worker: only the stored deadline is known here
+    live, expired = pairing(device, peer), pairing(device, peer)
+    live.expires, expired.expires = int(time.time()) + 100, int(time.time()) - 1
+    h.seed(live, expired)
+    h.ttl_task_queue.remove_task(live.token)
+    h.ttl_task_queue.remove_task(expired.token)
+    h.cache_handler.pairing_cache.invalidate([live.token, expired.token])
+
+    assert h.toggle(device).status_code == 200
+    assert h.availability(live.token)[device] is True
+    assert h.availability(expired.token)[device] is False
+    deadline = h.memcached.items[live.token.encode()][3]
+    assert 0 < deadline - time.time() <= 100
+
+
+def test_vanished_value_answers_not_found(h: Harness):
+    device, peer, joiner = devices(3)
+    pair = pairing(device, peer)
+    pair.openToJoin = True
+    h.seed(pair)
+    # Evicted between the liveness check and the read: marker and index remain
+    del h.memcached.items[pair.token.encode()]
+    h.cache_handler.pairing_cache.invalidate([pair.token])
+
+    requests = [
+        ("/pairing/complete/", {"token": pair.token, "device": {"deviceId": joiner}}),
+        (
+            "/pairing/batch/complete/",
+            {"token": pair.token, "devices": [{"deviceId": joiner}]},
+        ),
+        (
+            "/pairing/playback/start/",
+            {
+                "pairToken": pair.token,
+                "node": {"deviceId": device},
+                "shareUrl": "https://example.com/",
+            },
+        ),
+    ]
+    for path, body in requests:
+        response = h.run(
+            h.client.post(path, orjson.dumps(body), content_type="application/json")
+        )
+        assert response.status_code == 404, path
+        assert response.content == TOKEN_NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["/pairing/events/", "/pairing/wait/", "/pairing/playback/events/"],
+)
+@pytest.mark.parametrize("token", ["two words", "ctl\x01", "t" * 251])
+def test_malformed_query_is_rejected(h: Harness, path: str, token: str):
+    query = {"token": token, "deviceId": str(uuid.uuid4()), "timeout": "0"}
+    response = h.run(h.client.get(path, query))
+    assert response.status_code == 400
+
+
+def test_unknown_query_token_is_not_found(h: Harness):
+    query = {"token": "unknown", "deviceId": str(uuid.uuid4()), "timeout": "0"}
+    for path in ("/pairing/events/", "/pairing/wait/", "/pairing/playback/events/"):
+        response = h.run(h.client.get(path, query))
+        assert response.status_code == 404, path
+        assert response.content == TOKEN_NOT_FOUND
+    query["deviceId"] = "not a uuid"
+    response = h.run(h.client.get("/pairing/playback/events/", query))
+    assert response.status_code == 400
+
+
+def test_sweep_ends_watches_of_pairings_gone_elsewhere(h: Harness):
+    device, peer = devices(2)
+    live, gone = pairing(device, peer), pairing(device, peer)
+    h.seed(live, gone)
+    # Watches earlier tests left behind
+    h.run(h.event_broker.sweep(h.cache_handler.pairing_exists))
+    # Scheduled on another worker, which expires `gone` without telling this one
+    h.ttl_task_queue.remove_task(live.token)
+    h.ttl_task_queue.remove_task(gone.token)
+    h.run(h.cache_handler.cancel_pairing(gone.token))
+    h.event_broker.watches.pop(gone.token, None)
+    for pair in (live, gone):
+        h.event_broker.publish(PairingEvent(event="joined", token=pair.token))
+    stream = h.event_broker.stream(gone.token)
+    h.run(stream.__anext__())
+
+    assert h.run(h.event_broker.sweep(h.cache_handler.pairing_exists)) == 1
+    assert gone.token not in h.event_broker.watches
+    assert b"event: expired" in h.run(stream.__anext__())
+    h.run(stream.aclose())
+    assert gone.token not in h.event_broker.subscribers
+    assert live.token in h.event_broker.watches
+    h.event_broker.watches.pop(live.token)
+
+
+def test_stream_disconnect_releases_its_watch(h: Harness):
+    pair = pairing(*devices(2))
+    h.seed(pair)
+    stream = h.event_broker.stream(pair.token)
+    h.run(stream.__anext__())
+    h.event_broker.publish(PairingEvent(event="joined", token=pair.token))
+    assert pair.token in h.event_broker.watches
+
+    h.run(stream.__anext__())
+    h.run(stream.aclose())
+    assert pair.token not in h.event_broker.subscribers
+    assert pair.token not in h.event_broker.watches
@@ -0,0 +1,62 @@
+import base64
+import secrets
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+TOKEN_SALT = "core.pairing.tokens"
+SIGNATURE_BYTES = 16
+
+
+class TokenClaims(NamedTuple):
+    issued: int
+    ttl: int
+
+    @property
+    def remaining_ttl(self) -> int:
+        return max(0, self.issued + self.ttl - int(time.time()))
+
+
+def signing_enabled() -> bool:
+    return getattr(settings, "PAIRING_SIGNED_TOKENS", False)
+
+
+def _signature(value: str) -> str:
+    digest = salted_hmac(TOKEN_SALT, value, algorithm="sha256").digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).rstrip(b"=").decode()
+
+
+def sign_token(ttl: int, issued: int | None = None) -> str:
+    """`<nonce>.<issued>.<ttl>.<signature>` with hex timestamps, keyed on SECRET_KEY"""
+    issued = int(time.time()) if issued is None else issued
+    value = f"{secrets.token_urlsafe(18)}.{issued:x}.{ttl:x}"
+    return f"{value}.{_signature(value)}"
+
+
+def is_signed(token: str) -> bool:
+    return token.count(".") == 3
+
+
+def read_token(token: str) -> TokenClaims | None:
+    """Claims of a signed token, or None when it is malformed or forged"""
+    value, _, signature = token.rpartition(".")
+    try:
+        _, issued, ttl = value.split(".")
+        claims = TokenClaims(int(issued, 16), int(ttl, 16))
+    except ValueError:
+        return None
+    if not constant_time_compare(signature, _signature(value)):
+        return None
+    return claims
+
+
+def token_rejected(token: str | None) -> bool:
+    """True for signed tokens that are forged or past their TTL; answered
+    from the token alone, so no index or memcached lookup is needed
+    """
+    if token is None or not signing_enabled() or not is_signed(token):
+        return False
+    claims = read_token(token)
+    return claims is None or claims.remaining_ttl == 0
@@ -1,14 +1,56 @@
 from django.urls import path
 
-from .views import (PairView, device_toggle, get_remaining_ttl,
-                    pairing_complete, pairing_initialize, pairing_refresh)
+from .views import (
+    PairView,
+    clock,
+    device_remove,
+    device_toggle,
+    get_remaining_ttl,
+    group_available,
+    group_initialize,
+    group_join,
+    group_leave,
+    pairing_batch_complete,
+    pairing_batch_initialize,
+    pairing_batch_remaining,
+    pairing_complete,
+    pairing_events,
+    pairing_initialize,
+    pairing_refresh,
+    pairing_wait,
+    playback_command,
+    playback_events,
+    playback_start,
+)
 
 jsonResponsePatterns = [
     path("initialize/", pairing_initialize, name="pairing_initialize"),
     path("complete/", pairing_complete, name="pairing_complete"),
     path("refresh/", pairing_refresh, name="pairing_refresh"),
     path("remaining/", get_remaining_ttl, name="pairing_remaining"),
+    path(
+        "batch/initialize/",
+        pairing_batch_initialize,
+        name="pairing_batch_initialize",
+    ),
+    path("batch/complete/", pairing_batch_complete, name="pairing_batch_complete"),
+    path(
+        "batch/remaining/",
+        pairing_batch_remaining,
+        name="pairing_batch_remaining",
+    ),
+    path("group/initialize/", group_initialize, name="group_initialize"),
+    path("group/join/", group_join, name="group_join"),
+    path("group/leave/", group_leave, name="group_leave"),
+    path("group/available/", group_available, name="group_available"),
+    path("events/", pairing_events, name="pairing_events"),
+    path("wait/", pairing_wait, name="pairing_wait"),
     path("device/toggle/", device_toggle, name="device_toggle"),
+    path("device/remove/", device_remove, name="device_remove"),
+    path("playback/start/", playback_start, name="playback_start"),
+    path("playback/", playback_command, name="playback_command"),
+    path("playback/events/", playback_events, name="playback_events"),
+    path("clock/", clock, name="pairing_clock"),
 ]
 
 vuePatterns = [
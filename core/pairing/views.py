@@ -1,3 +1,6 @@
+import functools
+import time
+
 import orjson
 from asgiref.sync import sync_to_async
 from django.apps import apps
@@ -7,154 +10,443 @@ from django.http import (
     HttpResponseForbidden,
     HttpResponseNotAllowed,
     HttpResponseNotFound,
+    StreamingHttpResponse,
 )
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView
 from pydantic import ValidationError
 
-from core.cacheManager.tasks import ICacheTaskHandler
+from core.cacheManager.tasks import IAsyncCacheTaskHandler, PairingContention
+from core.metrics.registry import registry
 
-from .schema import Device, DeviceId, Pair, PairComplete, PairCtx, PairInner
+from .admission import client_ip, device_limiter, ip_limiter, retry_after
+from .clock import server_time_ms
+from .events import LONG_POLL_SECONDS, IEventBroker
+from .playback import IPlaybackBroker
+from .schema import (
+    AT_CAPACITY,
+    CONTENDED,
+    DEVICE_NOT_FOUND,
+    DEVICE_PAIRED,
+    GROUP_FULL,
+    GROUP_ONLY,
+    JOIN_GROUP,
+    NO_MIRROR,
+    NOT_IN_PAIRING,
+    NOT_OPEN,
+    NOT_SOURCE,
+    RATE_LIMITED,
+    REFRESHED,
+    TOKEN_NOT_FOUND,
+    BatchComplete,
+    BatchInitialize,
+    BatchJoined,
+    BatchPairings,
+    BatchTokens,
+    Device,
+    DeviceId,
+    EventsQuery,
+    GroupInitialize,
+    Mirror,
+    Pair,
+    PairComplete,
+    PairCtx,
+    PairInner,
+    PlaybackCommand,
+    PlaybackEventsQuery,
+    PlaybackInfo,
+    decode,
+    encode,
+    pair_reply,
+    reason,
+)
 from .tasks import ITaskQueue
+from .tokens import is_signed, read_token, signing_enabled, token_rejected
 
 ttl_task_queue: ITaskQueue[Pair] = apps.get_app_config("pairing").ttl_task_queue
-cache_handler: ICacheTaskHandler = apps.get_app_config("cacheManager").cache_handler
+event_broker: IEventBroker = apps.get_app_config("pairing").event_broker
+playback_broker: IPlaybackBroker = apps.get_app_config("pairing").playback_broker
+cache_handler: IAsyncCacheTaskHandler = apps.get_app_config(
+    "cacheManager"
+).async_cache_handler
+
+
+VIEW_SECONDS = registry.histogram(
+    "pairing_view_seconds",
+    "Pairing views until the response object is returned",
+    ["view", "status"],
+)
+SHED_TOTAL = registry.counter(
+    "pairing_requests_shed_total",
+    "Requests refused by admission control before any cache work",
+    ["view", "reason"],
+)
+
+
+def instrumented(view):
+    if not registry.enabled:
+        return view
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        started = time.perf_counter()
+        response = await view(request, *args, **kwargs)
+        VIEW_SECONDS.observe(
+            time.perf_counter() - started, view.__name__, str(response.status_code)
+        )
+        return response
+
+    return wrapper
+
+
+def shed(view: str, reason: str, seconds: float) -> HttpResponse:
+    """429 for rate limited clients, 503 when the server is at capacity"""
+    SHED_TOTAL.inc(view, reason)
+    if reason == "capacity":
+        status, content = 503, AT_CAPACITY
+    else:
+        status, content = 429, RATE_LIMITED
+    return HttpResponse(
+        content=content,
+        status=status,
+        content_type="application/json",
+        headers={"Retry-After": retry_after(seconds)},
+    )
+
+
+def token_not_found() -> HttpResponseNotFound:
+    return HttpResponseNotFound(
+        content=TOKEN_NOT_FOUND, content_type="application/json"
+    )
+
+
+def contended() -> HttpResponse:
+    """503 for a write that kept losing to concurrent writers; nothing was stored"""
+    return HttpResponse(
+        content=CONTENDED,
+        status=503,
+        content_type="application/json",
+        headers={"Retry-After": retry_after(0)},
+    )
+
+
+def invalid_body(ve: ValidationError) -> HttpResponseBadRequest:
+    """400 listing the validation errors; malformed JSON keeps its `reason` body"""
+    errors = ve.errors(include_url=False, include_input=False)
+    if errors[0]["type"] == "json_invalid":
+        content = reason(errors[0]["ctx"]["error"])
+    else:
+        content = ve.json(include_input=False, include_url=False)
+    return HttpResponseBadRequest(content=content, content_type="application/json")
+
+
+async def join_refused(token: str) -> HttpResponse:
+    """Answer a join the pairing did not take: it expired or closed meanwhile"""
+    if not await cache_handler.pairing_exists(token):
+        return token_not_found()
+    return HttpResponse(
+        content=NOT_OPEN,
+        status=409,
+        content_type="application/json",
+    )
+
+
+def remaining_ttl(token: str | None) -> int:
+    """Seconds left on a pairing, 0 when unknown or expired.
+    Signed tokens carry their expiry, so any worker can answer for them
+    """
+    if token is not None and signing_enabled() and is_signed(token):
+        claims = read_token(token)
+        return 0 if claims is None else claims.remaining_ttl
+    try:
+        return ttl_task_queue.get_task_state(token).remaining_ttl
+    except KeyError:
+        return 0
 
 
 @csrf_exempt
+@instrumented
 async def pairing_initialize(
     request, permitted_methods=["OPTIONS", "POST"]
 ) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
     if request.method not in permitted_methods:
         return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    # Cheapest refusals first, so shed requests cost no parsing or cache trips
+    if ttl_task_queue.full:
+        return shed("initialize", "capacity", ttl_task_queue.next_expiry() or 0)
+    wait = ip_limiter.acquire(client_ip(request))
+    if wait:
+        return shed("initialize", "ip", wait)
     try:
-        device = Device(**orjson.loads(request.body))
+        device = decode(Device, request.body)
     except ValidationError as ve:
-        return HttpResponseBadRequest(
-            content=ve.json(include_input=False, include_url=False),
-            content_type="application/json",
-        )
-    except orjson.JSONDecodeError as je:
-        return HttpResponseBadRequest(
-            content=orjson.dumps({"reason": je.msg}),
-            content_type="application/json",
-        )
+        return invalid_body(ve)
+    return await start_pairing("initialize", device)
+
+
+async def start_pairing(view: str, device: Device, capacity: int = 0) -> HttpResponse:
+    """Admit `device` and create the pairing it is the source of"""
+    wait = device_limiter.acquire(str(device.deviceId))
+    if wait:
+        return shed(view, "device", wait)
 
-    if str(device.deviceId) in cache_handler.deviceIndex.keys():
+    if await cache_handler.device_exists(str(device.deviceId)):
         return HttpResponse(
-            content=orjson.dumps(
-                {"reason": "Device already in another pairing session"}
-            ),
+            content=DEVICE_PAIRED,
             status=409,
             content_type="application/json",
         )
+    # Checked again with no await before the slot is held, so bursts cannot overshoot
+    if ttl_task_queue.full:
+        return shed(view, "capacity", ttl_task_queue.next_expiry() or 0)
     pair = Pair()
-    pairInner = PairInner(**pair.model_dump(), openToJoin=True, nodes=[device])
-    cache_handler.set_pairing(pair=pairInner)
+    pairInner = PairInner(
+        **pair.model_dump(), openToJoin=True, capacity=capacity, nodes=[device]
+    )
+    ttl_task_queue.reserved += 1
+    try:
+        await cache_handler.set_pairing(pair=pairInner)
+    finally:
+        ttl_task_queue.reserved -= 1
     await ttl_task_queue.add_task(pair)
     return HttpResponse(
-        content=pair.model_dump_json(),
+        content=encode(pair),
         content_type="application/json",
     )
 
 
 @csrf_exempt
-def pairing_complete(
+@instrumented
+async def pairing_complete(
     request, permitted_methods=["OPTIONS", "POST"]
 ) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
     if request.method not in permitted_methods:
         return HttpResponseNotAllowed(permitted_methods=permitted_methods)
     try:
-        pair_complete = PairComplete(**orjson.loads(request.body))
+        pair_complete = decode(PairComplete, request.body)
     except ValidationError as ve:
-        return HttpResponseBadRequest(
-            content=ve.json(include_input=False, include_url=False)
-        )
-    except orjson.JSONDecodeError as je:
-        return HttpResponseBadRequest(
-            content=orjson.dumps({"reason": je.msg}),
-            content_type="application/json",
-        )
+        return invalid_body(ve)
+    if token_rejected(pair_complete.token):
+        return token_not_found()
     deviceId = str(pair_complete.device.deviceId)
-    if deviceId in cache_handler.deviceIndex.keys():
+    if await cache_handler.device_exists(deviceId):
         return HttpResponse(
-            content=orjson.dumps(
-                {"reason": "Device already in another pairing session"}
-            ),
+            content=DEVICE_PAIRED,
             status=409,
             content_type="application/json",
         )
 
-    if pair_complete.token not in cache_handler.pairingIndex:
+    replacement = await cache_handler.find_pairing(pair_complete.token)
+    if replacement is None:
+        return token_not_found()
+    if replacement.capacity:
         return HttpResponse(
-            content=orjson.dumps({"reason": "Pairing token not found"}),
-            status=404,
+            content=JOIN_GROUP,
+            status=409,
             content_type="application/json",
         )
-    replacement: PairInner = cache_handler.get_pairing(pair_complete.token)
     if not replacement.openToJoin:
         return HttpResponse(
-            content=orjson.dumps({"reason": "Pairing not open to join"}),
+            content=NOT_OPEN,
             status=409,
             content_type="application/json",
         )
-    replacement.nodes.append(pair_complete.device)
-    replacement.openToJoin = False
-    cache_handler.update_pairing_devices(pair_complete.token, replacement.nodes)
+    # A concurrent join may close the pairing first; only the stored one answers 200
+    try:
+        joined = await cache_handler.update_pairing_devices(
+            pair_complete.token, [pair_complete.device], openToJoin=False
+        )
+    except PairingContention:
+        return contended()
+    if joined is None:
+        return await join_refused(pair_complete.token)
     return HttpResponse(
-        content=replacement.model_dump_json(),
+        content=encode(joined),
         content_type="application/json",
         status=200,
     )
 
 
 @csrf_exempt
+@instrumented
 async def pairing_refresh(
     request,
 ) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
-    # return HttpResponseBadRequest(content="Not Implemented")
     if request.method not in ["OPTIONS", "POST"]:
         return HttpResponseNotAllowed(permitted_methods=["OPTIONS", "POST"])
+    wait = ip_limiter.acquire(client_ip(request))
+    if wait:
+        return shed("refresh", "ip", wait)
     try:
-        pair_complete = PairComplete(**orjson.loads(request.body))
+        pair_complete = decode(PairComplete, request.body)
     except ValidationError as ve:
-        return HttpResponseBadRequest(
-            content=ve.json(include_input=False, include_url=False)
-        )
-    except orjson.JSONDecodeError as je:
-        return HttpResponseBadRequest(
-            content=orjson.dumps({"reason": je.msg}),
-            content_type="application/json",
-        )
+        return invalid_body(ve)
+    if token_rejected(pair_complete.token):
+        return token_not_found()
     deviceId = str(pair_complete.device.deviceId)
+    wait = device_limiter.acquire(deviceId)
+    if wait:
+        return shed("refresh", "device", wait)
 
-    if pair_complete.token not in cache_handler.pairingIndex:
+    if not await cache_handler.pairing_exists(pair_complete.token):
         return HttpResponse(
-            content=orjson.dumps({"reason": "Pairing token not found"}),
+            content=TOKEN_NOT_FOUND,
             status=404,
             content_type="application/json",
         )
 
-    if pair_complete.token not in cache_handler.deviceIndex[deviceId]:
+    if pair_complete.token not in await cache_handler.device_pairings(deviceId):
         return HttpResponseForbidden(
-            content=orjson.dumps({"reason": "Device not part of pairing"}),
+            content=NOT_IN_PAIRING,
             content_type="application/json",
         )
 
     replacement = Pair()
+    ttl_task_queue.reserved += 1
+    try:
+        transferred = await cache_handler.transfer_pairing(
+            pair_complete.token, replacement.token, replacement.ttl
+        )
+    finally:
+        ttl_task_queue.reserved -= 1
+    # Only the refresh that claimed the old token schedules its replacement
+    if not transferred:
+        return HttpResponse(
+            content=REFRESHED,
+            status=409,
+            content_type="application/json",
+        )
     await ttl_task_queue.add_task(replacement)
-    cache_handler.transfer_pairing(
-        pair_complete.token, replacement.token, replacement.ttl
-    )
+    ttl_task_queue.remove_task(pair_complete.token)
 
     return HttpResponse(
-        content=replacement.model_dump_json(),
+        content=encode(replacement),
         content_type="application/json",
         status=200,
     )
 
 
+@csrf_exempt
+@instrumented
+async def group_initialize(
+    request, permitted_methods=["OPTIONS", "POST"]
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    """Create a group pairing: one source mirroring to up to `capacity` receivers"""
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    if ttl_task_queue.full:
+        return shed("group", "capacity", ttl_task_queue.next_expiry() or 0)
+    wait = ip_limiter.acquire(client_ip(request))
+    if wait:
+        return shed("group", "ip", wait)
+    try:
+        group = decode(GroupInitialize, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    return await start_pairing("group", group.source, group.capacity)
+
+
+@csrf_exempt
+@instrumented
+async def group_join(
+    request, permitted_methods=["OPTIONS", "POST"]
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    """Add a receiver to a group pairing, at a cost independent of its size"""
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    try:
+        member = decode(PairComplete, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    if token_rejected(member.token) or not await cache_handler.pairing_exists(
+        member.token
+    ):
+        return token_not_found()
+    if await cache_handler.device_exists(str(member.device.deviceId)):
+        return HttpResponse(
+            content=DEVICE_PAIRED,
+            status=409,
+            content_type="application/json",
+        )
+    receivers = await cache_handler.join_group(member.token, member.device)
+    if not receivers:
+        return HttpResponse(
+            content=NOT_OPEN if receivers is None else GROUP_FULL,
+            status=409,
+            content_type="application/json",
+        )
+    return HttpResponse(
+        content=orjson.dumps({"token": member.token, "receivers": receivers}),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def group_leave(
+    request, permitted_methods=["OPTIONS", "POST"]
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    try:
+        member = decode(PairComplete, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    if token_rejected(member.token):
+        return token_not_found()
+    deviceId = str(member.device.deviceId)
+    if member.token not in await cache_handler.device_pairings(deviceId):
+        return HttpResponseForbidden(
+            content=NOT_IN_PAIRING,
+            content_type="application/json",
+        )
+    if not await cache_handler.leave_group(member.token, deviceId):
+        return HttpResponse(
+            content=GROUP_ONLY,
+            status=409,
+            content_type="application/json",
+        )
+    return HttpResponse(
+        content=encode(member.device),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def group_available(
+    request, permitted_methods=["OPTIONS", "PUT"]
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    """Set a group member's availability without touching the other members"""
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    try:
+        member = decode(PairComplete, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    if token_rejected(member.token):
+        return token_not_found()
+    if member.token not in await cache_handler.device_pairings(
+        str(member.device.deviceId)
+    ):
+        return HttpResponseForbidden(
+            content=NOT_IN_PAIRING,
+            content_type="application/json",
+        )
+    if not await cache_handler.set_member_available(member.token, member.device):
+        return HttpResponse(
+            content=GROUP_ONLY,
+            status=409,
+            content_type="application/json",
+        )
+    return HttpResponse(
+        content=encode(member.device),
+        content_type="application/json",
+    )
+
+
+@instrumented
 async def get_remaining_ttl(request) -> HttpResponse:
     if request.method not in ["OPTIONS", "GET"]:
         return HttpResponseNotAllowed(permitted_methods=["OPTIONS", "GET"])
@@ -162,48 +454,358 @@ async def get_remaining_ttl(request) -> HttpResponse:
         token = request.GET.get("token")
     except Exception:
         return HttpResponseBadRequest(
-            content=orjson.dumps({"reason": "No `token` query parameter found"}),
+            content=reason("No `token` query parameter found"),
             content_type="application/json",
         )
+    ttl = remaining_ttl(token)
+    if not ttl:
+        return token_not_found()
+    return HttpResponse(
+        content=pair_reply(token, ttl),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def pairing_batch_initialize(
+    request, permitted_methods=["OPTIONS", "POST"]
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    """One pairing for each device, created with one batch of cache writes.
+    The whole batch is admitted or shed together and costs one IP token
+    """
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    if ttl_task_queue.full:
+        return shed("batch_initialize", "capacity", ttl_task_queue.next_expiry() or 0)
+    wait = ip_limiter.acquire(client_ip(request))
+    if wait:
+        return shed("batch_initialize", "ip", wait)
     try:
-        remaining_ttl = ttl_task_queue.get_task_state(token).remaining_ttl
+        batch = decode(BatchInitialize, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    devices = {str(device.deviceId): device for device in batch.devices}
+    paired = await cache_handler.paired_devices(list(devices))
+    fresh = [device for deviceId, device in devices.items() if deviceId not in paired]
+    if not ttl_task_queue.fits(len(fresh)):
+        return shed("batch_initialize", "capacity", ttl_task_queue.next_expiry() or 0)
+    pairs = [Pair() for _ in fresh]
+    pairInners = [
+        PairInner(**pair.model_dump(), openToJoin=True, nodes=[device])
+        for pair, device in zip(pairs, fresh)
+    ]
+    if pairs:
+        ttl_task_queue.reserved += len(pairs)
+        try:
+            await cache_handler.set_pairings(pairInners)
+        finally:
+            ttl_task_queue.reserved -= len(pairs)
+        await ttl_task_queue.add_tasks(pairs)
+    return HttpResponse(
+        content=encode(
+            BatchPairings(
+                pairings=pairInners,
+                conflicts=[devices[deviceId].deviceId for deviceId in paired],
+            )
+        ),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def pairing_batch_complete(
+    request, permitted_methods=["OPTIONS", "POST"]
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    """Join many devices to one pairing, closing it unless `openToJoin`"""
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    try:
+        batch = decode(BatchComplete, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    if token_rejected(batch.token):
+        return token_not_found()
+    pair = await cache_handler.find_pairing(batch.token)
+    if pair is None:
+        return token_not_found()
+    devices = {str(device.deviceId): device for device in batch.devices}
+    paired = await cache_handler.paired_devices(list(devices))
+    if pair.capacity:
         return HttpResponse(
-            content=Pair(token=token, ttl=remaining_ttl).model_dump_json(),
+            content=JOIN_GROUP,
+            status=409,
             content_type="application/json",
         )
-    except KeyError:
-        return HttpResponseNotFound(
-            content=orjson.dumps({"reason": "Pairing token not found"}),
+    if not pair.openToJoin:
+        return HttpResponse(
+            content=NOT_OPEN,
+            status=409,
+            content_type="application/json",
+        )
+    try:
+        joined = await cache_handler.update_pairing_devices(
+            batch.token,
+            [device for deviceId, device in devices.items() if deviceId not in paired],
+            openToJoin=batch.openToJoin,
+        )
+    except PairingContention:
+        return contended()
+    if joined is None:
+        return await join_refused(batch.token)
+    return HttpResponse(
+        content=encode(
+            BatchJoined(
+                pairing=joined,
+                conflicts=[devices[deviceId].deviceId for deviceId in paired],
+            )
+        ),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def pairing_batch_remaining(
+    request, permitted_methods=["OPTIONS", "POST"]
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    try:
+        batch = decode(BatchTokens, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    pairings, missing = list(), list()
+    for token in batch.tokens:
+        ttl = remaining_ttl(token)
+        if ttl:
+            pairings.append({"token": token, "ttl": ttl})
+        else:
+            missing.append(token)
+    return HttpResponse(
+        content=orjson.dumps({"pairings": pairings, "missing": missing}),
+        content_type="application/json",
+    )
+
+
+@instrumented
+async def pairing_events(
+    request,
+) -> (
+    StreamingHttpResponse
+    | HttpResponseBadRequest
+    | HttpResponseNotFound
+    | HttpResponseNotAllowed
+):
+    if request.method not in ["GET"]:
+        return HttpResponseNotAllowed(permitted_methods=["GET"])
+    try:
+        token = EventsQuery.model_validate(request.GET.dict()).token
+    except ValidationError as ve:
+        return invalid_body(ve)
+    if token_rejected(token) or not await cache_handler.pairing_exists(token):
+        return token_not_found()
+    return StreamingHttpResponse(
+        event_broker.stream(token),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@instrumented
+async def pairing_wait(
+    request,
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotFound:
+    if request.method not in ["OPTIONS", "GET"]:
+        return HttpResponseNotAllowed(permitted_methods=["OPTIONS", "GET"])
+    try:
+        token = EventsQuery.model_validate(request.GET.dict()).token
+    except ValidationError as ve:
+        return invalid_body(ve)
+    try:
+        version = int(request.GET.get("version", 0))
+        timeout = min(
+            float(request.GET.get("timeout", LONG_POLL_SECONDS)), LONG_POLL_SECONDS
+        )
+    except ValueError:
+        return HttpResponseBadRequest(
+            content=reason("`version` and `timeout` must be numbers"),
             content_type="application/json",
         )
+    if token_rejected(token) or not await cache_handler.pairing_exists(token):
+        return token_not_found()
+    change = await event_broker.wait(token, version, max(0.0, timeout))
+    return HttpResponse(
+        content=encode(change),
+        content_type="application/json",
+    )
 
 
-def device_toggle(
+@csrf_exempt
+@instrumented
+async def device_toggle(
     request, permitted_methods=["OPTIONS", "PUT"]
 ) -> HttpResponse | HttpResponseNotAllowed | HttpResponseBadRequest:
+    """Flip a device's availability in every pairing it is in"""
     if request.method not in permitted_methods:
         return HttpResponseNotAllowed(permitted_methods=permitted_methods)
     try:
-        deviceId = DeviceId(**orjson.loads(request.body))
+        deviceId = decode(DeviceId, request.body)
     except ValidationError as ve:
-        return HttpResponseBadRequest(
-            content=ve.json(include_input=False, include_url=False)
+        return invalid_body(ve)
+    available = await cache_handler.toggle_device(str(deviceId.deviceId))
+    if available is None:
+        return HttpResponseNotFound(
+            content=DEVICE_NOT_FOUND,
+            content_type="application/json",
         )
-    except orjson.JSONDecodeError as je:
-        return HttpResponseBadRequest(
-            content=orjson.dumps({"reason": je.msg}),
+    return HttpResponse(
+        content=encode(Device(deviceId=deviceId.deviceId, available=available)),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def device_remove(
+    request, permitted_methods=["OPTIONS", "POST"]
+) -> HttpResponse | HttpResponseNotAllowed | HttpResponseBadRequest:
+    """Take a device out of every pairing it is in"""
+    if request.method not in permitted_methods:
+        return HttpResponseNotAllowed(permitted_methods=permitted_methods)
+    try:
+        deviceId = decode(DeviceId, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    if not await cache_handler.device_exists(str(deviceId.deviceId)):
+        return HttpResponseNotFound(
+            content=DEVICE_NOT_FOUND,
+            content_type="application/json",
+        )
+    pairings = await cache_handler.remove_device(str(deviceId.deviceId))
+    return HttpResponse(
+        content=orjson.dumps({"deviceId": deviceId.deviceId, "pairings": pairings}),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def playback_start(
+    request,
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    if request.method not in ["OPTIONS", "POST"]:
+        return HttpResponseNotAllowed(permitted_methods=["OPTIONS", "POST"])
+    try:
+        info = decode(PlaybackInfo, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    if token_rejected(info.pairToken):
+        return token_not_found()
+    if info.pairToken not in await cache_handler.device_pairings(
+        str(info.node.deviceId)
+    ):
+        return HttpResponseForbidden(
+            content=NOT_IN_PAIRING,
             content_type="application/json",
         )
-    deviceId = str(deviceId.deviceId)
-    if deviceId not in cache_handler.deviceIndex.keys():
+    pair = await cache_handler.find_pairing(info.pairToken)
+    if pair is None:
+        return token_not_found()
+    mirror = Mirror(
+        pairToken=info.pairToken,
+        nodeSource=info.node,
+        nodeDest=[node for node in pair.nodes if node.deviceId != info.node.deviceId],
+        shareUrl=info.shareUrl,
+        platformArgs=info.platformArgs,
+    )
+    playback_broker.start(mirror)
+    return HttpResponse(
+        content=encode(mirror),
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+@instrumented
+async def playback_command(
+    request,
+) -> HttpResponse | HttpResponseBadRequest | HttpResponseNotAllowed:
+    if request.method not in ["OPTIONS", "POST"]:
+        return HttpResponseNotAllowed(permitted_methods=["OPTIONS", "POST"])
+    try:
+        command = decode(PlaybackCommand, request.body)
+    except ValidationError as ve:
+        return invalid_body(ve)
+    # The mirror state lives in this process, so commands need no cache trip
+    source = playback_broker.source(command.pairToken)
+    if source is None:
         return HttpResponseNotFound(
-            content=orjson.dumps({"reason": "Device id not found"}),
+            content=NO_MIRROR,
             content_type="application/json",
         )
-    cache_handler.remove_device(deviceId)
-    return HttpResponseBadRequest(
-        content=orjson.dumps({"reason": "Not implemented"}),
+    if source != str(command.node.deviceId):
+        return HttpResponseForbidden(
+            content=NOT_SOURCE,
+            content_type="application/json",
+        )
+    event = playback_broker.command(
+        command.pairToken, command.action, command.position, command.at
+    )
+    return HttpResponse(
+        content=encode(event),
+        content_type="application/json",
+    )
+
+
+@instrumented
+async def clock(request) -> HttpResponse | HttpResponseNotAllowed:
+    """NTP-style time sample: echoes the client's `t0` with the server's
+    receive and send times in epoch milliseconds. Clients take several over
+    one kept-alive connection and estimate their offset from the fastest
+    """
+    received = server_time_ms()
+    if request.method not in ["GET"]:
+        return HttpResponseNotAllowed(permitted_methods=["GET"])
+    try:
+        t0 = float(request.GET.get("t0", 0))
+    except ValueError:
+        return HttpResponseBadRequest(
+            content=reason("`t0` must be a number"),
+            content_type="application/json",
+        )
+    return HttpResponse(
+        content=orjson.dumps({"t0": t0, "t1": received, "t2": server_time_ms()}),
         content_type="application/json",
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+@instrumented
+async def playback_events(
+    request,
+) -> (
+    StreamingHttpResponse
+    | HttpResponseBadRequest
+    | HttpResponseNotFound
+    | HttpResponseNotAllowed
+):
+    if request.method not in ["GET"]:
+        return HttpResponseNotAllowed(permitted_methods=["GET"])
+    try:
+        query = PlaybackEventsQuery.model_validate(request.GET.dict())
+    except ValidationError as ve:
+        return invalid_body(ve)
+    token, deviceId = query.token, str(query.deviceId)
+    if token_rejected(token) or token not in await cache_handler.device_pairings(
+        deviceId
+    ):
+        return token_not_found()
+    return StreamingHttpResponse(
+        playback_broker.stream(token, deviceId),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
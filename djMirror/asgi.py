@@ -7,10 +7,182 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
+import asyncio
+import logging
 import os
+import signal
+from contextlib import suppress
+from typing import Awaitable, Callable, Dict, List
 
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
 from django.core.asgi import get_asgi_application
+from django.core.exceptions import RequestAborted
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+from django.core.handlers.exception import response_for_exception
+from django.urls import URLPattern, reverse
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djMirror.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from core.pairing.urls import jsonResponsePatterns  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+DRAIN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+class Lifespan:
+    """ASGI lifespan of the installed apps' background work.
+
+    Startup awaits the `startup` coroutine of every AppConfig defining one, in
+    INSTALLED_APPS order. Shutdown first awaits every `drain`, which ends push
+    streams and stops background work, gives in-flight requests `grace`
+    seconds, then awaits each `shutdown` in reverse order.
+
+    Servers send the shutdown event only once their connections are closed,
+    which open event streams would hold off, so SIGINT and SIGTERM start the
+    drain early, ahead of the server's own handlers
+    """
+
+    def __init__(self, idle: asyncio.Event, grace: float):
+        self.idle = idle
+        self.grace = grace
+        self._draining: asyncio.Task | None = None
+
+    @staticmethod
+    def _hooks(name: str) -> List[Callable[[], Awaitable[None]]]:
+        return [
+            getattr(config, name)
+            for config in apps.get_app_configs()
+            if hasattr(config, name)
+        ]
+
+    async def __call__(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.exception("Lifespan startup failed")
+                    await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self) -> None:
+        for hook in self._hooks("startup"):
+            await hook()
+        self._watch_signals()
+
+    def drain(self) -> asyncio.Task:
+        if self._draining is None:
+            self._draining = asyncio.create_task(self._drain())
+        return self._draining
+
+    async def _drain(self) -> None:
+        for hook in self._hooks("drain"):
+            try:
+                await hook()
+            except Exception:
+                logger.exception(f"Drain of {hook.__self__.name} failed")
+
+    async def shutdown(self) -> None:
+        await self.drain()
+        try:
+            await asyncio.wait_for(self.idle.wait(), self.grace)
+        except TimeoutError:
+            logger.error(f"Requests still in flight after {self.grace}s of shutdown")
+        for hook in reversed(self._hooks("shutdown")):
+            try:
+                await hook()
+            except Exception:
+                logger.exception(f"Shutdown of {hook.__self__.name} failed")
+
+    def _watch_signals(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in DRAIN_SIGNALS:
+            previous = signal.getsignal(sig)
+            # Only chain onto servers that handle the signal themselves
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                loop.call_soon_threadsafe(self.drain)
+                previous(signum, frame)
+
+            try:
+                signal.signal(sig, handler)
+            except ValueError:
+                # Signal handlers can only be installed from the main thread
+                return
+
+
+class JsonApiRouter:
+    """Dispatch `jsonResponsePatterns` straight to their async views.
+
+    The pairing API is csrf exempt and uses no sessions, auth or messages, so
+    it skips the middleware chain and URL resolver; every other path, including
+    PairView, static files and the admin, goes through the full Django stack
+    """
+
+    def __init__(self, django: ASGIHandler, patterns: List[URLPattern]):
+        self.django = django
+        self.routes: Dict[str, Callable] = {
+            reverse(pattern.name): pattern.callback for pattern in patterns
+        }
+        self.requests: int = 0
+        self.idle: asyncio.Event = asyncio.Event()
+        self.idle.set()
+        self.lifespan = Lifespan(self.idle, settings.SHUTDOWN_GRACE_SECONDS)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        self.requests += 1
+        self.idle.clear()
+        try:
+            await self.dispatch(scope, receive, send)
+        finally:
+            self.requests -= 1
+            if not self.requests:
+                self.idle.set()
+
+    async def dispatch(self, scope, receive, send) -> None:
+        view = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if view is None:
+            return await self.django(scope, receive, send)
+        try:
+            body_file = await self.django.read_body(receive)
+        except RequestAborted:
+            return
+        request = ASGIRequest(scope, body_file)
+        # Same disconnect handling as Django so long-lived streams get cancelled
+        tasks = [
+            asyncio.create_task(self.django.listen_for_disconnect(receive)),
+            asyncio.create_task(self.respond(view, request, send)),
+        ]
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        [task.cancel() for task in tasks]
+        try:
+            for task in tasks:
+                with suppress(asyncio.CancelledError, RequestAborted):
+                    await task
+        finally:
+            body_file.close()
+
+    async def respond(self, view: Callable, request: ASGIRequest, send) -> None:
+        try:
+            response = await view(request)
+        except Exception as e:
+            response = await sync_to_async(response_for_exception)(request, e)
+        await self.django.send_response(response, send)
+
+
+application = JsonApiRouter(django_application, jsonResponsePatterns)
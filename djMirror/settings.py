@@ -30,6 +30,7 @@ DJANGO_APPS = [
 THIRD_PARTY_APPS = []
 
 CORE_APPS = [
+    "core.metrics",
     "core.pairing",
     "core.cacheManager",
 ]
@@ -115,4 +116,70 @@ STORAGES = {
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# "local" keeps pairing indexes in-process; "shared" makes memcached the
+# source of truth so several workers or hosts can serve the same pairings
+PAIRING_INDEX_MODE = environ.get("PAIRING_INDEX_MODE", "local")
+PAIRING_INDEX_READ_CACHE_TTL = float(environ.get("PAIRING_INDEX_READ_CACHE_TTL", 0))
+# Decoded pairings kept per process; shared mode trusts them for reads only
+# within PAIRING_INDEX_READ_CACHE_TTL. 0 disables the cache
+PAIRING_OBJECT_CACHE_SIZE = int(environ.get("PAIRING_OBJECT_CACHE_SIZE", 4096))
+
+# Comma separated host:port list; keys are spread over them on a ketama ring
+MEMCACHED_SERVERS = [
+    (host, int(port))
+    for host, port in (
+        server.strip().rsplit(":", 1)
+        for server in environ.get("MEMCACHED_SERVERS", "127.0.0.1:11211").split(",")
+    )
+]
+MEMCACHED_POOL_SIZE = int(environ.get("MEMCACHED_POOL_SIZE", 16))
+MEMCACHED_CONNECT_TIMEOUT = float(environ.get("MEMCACHED_CONNECT_TIMEOUT", 1))
+MEMCACHED_TIMEOUT = float(environ.get("MEMCACHED_TIMEOUT", 1))
+# Consecutive failures before a node leaves the ring, and how often nodes are
+# probed so ejected ones can rejoin
+MEMCACHED_FAILURE_LIMIT = int(environ.get("MEMCACHED_FAILURE_LIMIT", 2))
+MEMCACHED_HEALTH_INTERVAL = float(environ.get("MEMCACHED_HEALTH_INTERVAL", 5))
+
+# Live pairings of this process are written here every
+# PAIRING_SNAPSHOT_INTERVAL seconds and on exit, and restored on startup.
+# Each worker process needs its own path, so snapshots are off (empty) unless
+# set per worker, e.g. pairings-0.snapshot, pairings-1.snapshot
+PAIRING_SNAPSHOT_PATH = environ.get("PAIRING_SNAPSHOT_PATH", "")
+PAIRING_SNAPSHOT_INTERVAL = float(environ.get("PAIRING_SNAPSHOT_INTERVAL", 30))
+
+# Seconds in-flight requests get to finish on shutdown before the memcached
+# clients are closed; set uvicorn's --timeout-graceful-shutdown to match
+SHUTDOWN_GRACE_SECONDS = float(environ.get("SHUTDOWN_GRACE_SECONDS", 10))
+
+# Issue HMAC-signed tokens carrying their issue time and ttl, so expired or
+# forged tokens are refused without touching the indexes
+PAIRING_SIGNED_TOKENS = environ.get("PAIRING_SIGNED_TOKENS", "0") == "1"
+
+# Admission control. Initialize answers 503 once PAIRING_CAPACITY pairings
+# are live in this process (0 is unbounded). Initialize and refresh are rate
+# limited per device and per client address with token buckets refilling
+# RATE tokens per second up to BURST (RATE 0 disables); behind a proxy run
+# uvicorn with --proxy-headers so the address is the client's
+PAIRING_CAPACITY = int(environ.get("PAIRING_CAPACITY", 100_000))
+PAIRING_DEVICE_RATE = float(environ.get("PAIRING_DEVICE_RATE", 0.2))
+PAIRING_DEVICE_BURST = float(environ.get("PAIRING_DEVICE_BURST", 5))
+PAIRING_IP_RATE = float(environ.get("PAIRING_IP_RATE", 5))
+PAIRING_IP_BURST = float(environ.get("PAIRING_IP_BURST", 50))
+
+# Most devices or tokens one /pairing/batch/ request may carry; a batch
+# initialize is admitted as a whole and costs a single IP token
+PAIRING_BATCH_LIMIT = int(environ.get("PAIRING_BATCH_LIMIT", 500))
+
+# Receivers a /pairing/group/ pairing admits unless the request sets its own
+# capacity, and the most it may ask for
+PAIRING_GROUP_CAPACITY = int(environ.get("PAIRING_GROUP_CAPACITY", 64))
+PAIRING_GROUP_MAX_CAPACITY = int(environ.get("PAIRING_GROUP_MAX_CAPACITY", 1024))
+
+# Playback commands sent without a start time take effect this many
+# milliseconds after the server stamps them; keep it above the delivery p99
+PLAYBACK_LEAD_MS = float(environ.get("PLAYBACK_LEAD_MS", 150))
+
+# Latency histograms exposed on /metrics/; off removes the timing wrappers
+METRICS_ENABLED = environ.get("METRICS_ENABLED", "1") == "1"
+
 ALLOWED_HOSTS = ["*"]
@@ -6,4 +6,5 @@ from django.urls import include, path
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("pairing/", include("core.pairing.urls")),
+    path("metrics/", include("core.metrics.urls")),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
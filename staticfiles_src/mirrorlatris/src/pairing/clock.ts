@@ -0,0 +1,60 @@
+import { BASE_URL } from '@/pairing/utils'
+import type { ClockSample } from '@/pairing/types.ts'
+
+// Fraction of the samples, lowest round trip first, the offset is taken from;
+// the same estimate as core/pairing/clock.py
+const BEST_SAMPLES = 0.25
+const SYNC_SAMPLES = 8
+
+// Server clock minus this device's clock, in milliseconds
+let offsetMs = 0
+
+// Server clock minus client clock, assuming symmetric network delays
+export function sampleOffset(sample: ClockSample): number {
+  return (sample.t1 - sample.t0 + (sample.t2 - sample.t3)) / 2
+}
+
+export function sampleRtt(sample: ClockSample): number {
+  return sample.t3 - sample.t0 - (sample.t2 - sample.t1)
+}
+
+// Median offset of the lowest-RTT samples: queueing delay inflates the round
+// trip and is rarely symmetric, so the fastest exchanges err the least
+export function estimateOffset(samples: ClockSample[]): number {
+  const best = [...samples]
+    .sort((a, b) => sampleRtt(a) - sampleRtt(b))
+    .slice(0, Math.max(1, Math.floor(samples.length * BEST_SAMPLES)))
+  const offsets = best.map(sampleOffset).sort((a, b) => a - b)
+  const middle = Math.floor(offsets.length / 2)
+  return offsets.length % 2 ? offsets[middle] : (offsets[middle - 1] + offsets[middle]) / 2
+}
+
+// Sample /pairing/clock/ one exchange at a time, so they share a kept-alive
+// connection, and keep the estimated offset for serverNow()
+export async function syncClock(count: number = SYNC_SAMPLES): Promise<number> {
+  const samples: ClockSample[] = []
+  for (let i = 0; i < count; i++) {
+    const t0 = Date.now()
+    const response = await fetch(`${BASE_URL}/pairing/clock/?t0=${t0}`, { cache: 'no-store' })
+    const t3 = Date.now()
+    if (!response.ok) {
+      continue
+    }
+    const reply = (await response.json()) as ClockSample
+    samples.push({ t0, t1: reply.t1, t2: reply.t2, t3 })
+  }
+  if (samples.length) {
+    offsetMs = estimateOffset(samples)
+  }
+  return offsetMs
+}
+
+// Epoch milliseconds on the server clock, the time base of scheduled playback
+export function serverNow(): number {
+  return Date.now() + offsetMs
+}
+
+// Milliseconds from now until server time `at` on this device's clock
+export function delayUntil(at: number): number {
+  return Math.max(0, at - serverNow())
+}
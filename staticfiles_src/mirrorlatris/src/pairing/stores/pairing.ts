@@ -3,10 +3,36 @@ import { ref, computed } from 'vue'
 import { v4 as uuidv4 } from 'uuid'
 
 import { BASE_URL } from "@/pairing/utils"
-import type { PairingState, PairingObject, PairingComplete, Device } from '@/pairing/types.ts'
+import { delayUntil, serverNow, syncClock } from '@/pairing/clock'
+import type {
+  PairingState,
+  PairingObject,
+  PairingComplete,
+  PairingEvent,
+  PlaybackAction,
+  PlaybackCommand,
+  PlaybackEvent,
+  Device,
+} from '@/pairing/types.ts'
 
 const DEVICE_ID_KEY = 'deviceId'
 const PAIR_TOKEN_KEY = 'pairtoken'
+const PAIRING_EVENTS: PairingEvent['event'][] = [
+  'ttl',
+  'joined',
+  'refresh',
+  'cancelled',
+  'expired',
+  'member_joined',
+  'member_left',
+  'member_updated',
+]
+// The server ends the stream after these, so the pairing is over
+const FINAL_EVENTS: PairingEvent['event'][] = ['cancelled', 'expired']
+const PLAYBACK_EVENTS: PlaybackEvent['event'][] = ['load', 'play', 'pause', 'seek', 'stop']
+// Commands take effect this long after they are sent, so every device in the
+// pairing has them by then; the server's PLAYBACK_LEAD_MS
+const PLAYBACK_LEAD_MS = 150
 
 export const usePairingStore = defineStore('pairing', () => {
   const state = ref<PairingState>({
@@ -30,6 +56,86 @@ export const usePairingStore = defineStore('pairing', () => {
     return obj.ttl
   }
 
+  function subscribeEvents(onEvent: (event: PairingEvent) => void): EventSource | null {
+    if (!state.value.currentPairing) {
+      return null
+    }
+    const source = new EventSource(
+      `${BASE_URL}/pairing/events/?token=${state.value.currentPairing.token}`,
+    )
+    for (const name of PAIRING_EVENTS) {
+      source.addEventListener(name, (message: MessageEvent) => {
+        const event = JSON.parse(message.data) as PairingEvent
+        if (event.event === 'refresh') {
+          state.value.currentPairing = { token: event.token, ttl: event.ttl }
+          localStorage.setItem(PAIR_TOKEN_KEY, event.token)
+        }
+        if (FINAL_EVENTS.includes(event.event)) {
+          state.value.currentPairing = null
+          source.close()
+        }
+        onEvent(event)
+      })
+    }
+    return source
+  }
+
+  // Playback of the current pairing, each change handed over when its server
+  // time `at` comes round on this device's clock
+  function subscribePlayback(onEvent: (event: PlaybackEvent) => void): EventSource | null {
+    if (!state.value.currentPairing) {
+      return null
+    }
+    void syncClock()
+    const source = new EventSource(
+      `${BASE_URL}/pairing/playback/events/?token=${state.value.currentPairing.token}` +
+        `&deviceId=${state.value.deviceId}`,
+    )
+    for (const name of PLAYBACK_EVENTS) {
+      source.addEventListener(name, (message: MessageEvent) => {
+        const event = JSON.parse(message.data) as PlaybackEvent
+        setTimeout(() => onEvent(event), delayUntil(event.at))
+      })
+    }
+    return source
+  }
+
+  async function sendPlaybackCommand(
+    action: PlaybackAction,
+    position: number,
+  ): Promise<PlaybackEvent | null> {
+    if (!state.value.currentPairing) {
+      return null
+    }
+    const command = {
+      pairToken: state.value.currentPairing.token,
+      node: { deviceId: state.value.deviceId, available: true },
+      action: action,
+      position: position,
+      // On the server clock, so every device starts together whatever its own
+      at: serverNow() + PLAYBACK_LEAD_MS,
+    } as PlaybackCommand
+    try {
+      let headers = new Headers()
+      headers.append('Content-Type', 'application/json')
+      const csrfToken = getCookie('csrftoken')
+      csrfToken ? headers.append('X-CSRFToken', csrfToken) : headers.append('X-CSRFToken', '')
+
+      const response = await fetch(`${BASE_URL}/pairing/playback/`, {
+        method: 'POST',
+        headers: headers,
+        body: JSON.stringify(command),
+      })
+      if (!response.ok) {
+        throw new Error(`Playback command failed ${response.statusText}`)
+      }
+      return (await response.json()) as PlaybackEvent
+    } catch (error: any) {
+      console.error(error)
+      return null
+    }
+  }
+
   async function initiatePairing(): Promise<void> {
     try {
       let headers = new Headers()
@@ -159,6 +265,9 @@ export const usePairingStore = defineStore('pairing', () => {
     state,
     isPaired,
     getRemainingTTL,
+    subscribeEvents,
+    subscribePlayback,
+    sendPlaybackCommand,
     initiatePairing,
     completePairing,
     refreshPairing,
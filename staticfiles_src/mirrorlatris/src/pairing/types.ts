@@ -19,3 +19,52 @@ export interface PairingComplete {
   token: string
   device: Device
 }
+
+export interface PairingEvent {
+  event:
+    | 'ttl'
+    | 'joined'
+    | 'refresh'
+    | 'cancelled'
+    | 'expired'
+    | 'member_joined'
+    | 'member_left'
+    | 'member_updated'
+  token: string
+  ttl: number
+  version: number
+  nodes: Device[]
+}
+
+// One NTP-style exchange with /pairing/clock/ in epoch milliseconds: client
+// send (t0), server receive (t1), server send (t2) and client receive (t3)
+export interface ClockSample {
+  t0: number
+  t1: number
+  t2: number
+  t3: number
+}
+
+export type PlaybackAction = 'play' | 'pause' | 'seek' | 'stop'
+
+export interface PlaybackCommand {
+  pairToken: string
+  node: Device
+  action: PlaybackAction
+  position: number
+  // Server clock epoch milliseconds the action takes effect at
+  at?: number
+}
+
+// The whole playback state after a change: at server time `at` playback is
+// at `position` seconds
+export interface PlaybackEvent {
+  event: 'load' | PlaybackAction
+  pairToken: string
+  shareUrl: string
+  position: number
+  at: number
+  playing: boolean
+  seq: number
+  platformArgs: Record<string, string>
+}
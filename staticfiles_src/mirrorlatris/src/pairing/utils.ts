@@ -5,13 +5,35 @@ import qrlib from './components/PairingQR'
 export const BASE_URL = 'http://127.0.0.1:8000'
 
 export let remainingTTL = ref<number>(1000)
+let pairingEvents: EventSource | null = null
+let countdown: ReturnType<typeof setInterval> | undefined
+
+export function followPairing(): void {
+  const pairingStore = usePairingStore()
+
+  pairingEvents?.close()
+  clearInterval(countdown)
+  pairingEvents = pairingStore.subscribeEvents((event) => {
+    remainingTTL.value = event.ttl
+  })
+  if (!pairingEvents) {
+    return
+  }
+  countdown = setInterval(() => {
+    if (remainingTTL.value > 0) {
+      remainingTTL.value -= 1
+    }
+  }, 1000)
+}
+
 export async function refreshPairing(): Promise<void> {
   const pairingStore = usePairingStore()
 
   await pairingStore.refreshPairing()
   await qrlib.generateQRCode(pairingStore.state.currentPairing)
-  await new Promise((r) => setTimeout(r, 1000))
-  remainingTTL.value = await pairingStore.getRemainingTTL()
+  if (pairingStore.state.currentPairing) {
+    remainingTTL.value = pairingStore.state.currentPairing.ttl
+  }
 }
 
 export function handleAvailabilityToggle(event: Event): void {